@@ -1,5 +1,10 @@
+import base64
+import hashlib
+import json
+import os
 import time
 from distutils.version import LooseVersion
+from typing import Any, Dict  # noqa: F401
 from urllib.parse import urljoin, urlparse
 
 import jenkins
@@ -7,8 +12,12 @@ import requests
 from charmhelpers.core import hookenv, unitdata
 from charmhelpers.core.decorators import retry_on_exception
 from charmhelpers.core.hookenv import ERROR
+from charms.layer.jenkins import paths
 from charms.layer.jenkins.credentials import Credentials
 from charms.layer.jenkins.packages import Packages
+from charms.layer.jenkins.readiness import Readiness
+
+DEFAULT_UPDATE_CENTER = "https://updates.jenkins.io/stable/update-center.json"
 
 RETRIABLE = (
     requests.exceptions.RequestException,
@@ -17,57 +26,330 @@ RETRIABLE = (
     jenkins.JenkinsException,  # type: ignore
 )
 
+# Groovy scripts are written as bodies of a closure taking a "params" map and
+# returning a JSON-serializable value, see render_script().
+
 GET_LEGACY_TOKEN_SCRIPT = """
-user = hudson.model.User.get('{}')
-prop = user.getProperty(jenkins.security.ApiTokenProperty.class)
-println(prop.getApiToken())
+def user = hudson.model.User.get(params.username)
+def prop = user.getProperty(jenkins.security.ApiTokenProperty.class)
+return prop.getApiToken()
 """
 
 GET_NEW_TOKEN_SCRIPT = """
-user = hudson.model.User.get('{}')
-prop = user.getProperty(jenkins.security.ApiTokenProperty.class)
-result = prop.tokenStore.generateNewToken("token-created-by-script")
+def user = hudson.model.User.get(params.username)
+def prop = user.getProperty(jenkins.security.ApiTokenProperty.class)
+def result = prop.tokenStore.generateNewToken("token-created-by-script")
 user.save()
-println(result.plainValue)
+return result.plainValue
 """
 
-# flake8: noqa
 UPDATE_PASSWORD_SCRIPT = """
-user = hudson.model.User.get('{username}')
-property = hudson.security.HudsonPrivateSecurityRealm.Details.fromPlainPassword('{password}')
-user.addProperty(property)
+def user = hudson.model.User.get(params.username)
+user.addProperty(hudson.security.HudsonPrivateSecurityRealm.Details.fromPlainPassword(params.password))
+return null
 """
 
-# flake8: noqa
 SET_UPDATE_CENTER_SCRIPT = """
-Jenkins.instance.pluginManager.doSiteConfigure('{url}')
+Jenkins.instance.pluginManager.doSiteConfigure(params.url)
+return null
 """
 
-CONFIGURE_PROXY_NO_PROXY_WITH_AUTH_SCRIPT = """
-proxy = new ProxyConfiguration('{hostname}', {port}, '{username}', '{password}', '{no_proxy_hosts}')
-proxy.save()
+SET_URL_SCRIPT = """
+def location = jenkins.model.JenkinsLocationConfiguration.get()
+location.setUrl(params.url ?: null)
+location.save()
+return null
 """
 
-CONFIGURE_PROXY_WITH_AUTH_SCRIPT = """
-proxy = new ProxyConfiguration('{hostname}', {port}, '{username}', '{password}')
+# Setting Jenkins.proxy applies the settings live, without a restart.
+CONFIGURE_PROXY_SCRIPT = """
+def proxy = new ProxyConfiguration(
+  params.hostname, params.port, params.username, params.password, params.noProxyHosts)
+Jenkins.instance.proxy = proxy
 proxy.save()
+return null
 """
 
-CONFIGURE_PROXY_WITHOUT_AUTH_SCRIPT = """
-proxy = new ProxyConfiguration('{hostname}', {port})
-proxy.save()
+DISABLE_PROXY_SCRIPT = """
+Jenkins.instance.proxy = null
+ProxyConfiguration.getXmlFile().delete()
+return null
 """
 
-DISABLE_PROXY_SCRIPT = """
-ProxyConfiguration.getXmlFile().delete();
+GET_PLUGIN_VERSION_SCRIPT = """
+return Jenkins.instance.pluginManager.getPlugin(params.name)?.version
+"""
+
+# Plugin pinning is gone from recent Jenkins versions, hence the respondsTo.
+GET_INSTALLED_PLUGINS_SCRIPT = """
+return Jenkins.instance.pluginManager.plugins.collectEntries { plugin ->
+  [(plugin.shortName): [
+    version: plugin.version,
+    enabled: plugin.isEnabled(),
+    active: plugin.isActive(),
+    pinned: plugin.metaClass.respondsTo(plugin, "isPinned") ? plugin.isPinned() : false,
+    hasUpdate: plugin.hasUpdate(),
+  ]]
+}
+"""
+
+CHECK_UPDATE_CENTER_SCRIPT = """
+Jenkins.instance.updateCenter.sites.each { site ->
+  site.updateDirectlyNow(hudson.model.DownloadService.signatureCheck)
+}
+hudson.model.DownloadService.Downloadable.all().each { downloadable ->
+  downloadable.updateNow()
+}
+return null
+"""
+
+GET_UPDATABLE_PLUGINS_SCRIPT = """
+def updatable = Jenkins.instance.pluginManager.activePlugins.findAll { it.hasUpdate() }
+return updatable.collect { it.shortName }
+"""
+
+UPDATE_PLUGINS_SCRIPT = """
+def updatable = Jenkins.instance.pluginManager.activePlugins.findAll { it.hasUpdate() }
+def plugins = updatable.collect { it.shortName }
+return Jenkins.instance.pluginManager.install(plugins, false).size()
+"""
+
+# offlineSince is in milliseconds since the epoch, null for nodes that are
+# online or were taken offline on purpose, and 0 if they never connected.
+GET_NODES_SCRIPT = """
+return Jenkins.instance.nodes.collectEntries { node ->
+  def computer = node.toComputer()
+  def offlineSince = null
+  if (computer != null && computer.offline && !computer.temporarilyOffline) {
+    offlineSince = computer.offlineCause?.timestamp ?: computer.connectTime
+  }
+  [(node.nodeName): [
+    executors: node.numExecutors,
+    labels: node.labelString,
+    offlineSince: offlineSince,
+  ]]
+}
+"""
+
+UPDATE_NODES_SCRIPT = """
+params.nodes.each { name, spec ->
+  def node = Jenkins.instance.getNode(name)
+  if (node != null) {
+    node.setNumExecutors(spec.executors)
+    node.setLabelString(spec.labels)
+    Jenkins.instance.updateNode(node)
+  }
+}
+return null
+"""
+
+DELETE_NODES_SCRIPT = """
+params.names.each { name ->
+  def node = Jenkins.instance.getNode(name)
+  if (node != null) {
+    Jenkins.instance.removeNode(node)
+  }
+}
+return null
+"""
+
+GET_NODE_SECRET_SCRIPT = """
+return Jenkins.instance.getComputer(params.name).getJnlpMac()
+"""
+
+GET_NODE_SECRETS_SCRIPT = """
+return params.names.collectEntries { name ->
+  def computer = Jenkins.instance.getComputer(name)
+  [(name): computer == null ? null : computer.jnlpMac]
+}
+"""
+
+# Bodies precompiled by the resident helper, see render_helper(). The token
+# scripts are left out, they run before the charm has API credentials.
+HELPER_FUNCTIONS = {
+    "updatePassword": UPDATE_PASSWORD_SCRIPT,
+    "setUpdateCenter": SET_UPDATE_CENTER_SCRIPT,
+    "setUrl": SET_URL_SCRIPT,
+    "configureProxy": CONFIGURE_PROXY_SCRIPT,
+    "disableProxy": DISABLE_PROXY_SCRIPT,
+    "getPluginVersion": GET_PLUGIN_VERSION_SCRIPT,
+    "getInstalledPlugins": GET_INSTALLED_PLUGINS_SCRIPT,
+    "checkUpdateCenter": CHECK_UPDATE_CENTER_SCRIPT,
+    "getUpdatablePlugins": GET_UPDATABLE_PLUGINS_SCRIPT,
+    "updatePlugins": UPDATE_PLUGINS_SCRIPT,
+    "getNodes": GET_NODES_SCRIPT,
+    "updateNodes": UPDATE_NODES_SCRIPT,
+    "deleteNodes": DELETE_NODES_SCRIPT,
+    "getNodeSecret": GET_NODE_SECRET_SCRIPT,
+    "getNodeSecrets": GET_NODE_SECRETS_SCRIPT,
+}
+
+HELPER_FUNCTION_TEMPLATE = """  "{name}": {{ params ->
+{body}
+  }},"""
+
+# Registers the helper's functions as an attribute of the servlet context,
+# which holds arbitrary objects for the lifetime of Jenkins (unlike system
+# properties, expected to be strings), under a key that changes with their
+# content, dropping the ones of other charm revisions.
+HELPER_TEMPLATE = """// Generated by the jenkins charm, changes will be overwritten.
+import hudson.*
+import hudson.model.*
+import jenkins.model.*
+
+def context = Jenkins.instance.servletContext
+def key = "{key}"
+Collections.list(context.attributeNames).findAll {{ it.startsWith("{prefix}") }}.each {{
+  context.removeAttribute(it)
+}}
+context.setAttribute(key, [
+{functions}
+])
 """
 
+HELPER_PREFIX = "jenkins-charm.helper."
+
+# Runs a script body once at startup, then deletes the script.
+INIT_SCRIPT_TEMPLATE = """// Generated by the jenkins charm, deletes itself once run.
+import hudson.*
+import hudson.model.*
+import jenkins.model.*
+
+def body = {{ params ->
+{body}
+}}
+def text = new String("{params}".decodeBase64(), "UTF-8")
+body(new groovy.json.JsonSlurper().parseText(text))
+new File("{path}").delete()
+"""
+
+HELPER_PROBE_SCRIPT = """
+return Jenkins.instance.servletContext.getAttribute(params.key) != null
+"""
+
+# Runs each script body as a closure, binding its parameters from
+# base64-encoded JSON (so no quoting is ever needed), and prints all results
+# as a single JSON list, with failures reported rather than aborting.
+SCRIPT_TEMPLATE = """
+def functions = Jenkins.instance.servletContext.getAttribute("{key}")
+def results = []
+def runBody = {{ body, encoded ->
+  try {{
+    def text = new String(encoded.decodeBase64(), "UTF-8")
+    results << [value: body(new groovy.json.JsonSlurper().parseText(text))]
+  }} catch (Throwable e) {{
+    results << [error: e.toString()]
+  }}
+}}
+{calls}
+println(groovy.json.JsonOutput.toJson(results))
+"""
+
+CALL_TEMPLATE = """runBody({{ params ->
+{body}
+}}, "{params}")"""
+
+RESIDENT_CALL_TEMPLATE = """runBody(functions["{name}"], "{params}")"""
+
+
+class ScriptError(jenkins.JenkinsException):  # type: ignore
+    """Raised when a Groovy script fails or returns unexpected output."""
+
+
+def _render_helper_functions():
+    functions = [
+        HELPER_FUNCTION_TEMPLATE.format(name=name, body=HELPER_FUNCTIONS[name].strip())
+        for name in sorted(HELPER_FUNCTIONS)
+    ]
+    return "\n".join(functions)
+
+
+HELPER_KEY = HELPER_PREFIX + hashlib.sha256(
+    _render_helper_functions().encode("utf-8")
+).hexdigest()[:16]
+
+_HELPER_NAMES = {body: name for name, body in HELPER_FUNCTIONS.items()}
+
+
+def render_helper():
+    """Render the init.groovy.d script registering the helper's functions."""
+    return HELPER_TEMPLATE.format(
+        key=HELPER_KEY, prefix=HELPER_PREFIX, functions=_render_helper_functions()
+    )
+
+
+def render_init_script(body, params, path):
+    """Render an init.groovy.d script running a body once at startup.
+
+    @param path: Where the script will be installed, so it can delete itself.
+    """
+    encoded = base64.b64encode(json.dumps(params, sort_keys=True).encode("utf-8"))
+    return INIT_SCRIPT_TEMPLATE.format(
+        body=body.strip(), params=encoded.decode("ascii"), path=path
+    )
+
+
+def render_script(calls, resident=False):
+    """Render a script running the given bodies, in order, in one go.
+
+    @param calls: A list of (body, params) tuples, params being a dict.
+    @param resident: Whether to call the helper's precompiled functions
+        rather than sending the bodies, which must all be helper functions.
+    """
+    rendered = []
+    for body, params in calls:
+        encoded = base64.b64encode(json.dumps(params, sort_keys=True).encode("utf-8"))
+        encoded = encoded.decode("ascii")
+        if resident:
+            call = RESIDENT_CALL_TEMPLATE.format(name=_HELPER_NAMES[body], params=encoded)
+        else:
+            call = CALL_TEMPLATE.format(body=body.strip(), params=encoded)
+        rendered.append(call)
+    return SCRIPT_TEMPLATE.format(key=HELPER_KEY, calls="\n".join(rendered))
+
+
+def parse_results(output):
+    """Return the values printed by a script from render_script().
+
+    The JSON document is the last line of output, anything before is
+    whatever the bodies printed themselves.
+    """
+    lines = output.strip().splitlines()
+    try:
+        results = json.loads(lines[-1])
+    except (IndexError, ValueError):
+        raise ScriptError("Unexpected script output: %s" % output)
+    for result in results:
+        if "error" in result:
+            raise ScriptError("Script failed: %s" % result["error"])
+    return [result["value"] for result in results]
+
 
 class Api(object):
     """Encapsulate operations on the Jenkins master."""
 
+    # Authenticated clients, keyed by URL. Each hook runs in its own process,
+    # so this lives exactly as long as the hook dispatch: the handshake is done
+    # once and the client's HTTP session keeps its connections alive.
+    _clients = {}  # type: Dict[str, Any]
+
+    # Whether the resident helper is registered, keyed by URL and probed once
+    # per hook dispatch.
+    _helpers = {}  # type: Dict[str, bool]
+
     def __init__(self, packages=None):
-        self._packages = packages or Packages()
+        self._packages_instance = packages
+
+    @property
+    def _packages(self):
+        """The Packages instance, built on first use.
+
+        It's only needed to regenerate the API token, so don't pay for
+        setting it up on every Api() construction.
+        """
+        if self._packages_instance is None:
+            self._packages_instance = Packages()
+        return self._packages_instance
 
     @property
     def url(self):
@@ -91,50 +373,45 @@ class Api(object):
 
         If the user doesn't exist, it will be created.
         """
-        client = self._make_client()
-        client.run_script(UPDATE_PASSWORD_SCRIPT.format(username=username, password=password))
+        self._run_script(UPDATE_PASSWORD_SCRIPT, username=username, password=password)
+
+    def set_url(self, url):
+        """Set the Jenkins URL live, no reload needed."""
+        self._run_script(SET_URL_SCRIPT, url=url)
 
     def get_plugin_version(self, plugin):
         """Get the installed version of a given plugin
 
         If the plugin is not installed returns False
         """
-        client = self._make_client()
-        script = "println(Jenkins.instance.pluginManager.plugins.find{{it.shortName == '{}'}}?.version)".format(
-            plugin
-        )
-        version = client.run_script(script)
-        if version == "null":
-            return False
-        return version
+        return self._run_script(GET_PLUGIN_VERSION_SCRIPT, name=plugin) or False
+
+    def get_installed_plugins(self):
+        """Get the inventory of installed plugins in a single call.
+
+        :returns: Plugin details (version, enabled, active, pinned and
+            hasUpdate) keyed by plugin short name.
+        :rtype: dict
+        """
+        return self._run_script(GET_INSTALLED_PLUGINS_SCRIPT)
 
     def configure_proxy(
         self, hostname=None, port=None, username=None, password=None, no_proxy_hosts=None
     ):
         """Configure (or disable) a system proxy."""
-        client = self._make_client()
-        if hostname and port and no_proxy_hosts:
-            client.run_script(
-                CONFIGURE_PROXY_NO_PROXY_WITH_AUTH_SCRIPT.format(
-                    hostname=hostname,
-                    port=port,
-                    username=username or "",
-                    password=password or "",
-                    no_proxy_hosts=no_proxy_hosts,
-                )
-            )
-        elif username and password and hostname and port:
-            client.run_script(
-                CONFIGURE_PROXY_WITH_AUTH_SCRIPT.format(
-                    hostname=hostname, port=port, username=username, password=password
-                )
-            )
-        elif hostname and port:
-            client.run_script(
-                CONFIGURE_PROXY_WITHOUT_AUTH_SCRIPT.format(hostname=hostname, port=port)
-            )
-        else:
-            client.run_script(DISABLE_PROXY_SCRIPT)
+        if not (hostname and port):
+            self._run_script(DISABLE_PROXY_SCRIPT)
+            return
+        if not (username and password or no_proxy_hosts):
+            username = password = None
+        self._run_script(
+            CONFIGURE_PROXY_SCRIPT,
+            hostname=hostname,
+            port=int(port),
+            username=username,
+            password=password,
+            noProxyHosts=no_proxy_hosts or None,
+        )
 
     def add_node(self, host, executors, labels=()):
         """Add a slave node with the given host name."""
@@ -185,6 +462,7 @@ class Api(object):
         action = "safeRestart"
         fail_message = "Couldn't restart jenkins"
         self._execute_action(action, fail_message)
+        self.invalidate_client()
         self.wait()
         unitdata.kv().set("jenkins.last_restart", time.time())
 
@@ -211,34 +489,53 @@ class Api(object):
 
     def get_node_secret(self, node_name):
         """Get node secret from jenkins."""
-        client = self._make_client()
-        cmd = 'println(jenkins.model.Jenkins.getInstance().getComputer("{}").getJnlpMac())'.format(
-            node_name
-        )
         try:
-            secret = client.run_script(cmd).strip()
-            return secret
+            return self._run_script(GET_NODE_SECRET_SCRIPT, name=node_name)
         except jenkins.JenkinsException:
             return False
 
+    def get_nodes(self):
+        """Get the agent nodes defined in Jenkins.
+
+        :returns: Node names mapped to dicts with their executors and labels.
+        :rtype: dict
+        """
+        return self._run_script(GET_NODES_SCRIPT)
+
+    def update_nodes(self, nodes):
+        """Update the executors and labels of existing nodes in place.
+
+        :param nodes: Node names mapped to dicts with the new executors and
+            labels.
+        """
+        hookenv.log("Updating nodes: %s" % ", ".join(sorted(nodes)))
+        self._run_script(UPDATE_NODES_SCRIPT, nodes=nodes)
+
+    def delete_nodes(self, node_names):
+        """Delete the given nodes with a single script."""
+        hookenv.log("Deleting nodes: %s" % ", ".join(sorted(node_names)))
+        self._run_script(DELETE_NODES_SCRIPT, names=sorted(node_names))
+
+    def get_node_secrets(self, node_names):
+        """Get the JNLP secrets of the given nodes with a single script.
+
+        :returns: Node names mapped to their secret, or None if the node
+            doesn't exist.
+        :rtype: dict
+        """
+        if not node_names:
+            return {}
+        return self._run_script(GET_NODE_SECRETS_SCRIPT, names=sorted(node_names))
+
     def set_update_center(self, url=None):
         """Set the update center or reset it to default"""
-        url = url or "https://updates.jenkins.io/stable/update-center.json"
+        url = url or DEFAULT_UPDATE_CENTER
         hookenv.log("Configuring {} as new update center".format(url), level="DEBUG")
-        client = self._make_client()
-        client.run_script(SET_UPDATE_CENTER_SCRIPT.format(url=url))
+        self._run_script(SET_UPDATE_CENTER_SCRIPT, url=url)
 
     def check_update_center(self):
         """Updated Jenkins' info from update-center and download plugins"""
-        cmd = (
-            "Jenkins.instance.getUpdateCenter().getSites().each { site ->"
-            "  site.updateDirectlyNow(hudson.model.DownloadService.signatureCheck)"
-            "};"
-            "hudson.model.DownloadService.Downloadable.all().each { downloadable ->"
-            "  downloadable.updateNow();"
-            "}"
-        )
-        self._run_cmd(cmd)
+        self._run_script(CHECK_UPDATE_CENTER_SCRIPT)
 
     def get_updatable_plugins(self):
         """Get plugins available to be updated
@@ -246,14 +543,7 @@ class Api(object):
         :returns: Plugins updated
         :rtype: list
         """
-        cmd = (
-            "println(Jenkins.instance.pluginManager.activePlugins.findAll {"
-            "  it -> it.hasUpdate()"
-            "}.collect {"
-            "  it -> it.getShortName()"
-            "})"
-        )
-        return list(filter(None, self._run_cmd(cmd).strip("[]").split(" ")))
+        return self._run_script(GET_UPDATABLE_PLUGINS_SCRIPT)
 
     def update_plugins(self):
         """Update plugins
@@ -262,38 +552,45 @@ class Api(object):
         :rtype: int
         """
         hookenv.log("Updating plugins", level="INFO")
-        cmd = (
-            "def plugins = Jenkins.instance.pluginManager.activePlugins.findAll {"
-            "  it -> it.hasUpdate()"
-            "}.collect {"
-            "  it -> it.getShortName()"
-            "};"
-            "long count;"
-            "Jenkins.instance.pluginManager.install(plugins, false).each { plugin ->"
-            "  ++count"
-            "};"
-            "println(count)"
-        )
-        return int(self._run_cmd(cmd))
+        return self._run_script(UPDATE_PLUGINS_SCRIPT)
 
-    def try_update_plugins(self):
+    def try_update_plugins(self, restart=True):
         """Try to update plugins
 
+        :param restart: Whether to restart Jenkins if plugins were updated.
+            Callers coordinating their own restarts can pass False.
         :returns: Plugins that were updated or False.
         :rtype: list or boolean
         """
-        self.check_update_center()
-        plugins = self.get_updatable_plugins()
+        # Refresh the update center and list updates in a single round trip.
+        _, plugins = self._run_scripts(
+            [(CHECK_UPDATE_CENTER_SCRIPT, {}), (GET_UPDATABLE_PLUGINS_SCRIPT, {})]
+        )
         if len(plugins) > 0:
             self.update_plugins()
-            self.restart()
+            if restart:
+                self.restart()
             return plugins
         else:
             return False
 
-    # Wait up to 140 seconds for Jenkins to be fully up.
-    @retry_on_exception(7, base_delay=5, exc_type=RETRIABLE)
+    def invalidate_client(self):
+        """Forget the cached client, e.g. because Jenkins was restarted."""
+        self._clients.pop(self.url, None)
+        self._helpers.pop(self.url, None)
+
     def _make_client(self):
+        """Return the cached Jenkins client, building it if needed."""
+        client = self._clients.get(self.url)
+        if client is None:
+            Readiness(self.url).wait()
+            client = self._build_client()
+            self._clients[self.url] = client
+        return client
+
+    # Jenkins is up by now, only retry transient and authentication failures.
+    @retry_on_exception(3, base_delay=2, exc_type=RETRIABLE)
+    def _build_client(self):
         """Build a Jenkins client instance."""
         creds = Credentials()
         user = creds.username()
@@ -319,9 +616,10 @@ class Api(object):
         client = jenkins.Jenkins(self.url, user, password)
         # If we're using Jenkins >= 2.129 we need to request a new token.
         if LooseVersion(jenkins_version) >= LooseVersion("2.129"):
-            token = client.run_script(GET_NEW_TOKEN_SCRIPT.format(user)).strip()
+            body = GET_NEW_TOKEN_SCRIPT
         else:
-            token = client.run_script(GET_LEGACY_TOKEN_SCRIPT.format(user)).strip()
+            body = GET_LEGACY_TOKEN_SCRIPT
+        [token] = parse_results(client.run_script(render_script([(body, {"username": user})])))
         return token
 
     def _check_response(self, error):
@@ -352,4 +650,48 @@ class Api(object):
 
     def _run_cmd(self, cmd):
         client = self._make_client()
-        return client.run_script(cmd).strip()
+        try:
+            return client.run_script(cmd).strip()
+        except jenkins.JenkinsException as e:
+            # The cached client's token was revoked, authenticate again.
+            if "401" not in str(e):
+                raise
+            self.invalidate_client()
+            return self._make_client().run_script(cmd).strip()
+
+    def _run_script(self, body, **params):
+        """Run a script body with the given parameters, returning its value."""
+        [result] = self._run_scripts([(body, params)])
+        return result
+
+    def _run_scripts(self, calls):
+        """Run several script bodies in a single round trip.
+
+        @param calls: A list of (body, params) tuples, params being a dict.
+        @return: The values returned by each body, in order.
+        """
+        resident = all(body in _HELPER_NAMES for body, _ in calls) and self._has_helper()
+        return parse_results(self._run_cmd(render_script(calls, resident=resident)))
+
+    def _has_helper(self):
+        """Whether the resident helper can be used, probing for it once.
+
+        If the helper isn't registered yet but was installed on disk (Jenkins
+        only runs init.groovy.d scripts at startup), it's loaded right away.
+        Otherwise scripts are sent inline.
+        """
+        available = self._helpers.get(self.url)
+        if available is None:
+            [available] = parse_results(
+                self._run_cmd(render_script([(HELPER_PROBE_SCRIPT, {"key": HELPER_KEY})]))
+            )
+            if not available and os.path.exists(paths.HELPER_SCRIPT):
+                hookenv.log("Loading the charm helper into Jenkins")
+                try:
+                    self._run_cmd(render_helper())
+                except jenkins.JenkinsException as error:
+                    hookenv.log("Failed to load the charm helper: %s" % error, level=ERROR)
+                else:
+                    available = True
+            self._helpers[self.url] = available
+        return available
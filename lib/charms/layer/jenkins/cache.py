@@ -0,0 +1,255 @@
+import base64
+import binascii
+import hashlib
+import os
+import shutil
+import tempfile
+
+import requests
+
+from charmhelpers.core import hookenv, host
+from charmhelpers.core.decorators import retry_on_exception
+
+from charms.layer.jenkins import paths
+
+# Number of Jenkins packages kept by PackageCache.evict(), so that the
+# previous version stays around for downgrades.
+KEEP_PACKAGES = 2
+
+# Seconds to wait for the package server before giving up on a request.
+DOWNLOAD_TIMEOUT = 60
+
+
+class IncompleteDownload(requests.exceptions.RequestException):
+    """The server closed the connection before sending the whole package."""
+
+
+# Errors after which PackageCache.download() tries again, resuming the
+# partial download. HTTP errors, like a missing package, aren't retried.
+TRANSIENT_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    IncompleteDownload,
+)
+
+
+class PluginCache(object):
+    """Content-addressed cache of downloaded plugin files.
+
+    Entries are keyed by the sha256 published by the update center, and live
+    outside JENKINS_HOME so they survive plugin removals and re-installs.
+    """
+
+    def __init__(self, directory=paths.PLUGINS_CACHE, max_size=None):
+        """
+        @param directory: Where cached plugins are kept.
+        @param max_size: Maximum size of the cache in bytes. Defaults to the
+            plugins-cache-size config option, 0 disables caching.
+        """
+        self._directory = directory
+        if max_size is None:
+            max_size = hookenv.config()["plugins-cache-size"] * 1024 * 1024
+        self._max_size = max_size
+
+    @property
+    def enabled(self):
+        return self._max_size > 0
+
+    def fetch(self, sha256, path):
+        """Copy the cached file with the given checksum to path.
+
+        @param sha256: The base64 encoded checksum, as found in update-center.json.
+        @returns: Whether the file was found in the cache.
+        """
+        cached_path = self._cached_path(sha256)
+        if cached_path is None or not os.path.isfile(cached_path):
+            return False
+        if _sha256(cached_path) != os.path.basename(cached_path):
+            hookenv.log("Discarding corrupted cached plugin %s" % sha256)
+            os.remove(cached_path)
+            return False
+        self._copy(cached_path, path)
+        # Mark the entry as recently used.
+        os.utime(cached_path)
+        return True
+
+    def store(self, sha256, path):
+        """Add the file at path to the cache under the given checksum."""
+        cached_path = self._cached_path(sha256)
+        if cached_path is None:
+            return
+        host.mkdir(self._directory, perms=0o755)
+        self._copy(path, cached_path)
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits."""
+        if not os.path.isdir(self._directory):
+            return
+        entries = []
+        for name in os.listdir(self._directory):
+            stat = os.stat(os.path.join(self._directory, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self._max_size:
+                break
+            hookenv.log("Evicting cached plugin %s" % name)
+            os.remove(os.path.join(self._directory, name))
+            total -= size
+
+    def _cached_path(self, sha256):
+        """Return the path of the cache entry for the given checksum, if any."""
+        if not self.enabled or not sha256:
+            return None
+        try:
+            digest = base64.b64decode(sha256, validate=True)
+        except binascii.Error:
+            digest = None
+        if digest is None or len(digest) != hashlib.sha256().digest_size:
+            hookenv.log("Ignoring invalid plugin checksum %s" % sha256)
+            return None
+        return os.path.join(self._directory, binascii.hexlify(digest).decode("ascii"))
+
+    def _copy(self, src, dest):
+        """Atomically copy src to dest, so readers never see partial files."""
+        fd, partial_path = tempfile.mkstemp(dir=os.path.dirname(dest), prefix=".cache-")
+        os.close(fd)
+        try:
+            shutil.copyfile(src, partial_path)
+            os.rename(partial_path, dest)
+        except Exception:
+            os.remove(partial_path)
+            raise
+
+
+class PackageCache(object):
+    """Cache of downloaded Jenkins packages.
+
+    Every package has a sha256sum-style sidecar file, written once the
+    download completes with the size announced by the server, which is
+    checked before the package is used, so a truncated or corrupted file is
+    never installed.
+    """
+
+    def __init__(self, directory=paths.DEBS_CACHE):
+        self._directory = directory
+
+    def path(self, name):
+        """Return the path of the package with the given file name."""
+        return os.path.join(self._directory, name)
+
+    def get(self, name):
+        """Return the path of the cached package, if it's there and intact."""
+        path = self.path(name)
+        sidecar = path + ".sha256"
+        if not os.path.isfile(path) or not os.path.isfile(sidecar):
+            return None
+        with open(sidecar) as fd:
+            expected = fd.read().split(" ", 1)[0]
+        if _sha256(path) != expected:
+            hookenv.log("Discarding corrupted cached package %s" % name)
+            os.remove(path)
+            os.remove(sidecar)
+            return None
+        hookenv.log("Using cached package %s" % name)
+        # Mark the entry as recently used.
+        os.utime(path)
+        return path
+
+    def add(self, name):
+        """Record the checksum of a package downloaded into the cache.
+
+        @returns: The path of the package.
+        """
+        path = self.path(name)
+        with open(path + ".sha256", "w") as fd:
+            fd.write("%s  %s\n" % (_sha256(path), name))
+        return path
+
+    @retry_on_exception(3, base_delay=2, exc_type=TRANSIENT_ERRORS)
+    def download(self, url, name):
+        """Download the package at url into the cache.
+
+        An interrupted download is resumed with a Range request, by the next
+        retry or by the next hook. The ETag (or Last-Modified date) of the
+        first response is kept next to the partial file and sent along as
+        If-Range, so that a package which changed in the meantime is
+        downloaded again from scratch instead of being spliced.
+
+        @returns: The path of the package.
+        """
+        host.mkdir(self._directory, perms=0o755)
+        partial_path = self.path(name) + ".part"
+        validator_path = partial_path + ".validator"
+        headers = {}
+        if os.path.isfile(partial_path) and os.path.isfile(validator_path):
+            with open(validator_path) as fd:
+                headers["If-Range"] = fd.read().strip()
+            headers["Range"] = "bytes=%d-" % os.path.getsize(partial_path)
+        response = requests.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT)
+        if response.status_code == 416:
+            # Whatever was downloaded doesn't match the remote file anymore.
+            os.remove(partial_path)
+        response.raise_for_status()
+        if response.status_code == 206:
+            hookenv.log("Resuming download of %s from %s" % (url, headers["Range"]))
+            mode = "ab"
+        else:
+            hookenv.log("Downloading %s" % url)
+            mode = "wb"
+            validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+            if validator:
+                with open(validator_path, "w") as fd:
+                    fd.write(validator)
+            elif os.path.exists(validator_path):
+                os.remove(validator_path)
+        with open(partial_path, mode) as fd:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                fd.write(chunk)
+        expected_size = _expected_size(response)
+        size = os.path.getsize(partial_path)
+        if expected_size is not None and size != expected_size:
+            raise IncompleteDownload(
+                "Got %d of %d bytes of %s" % (size, expected_size, url), response=response
+            )
+        os.rename(partial_path, self.path(name))
+        if os.path.exists(validator_path):
+            os.remove(validator_path)
+        return self.add(name)
+
+    def evict(self, keep=KEEP_PACKAGES):
+        """Remove all but the keep most recently used packages."""
+        if not os.path.isdir(self._directory):
+            return
+        packages = sorted(
+            (name for name in os.listdir(self._directory) if name.endswith(".deb")),
+            key=lambda name: os.stat(self.path(name)).st_mtime,
+            reverse=True,
+        )
+        for name in packages[keep:]:
+            hookenv.log("Evicting cached package %s" % name)
+            for path in (self.path(name), self.path(name) + ".sha256"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+def _expected_size(response):
+    """Return the full size of the file being downloaded, if the server told."""
+    if response.status_code == 206:
+        total = response.headers.get("Content-Range", "").rpartition("/")[2]
+        return int(total) if total.isdigit() else None
+    if response.headers.get("Content-Encoding"):
+        # The length is the one of the encoded body, not of the file.
+        return None
+    length = response.headers.get("Content-Length", "")
+    return int(length) if length.isdigit() else None
+
+
+def _sha256(path):
+    """Return the hex sha256 of the file at path."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fd:
+        for chunk in iter(lambda: fd.read(64 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -1,9 +1,11 @@
+import base64
 import os
 from urllib.parse import urlparse
 
 from charmhelpers.core import hookenv, host, templating
 from charms.layer.jenkins import paths
-from charms.layer.jenkins.api import Api
+from charms.layer.jenkins.api import DEFAULT_UPDATE_CENTER, Api, render_helper
+from charms.layer.jenkins.jvm import JvmProfile
 
 PORT = 8080
 
@@ -41,20 +43,80 @@ class Configuration(object):
 
         return True
 
-    def configure_proxy(self):
-        """Configure http(s) proxy settings if appropriate."""
+    def install_helper(self):
+        """Install the charm's resident Groovy helper into init.groovy.d.
 
-        config = hookenv.config()
+        Jenkins runs it at startup, registering precompiled functions that
+        the Api calls instead of sending whole scripts each time.
+
+        :returns: Whether the helper was changed.
+        """
+        content = render_helper()
+        if os.path.exists(paths.HELPER_SCRIPT):
+            with open(paths.HELPER_SCRIPT) as fd:
+                if fd.read() == content:
+                    return False
+        hookenv.log("Installing the charm helper into %s" % paths.INIT_GROOVY)
+        host.mkdir(paths.INIT_GROOVY, owner="jenkins", group="nogroup")
+        host.write_file(
+            paths.HELPER_SCRIPT, content.encode("utf-8"),
+            owner="jenkins", group="nogroup")
+        return True
+
+    def configure_proxy(self, live=True):
+        """Configure http(s) proxy settings if appropriate.
 
+        The settings are written to proxy.xml, which Jenkins reads at boot,
+        and applied to the running Jenkins unless live is False.
+        """
+
+        config = hookenv.config()
+        hostname = config["proxy-hostname"]
+        port = config["proxy-port"]
+
+        if hostname and port:
+            password = config["proxy-password"] or ""
+            context = {
+                "hostname": hostname,
+                "port": port,
+                "username": config["proxy-username"],
+                # Jenkins encrypts the password when it saves the file, but
+                # still reads it in the legacy base64-scrambled form.
+                "scrambled_password": base64.b64encode(password.encode("utf-8")).decode(),
+                "no_proxy_hosts": config["no-proxy"],
+            }
+            templating.render(
+                "proxy.xml", paths.PROXY_CONFIG_FILE, context,
+                owner="jenkins", group="nogroup", perms=0o600)
+        elif os.path.exists(paths.PROXY_CONFIG_FILE):
+            os.unlink(paths.PROXY_CONFIG_FILE)
+
+        if not live:
+            return
         api = Api()
         api.configure_proxy(
-            config["proxy-hostname"],
-            config["proxy-port"],
+            hostname,
+            port,
             config["proxy-username"],
             config["proxy-password"],
             config["no-proxy"]
         )
 
+    def set_update_center(self, live=True):
+        """Configure the Update Center.
+
+        The URL is written to the update center configuration, which
+        Jenkins reads at boot, and applied to the running Jenkins unless
+        live is False.
+        """
+        url = hookenv.config()["update-center"] or DEFAULT_UPDATE_CENTER
+        templating.render(
+            "update-center.xml", paths.UPDATE_CENTER_CONFIG_FILE, {"url": url},
+            owner="jenkins", group="nogroup")
+        if live:
+            api = Api()
+            api.set_update_center(url)
+
     def migrate(self):
         """Drop the legacy boostrap flag file."""
         if os.path.exists(paths.LEGACY_BOOTSTRAP_FLAG):
@@ -62,7 +124,11 @@ class Configuration(object):
             os.unlink(paths.LEGACY_BOOTSTRAP_FLAG)
 
     def set_url(self):
-        """Update Jenkins public_url and prefix."""
+        """Update Jenkins public_url and prefix.
+
+        :returns: Whether the prefix changed, in which case systemd must be
+                  reloaded and Jenkins restarted for it to take effect.
+        """
         config = hookenv.config()
         url = config["public-url"]
         context = {"public_url": url}
@@ -70,19 +136,42 @@ class Configuration(object):
             "location-config.xml", paths.LOCATION_CONFIG_FILE, context,
             owner="jenkins", group="nogroup")
 
-        self._set_prefix(urlparse(url).path)
+        return self._set_prefix(urlparse(url).path)
+
+    def set_jvm_options(self):
+        """Update the JVM options of Jenkins, see JvmProfile.
+
+        :returns: Whether the options changed, in which case systemd must be
+                  reloaded and Jenkins restarted for them to take effect.
+        """
+        prefix = urlparse(hookenv.config()["public-url"]).path
+        return self._set_prefix(prefix)
 
     def _set_prefix(self, prefix):
-        """ Set Jenkins to use the given prefix.
+        """ Set Jenkins to use the given prefix, and the JVM options.
         :param prefix: The prefix Jenkins will be configured to use. If empty
                        the prefix config is unset.
+        :returns: Whether the systemd override file changed.
         """
         # Since version 2.332.1 Jenkins is not loading env vars from the default config file
-        overrides_content = '# This file is managed by Juju. Do not edit manually.\n[Service]\nEnvironment="JENKINS_PREFIX={}"\n'.format(prefix)
-
+        java_opts = " ".join(JvmProfile().options())
+        overrides_content = (
+            '# This file is managed by Juju. Do not edit manually.\n[Service]\n'
+            'Environment="JENKINS_PREFIX={}"\n'.format(_escape(prefix)))
+        # Without JVM options, keep the package's own JAVA_OPTS.
+        if java_opts:
+            overrides_content += 'Environment="JAVA_OPTS={}"\n'.format(_escape(java_opts))
+
+        if os.path.exists(paths.SERVICE_CONFIG_FILE_OVERRIDE):
+            with open(paths.SERVICE_CONFIG_FILE_OVERRIDE) as overrides_file:
+                if overrides_file.read() == overrides_content:
+                    return False
+
+        hookenv.log("Setting JAVA_OPTS to %s" % (java_opts or "the package defaults"))
         host.mkdir(os.path.dirname(paths.SERVICE_CONFIG_FILE_OVERRIDE), perms=0o751)
-        with open(os.open(paths.SERVICE_CONFIG_FILE_OVERRIDE, os.O_CREAT | os.O_WRONLY, 0o644), 'w') as overrides_file:
+        with open(os.open(paths.SERVICE_CONFIG_FILE_OVERRIDE, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o644), 'w') as overrides_file:
             overrides_file.write(overrides_content)
+        return True
 
     def set_update_center_ca(self):
         """Configure Jenkins Update Center CA cert"""
@@ -92,3 +181,8 @@ class Configuration(object):
                                     "default.crt")
         host.mkdir(paths.UPDATE_CENTER_ROOT_CAS, owner="jenkins", group="jenkins", perms=0o750)
         host.write_file(ca_cert_file, ca_cert, owner="jenkins", group="jenkins", perms=0o644)
+
+
+def _escape(value):
+    """Escape value for a double-quoted systemd Environment= assignment."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("%", "%%")
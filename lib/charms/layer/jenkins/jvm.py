@@ -0,0 +1,204 @@
+import glob
+import hashlib
+import os
+import re
+import subprocess
+
+from charmhelpers.core import hookenv, unitdata
+from charmhelpers.core.hookenv import ERROR
+
+from charms.layer.jenkins import paths
+
+# Bounds, in MB, of the heap size picked by the "auto" jvm-heap.
+MIN_AUTO_HEAP = 256
+MAX_AUTO_HEAP = 16384
+
+# Part of the unit's memory given to the heap by the "auto" jvm-heap, the
+# rest being left to metaspace, threads, native memory and the page cache.
+AUTO_HEAP_RATIO = 0.5
+
+# A memory size as accepted by -Xmx and friends, e.g. 512m or 4g.
+MEMORY_SIZE = re.compile(r"^\d+[kKmMgG]?$")
+
+# Flags of each jvm-gc choice.
+GC_OPTIONS = {
+    "": [],
+    "default": [],
+    "g1": ["-XX:+UseG1GC", "-XX:+UseStringDeduplication", "-XX:+ParallelRefProcEnabled"],
+    "parallel": ["-XX:+UseParallelGC"],
+    "zgc": ["-XX:+UseZGC"],
+}
+
+# ZGC is only available from this Java version, and only experimental
+# before the production one.
+FIRST_ZGC_JAVA = 11
+FIRST_PRODUCTION_ZGC_JAVA = 15
+
+# Java versions able to dump a class data sharing archive at exit, and to
+# create and refresh one by itself.
+FIRST_DYNAMIC_CDS_JAVA = 13
+FIRST_AUTO_CDS_JAVA = 19
+
+# Unitdata keys of the fingerprint the class data sharing archive was dumped
+# for, and of the one it's being dumped for.
+CDS_FINGERPRINT_KEY = "jenkins.cds.fingerprint"
+CDS_PENDING_KEY = "jenkins.cds.pending"
+
+# Options of the Debian package's unit, which setting JAVA_OPTS replaces.
+DEFAULT_OPTIONS = ["-Djava.awt.headless=true"]
+
+
+class JvmProfile(object):
+    """Work out the JVM options of Jenkins from the charm config."""
+
+    def options(self):
+        """Return the JVM options, as a list of command line flags.
+
+        If nothing is configured the list is empty, and the options of the
+        Debian package are left alone.
+        """
+        config = hookenv.config()
+        options = []
+
+        heap = self._heap(config["jvm-heap"])
+        if heap:
+            options.extend(["-Xms%s" % heap, "-Xmx%s" % heap])
+
+        metaspace = config["jvm-max-metaspace"]
+        if metaspace:
+            if MEMORY_SIZE.match(metaspace):
+                options.append("-XX:MaxMetaspaceSize=%s" % metaspace)
+            else:
+                hookenv.log("Ignoring invalid jvm-max-metaspace %s" % metaspace, level=ERROR)
+
+        gc = config["jvm-gc"]
+        if gc not in GC_OPTIONS:
+            hookenv.log("Ignoring unknown jvm-gc %s" % gc, level=ERROR)
+        elif gc == "zgc" and self.problem():
+            hookenv.log("Ignoring jvm-gc %s: %s" % (gc, self.problem()), level=ERROR)
+        else:
+            if gc == "zgc" and (java_version() or 0) < FIRST_PRODUCTION_ZGC_JAVA:
+                options.append("-XX:+UnlockExperimentalVMOptions")
+            options.extend(GC_OPTIONS[gc])
+
+        if config["jvm-gc-logging"]:
+            options.extend(self._gc_logging())
+
+        if config["jvm-cds"]:
+            options.extend(self._cds())
+
+        options.extend(config["jvm-extra-options"].split())
+        if not options:
+            return []
+        return DEFAULT_OPTIONS + options
+
+    def problem(self):
+        """Return why the options can't work with the installed Java, if so."""
+        java = java_version()
+        if hookenv.config()["jvm-gc"] == "zgc" and java is not None and java < FIRST_ZGC_JAVA:
+            return "jvm-gc zgc needs Java %d or later, not %d" % (FIRST_ZGC_JAVA, java)
+        return None
+
+    def _cds(self):
+        """Return the flags using a class data sharing archive.
+
+        The archive is dumped by the JVM when it exits, and must match the
+        Java and Jenkins versions and the plugins, so it's removed whenever
+        they change. From Java 19 the JVM refreshes it by itself. Before
+        that, the JVM dumps it until it's there, and then uses it.
+        """
+        java = java_version()
+        if java is None or java < FIRST_DYNAMIC_CDS_JAVA:
+            hookenv.log("Java %s can't dump a class data sharing archive" % java)
+            return []
+        kv = unitdata.kv()
+        fingerprint = self._cds_fingerprint(java)
+        archive = "-XX:SharedArchiveFile=%s" % paths.CDS_ARCHIVE
+        if java >= FIRST_AUTO_CDS_JAVA:
+            if kv.get(CDS_FINGERPRINT_KEY) != fingerprint:
+                _remove_cds_archive()
+                kv.set(CDS_FINGERPRINT_KEY, fingerprint)
+            return ["-XX:+AutoCreateSharedArchive", archive]
+        if kv.get(CDS_FINGERPRINT_KEY) == fingerprint and os.path.exists(paths.CDS_ARCHIVE):
+            return [archive]
+        if kv.get(CDS_PENDING_KEY) == fingerprint and os.path.exists(paths.CDS_ARCHIVE):
+            hookenv.log("Using the new class data sharing archive")
+            kv.set(CDS_FINGERPRINT_KEY, fingerprint)
+            return [archive]
+        if kv.get(CDS_PENDING_KEY) != fingerprint:
+            hookenv.log("Dumping a new class data sharing archive at the next stop")
+            _remove_cds_archive()
+            kv.set(CDS_PENDING_KEY, fingerprint)
+        return ["-XX:ArchiveClassesAtExit=%s" % paths.CDS_ARCHIVE]
+
+    def _cds_fingerprint(self, java):
+        """Return what the class data sharing archive depends on, hashed."""
+        try:
+            jenkins = subprocess.check_output(
+                ("dpkg-query", "--show", "--showformat", "${Version}", "jenkins")
+            ).decode("utf-8")
+        except subprocess.CalledProcessError:
+            jenkins = ""
+        plugins = []
+        for path in glob.glob(os.path.join(paths.PLUGINS, "*.[hj]pi")):
+            # Updated plugins usually keep their file name, but not their size
+            # and modification time.
+            stat = os.stat(path)
+            plugins.append("%s %d %d" % (os.path.basename(path), stat.st_size, stat.st_mtime_ns))
+        plugins.sort()
+        digest = hashlib.sha256()
+        for item in [str(java), jenkins] + plugins:
+            digest.update(item.encode("utf-8") + b"\n")
+        return digest.hexdigest()
+
+    def _heap(self, heap):
+        """Return the heap size for the given jvm-heap value, if any."""
+        if not heap:
+            return None
+        if heap != "auto":
+            if MEMORY_SIZE.match(heap):
+                return heap
+            hookenv.log("Ignoring invalid jvm-heap %s" % heap, level=ERROR)
+            return None
+        size = int(self._total_memory() * AUTO_HEAP_RATIO)
+        return "%dm" % max(MIN_AUTO_HEAP, min(MAX_AUTO_HEAP, size))
+
+    def _gc_logging(self):
+        """Return the flags logging GC activity to a rotated file."""
+        log_file = os.path.join(os.path.dirname(paths.LOG_FILE), "gc.log")
+        if java_version() == 8:
+            return [
+                "-Xloggc:%s" % log_file,
+                "-XX:+PrintGCDetails",
+                "-XX:+PrintGCDateStamps",
+                "-XX:+UseGCLogFileRotation",
+                "-XX:NumberOfGCLogFiles=5",
+                "-XX:GCLogFileSize=20m",
+            ]
+        return ["-Xlog:gc*:file=%s:time,uptime:filecount=5,filesize=20m" % log_file]
+
+    def _total_memory(self):
+        """Return the memory of the unit, in MB."""
+        with open("/proc/meminfo") as fd:
+            for line in fd:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) // 1024
+        raise RuntimeError("Can't find the total memory in /proc/meminfo")
+
+
+def java_version():
+    """Return the major version of the default java, if it's installed.
+
+    The version is taken from the JRE directory the java alternative points
+    to, e.g. /usr/lib/jvm/java-11-openjdk-amd64/bin/java.
+    """
+    match = re.search(r"java-(\d+)-", os.path.realpath(paths.JAVA_BIN))
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+def _remove_cds_archive():
+    """Remove the class data sharing archive, if any."""
+    if os.path.exists(paths.CDS_ARCHIVE):
+        os.remove(paths.CDS_ARCHIVE)
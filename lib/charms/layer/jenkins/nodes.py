@@ -0,0 +1,123 @@
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from charmhelpers.core import hookenv, unitdata
+
+from charms.layer.jenkins.api import Api
+
+# Key of the unitdata entry holding the names of the nodes the charm created.
+MANAGED_NODES_KEY = "jenkins.nodes.managed"
+
+# Upper bound on concurrent node creation requests.
+MAX_WORKERS = 8
+
+
+class Nodes(object):
+    """Reconcile Jenkins agent nodes with the agents related to the charm."""
+
+    def __init__(self, api=None):
+        self._api = api or Api()
+
+    def managed(self):
+        """Return the names of the nodes the charm created."""
+        return set(unitdata.kv().get(MANAGED_NODES_KEY, []))
+
+    def reconcile(self, slaves):
+        """Make Jenkins nodes match the given agents, touching only the delta.
+
+        The current node list is fetched once and compared with the agents,
+        then nodes of departed agents are deleted in one go, the executors
+        and labels of existing nodes are patched in place (so running builds
+        aren't affected), missing nodes are added concurrently and the
+        secrets of all agents are fetched with a single script.
+
+        @param slaves: Dicts with the slavehost, executors and labels of the
+            related agents.
+        @return: A dict mapping agent host names to their JNLP secret.
+        """
+        wanted = {slave["slavehost"]: slave for slave in slaves}
+        existing = self._api.get_nodes()
+
+        added = [wanted[host] for host in sorted(wanted) if host not in existing]
+        removed = sorted((self.managed() - set(wanted)) & set(existing))
+        changed = {}
+        for host, slave in wanted.items():
+            if host not in existing:
+                continue
+            spec = _node_spec(slave)
+            if spec != _node_spec(existing[host]):
+                changed[host] = spec
+        unchanged = len(wanted) - len(added) - len(changed)
+        hookenv.log(
+            "Reconciling nodes: %d to add, %d to remove, %d to update, %d unchanged"
+            % (len(added), len(removed), len(changed), unchanged)
+        )
+
+        if removed:
+            self._api.delete_nodes(removed)
+        if changed:
+            self._api.update_nodes(changed)
+        self._add_nodes(added)
+        self._set_managed(wanted.keys())
+
+        return self._api.get_node_secrets(wanted.keys())
+
+    def sweep(self, timeout, keep=()):
+        """Delete nodes the charm created which have been offline for too long.
+
+        Nodes that never connected or were taken offline on purpose are left
+        alone, and so are the ones in keep and those the charm didn't create,
+        e.g. added by hand or by a cloud plugin.
+
+        @param timeout: How long, in minutes, a node must have been offline.
+        @param keep: Names of nodes to never delete, e.g. related agents.
+        @return: The names of the deleted nodes.
+        """
+        cutoff = (time.time() - timeout * 60) * 1000
+        managed = self.managed()
+        stale = sorted(
+            name
+            for name, node in self._api.get_nodes().items()
+            if name in managed
+            and name not in keep
+            and node.get("offlineSince")
+            and node["offlineSince"] < cutoff
+        )
+        if stale:
+            hookenv.log("Removing %d nodes offline for over %d minutes" % (len(stale), timeout))
+            self._api.delete_nodes(stale)
+            self._set_managed(self.managed() - set(stale))
+        return stale
+
+    def _add_nodes(self, slaves):
+        """Add the nodes for the given agents, a few at a time."""
+        if not slaves:
+            return
+        # Authenticate once up front, rather than racing in the workers.
+        self._api.wait()
+        workers = min(MAX_WORKERS, len(slaves))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self._add_node, slave) for slave in slaves]
+            for future in futures:
+                future.result()
+
+    def _add_node(self, slave):
+        """Add the node for the given agent."""
+        self._api.add_node(slave["slavehost"], slave["executors"], labels=slave["labels"] or ())
+
+    def _set_managed(self, names):
+        """Persist the names of the nodes the charm created."""
+        unitdata.kv().set(MANAGED_NODES_KEY, sorted(names))
+
+
+def _node_spec(node):
+    """Return the executors and labels of an agent or node, normalized.
+
+    Labels may be a whitespace-separated string or a sequence, and their
+    order doesn't matter to Jenkins.
+    """
+    labels = node.get("labels") or ()
+    if isinstance(labels, str):
+        labels = labels.split()
+    return {"executors": int(node["executors"]), "labels": " ".join(sorted(labels))}
@@ -1,15 +1,19 @@
+import glob
+import hashlib
 import os
 import os.path
 import re
 import shutil
 import subprocess
-import tempfile
-from glob import glob
+from concurrent.futures import ThreadPoolExecutor
 
 from charmhelpers.core import hookenv, host
+from charmhelpers.core.hookenv import ERROR
 from charms.layer.jenkins import paths
+from charms.layer.jenkins.cache import PackageCache
 from jenkins_plugin_manager.core import JenkinsCore
 from pkg_resources import parse_version
+import requests
 from testtools import try_import
 
 # XXX Wrap this import with try_import since layers code won't be available
@@ -17,20 +21,35 @@ from testtools import try_import
 #     can be safely ignored since we're stubbing out these objects).
 apt = try_import("charms.apt")
 
-POSSIBLE_JRE_DEPENDENCIES_XENIAL = {"default-jre-headless", "openjdk-8-jre-headless"}
+# Java versions Jenkins runs on, with the first Jenkins version supporting
+# them and the first one that doesn't anymore, if any.
+JAVA_SUPPORT = {
+    8: (None, "2.357"),
+    11: ("2.164.1", "2.463"),
+    17: ("2.346.1", None),
+    21: ("2.426.1", None),
+}
+# Java versions whose JRE is packaged by each Ubuntu series. Series not
+# listed are assumed to package all of them.
+SERIES_JAVA_VERSIONS = {
+    "xenial": (8,),
+    "bionic": (8, 11, 17),
+    "focal": (8, 11, 17),
+    "jammy": (8, 11, 17, 21),
+}
+JRE_PACKAGE = "openjdk-%d-jre-headless"
+JRE_PACKAGE_PATTERN = re.compile(r"^openjdk-(\d+)-jre-headless$")
+JAVA_BINARIES = "/usr/lib/jvm/java-%d-openjdk-*/bin/java"
+POSSIBLE_JRE_DEPENDENCIES_XENIAL = {"default-jre-headless", JRE_PACKAGE % 8}
 POSSIBLE_JRE_DEPENDENCIES = {
     *POSSIBLE_JRE_DEPENDENCIES_XENIAL,
-    "openjdk-11-jre-headless",
-}
-APT_DEPENDENCIES = {
-    "jenkins-2.164-and-later": ["daemon", "openjdk-11-jre-headless"],
-    "pre-jenkins-2.164": ["daemon", "openjdk-8-jre-headless"],
-    "xenial": ["daemon", "openjdk-8-jre-headless"],
+    *(JRE_PACKAGE % java for java in JAVA_SUPPORT),
 }
 CONSTANT_APT_DEPENDENCIES = ["daemon"]
 APT_SOURCE = "deb http://pkg.jenkins.io/%s binary/"
 JENKINS_XENIAL_VERSION = "2.346.*"
-FIRST_JAVA_11_JENKINS_VERSION = "2.164.1"
+# Upper bound on concurrent removals in Packages.clean_old_plugins().
+CLEANUP_WORKERS = 4
 
 
 class Packages(object):
@@ -45,6 +64,7 @@ class Packages(object):
         """
         self._apt = apt
         self._host = ch_host or host
+        self._cache = PackageCache()
         core_url = hookenv.config()["bundle-site"]
         if core_url == "" or core_url == "https://pkg.jenkins.io":
             self._jc = JenkinsCore()
@@ -55,7 +75,7 @@ class Packages(object):
         """Return the distro release code name, e.g. 'precise' or 'trusty'."""
         return self._host.lsb_release()["DISTRIB_CODENAME"]
 
-    def apt_dependencies(self, jenkins_version=None):
+    def apt_dependencies(self, jenkins_version=None, installed_packages=None):
         """Get the apt dependencies based on Ubuntu series and Jenkins version.
 
         Assumes that, if Jenkins is not installed, that the latest LTS version of Jenkins will be
@@ -64,24 +84,67 @@ class Packages(object):
         Args:
             jenkins_version: The version of Jenkins to get the apt dependencies for. Based on
                 installed Jenkins version and Ubuntu series if it is None.
+            installed_packages: The installed packages, if already known, see pick_java().
 
         Returns:
             The dependencies of Jenkins to be installed.
 
         """
-        if self.distro_codename() == "xenial":
-            return APT_DEPENDENCIES["xenial"]
+        java = self.pick_java(jenkins_version, installed_packages=installed_packages)
+        return CONSTANT_APT_DEPENDENCIES + [JRE_PACKAGE % java]
+
+    def pick_java(self, jenkins_version=None, installed_packages=None):
+        """Pick the Java version to run Jenkins with.
+
+        That's the jre config option if it's set and supported, or else the
+        closest newer Java version that is supported. Otherwise,
+        once Jenkins is installed, the installed JRE is kept as long as it's
+        supported, so that upgrading the charm doesn't switch JREs. On a
+        fresh install, or if the installed JRE isn't supported anymore, it's
+        the newest Java version that both Jenkins and the Ubuntu series
+        support.
+
+        Args:
+            jenkins_version: The version of Jenkins to pick Java for. The installed version if
+                it is None, or the latest one if Jenkins is not installed.
+            installed_packages: The installed packages, to avoid asking dpkg again when the
+                caller already did.
+
+        Returns:
+            The major Java version.
+
+        """
+        series = self.distro_codename()
+        available = SERIES_JAVA_VERSIONS.get(series, tuple(sorted(JAVA_SUPPORT)))
+        installed = True
         if jenkins_version is None:
             try:
                 jenkins_version = self.jenkins_version()
             except subprocess.CalledProcessError:
                 # No Jenkins version installed
-                pass
-        if jenkins_version is not None and parse_version(jenkins_version) < parse_version(
-            FIRST_JAVA_11_JENKINS_VERSION
-        ):
-            return APT_DEPENDENCIES["pre-jenkins-2.164"]
-        return APT_DEPENDENCIES["jenkins-2.164-and-later"]
+                installed = False
+        supported = [java for java in available if _supports(java, jenkins_version)]
+        if not supported:
+            # E.g. xenial, where the newest Jenkins can't be installed anyway.
+            supported = [max(available)]
+        jre = hookenv.config()["jre"]
+        if jre != "auto":
+            if jre.isdigit() and int(jre) in supported:
+                return int(jre)
+            hookenv.log(
+                "Java %s is not supported by jenkins %s on %s, picking one of %s"
+                % (jre, jenkins_version or "latest", series, ", ".join(map(str, supported))),
+                level=ERROR,
+            )
+            newer = [java for java in supported if java > int(jre)] if jre.isdigit() else []
+            if newer:
+                return min(newer)
+        elif installed:
+            javas = self._installed_javas(installed_packages)
+            current = [java for java in javas if java in supported]
+            if current:
+                return max(current)
+        return max(supported)
 
     def install_dependencies(self, jenkins_version=None):
         """Install the deb dependencies of the Ubuntu series and Jenkins package.
@@ -89,30 +152,93 @@ class Packages(object):
         Removes any dependencies that are no longer needed based on the Ubuntu series and version
         of Jenkins to be installed and then installs dependencies based on Jenkins version
         installed/ to be installed (assumed to be the latest LTS version if Jenkins is not
-        installed yet).
+        installed yet). Apt isn't invoked at all when dpkg shows that the dependencies are
+        already satisfied.
 
         Args:
             jenkins_version: The version of Jenkins to get the apt dependencies for. Based on the
                 Ubuntu series and installed/ anticipated to be installed Jenkins version if it is
                 None.
 
+        Returns:
+            The required dependencies that were already installed, which apt doesn't flag.
+
         """
         hookenv.log("Installing jenkins dependencies and desired tools")
+        purge, install, satisfied = self.plan_dependencies(jenkins_version=jenkins_version)
+        if not purge and not install:
+            hookenv.log("Jenkins dependencies are already satisfied")
+            return satisfied
+
+        # Install depedencies based on Jenkins version
+        if install:
+            self._apt.queue_install(install)
+            self._apt.install_queued()
+
+        # Switch to the required JRE before removing the one Jenkins may be running on.
+        self._use_jre(satisfied + install)
 
         # Remove any previous dependencies that are no longer needed
-        required_apt_dependencies = set(self.apt_dependencies(jenkins_version=jenkins_version))
-        self._apt.purge(
-            (
-                POSSIBLE_JRE_DEPENDENCIES
-                if self.distro_codename() != "xenial"
-                else POSSIBLE_JRE_DEPENDENCIES_XENIAL
-            )
-            - required_apt_dependencies
+        if purge:
+            self._apt.purge(purge)
+        return satisfied
+
+    def plan_dependencies(self, jenkins_version=None):
+        """Work out the apt changes needed to satisfy the dependencies.
+
+        The dpkg status is read once and compared with the required
+        dependencies, see apt_dependencies().
+
+        Returns:
+            A tuple of the sorted packages to purge, of those to install and of the required
+            ones that are already installed.
+
+        """
+        installed = self._installed_packages()
+        required_apt_dependencies = set(
+            self.apt_dependencies(jenkins_version=jenkins_version, installed_packages=installed)
+        )
+        possible_jre_dependencies = (
+            POSSIBLE_JRE_DEPENDENCIES
+            if self.distro_codename() != "xenial"
+            else POSSIBLE_JRE_DEPENDENCIES_XENIAL
+        )
+        purge = (possible_jre_dependencies - required_apt_dependencies) & installed
+        install = required_apt_dependencies - installed
+        hookenv.log(
+            "Dependencies to purge: %s, to install: %s"
+            % (" ".join(sorted(purge)) or "none", " ".join(sorted(install)) or "none")
         )
+        return sorted(purge), sorted(install), sorted(required_apt_dependencies & installed)
 
-        # Install depedencies based on Jenkins version
-        self._apt.queue_install(required_apt_dependencies)
-        self._apt.install_queued()
+    def prefetch_dependencies(self, jenkins_version=None):
+        """Download the deb dependencies into the apt cache, without installing.
+
+        A later install_dependencies() then finds them there.
+        """
+        dependencies = self.apt_dependencies(jenkins_version=jenkins_version)
+        hookenv.log("Prefetching jenkins dependencies (%s)" % " ".join(dependencies))
+        env = dict(os.environ, DEBIAN_FRONTEND="noninteractive")
+        subprocess.check_call(
+            ("apt-get", "install", "--download-only", "--yes", "--quiet") + tuple(dependencies),
+            env=env,
+        )
+
+    def prefetch_jenkins(self):
+        """Download the Jenkins package, if it doesn't come from an apt source.
+
+        @returns: The path of the downloaded package, or None.
+        """
+        config = hookenv.config()
+        release = config["release"]
+        if release == "bundle":
+            if config["bundle-site"] == "":
+                return None
+            return self._fetch_bundle()
+        if release.startswith("http"):
+            return self._fetch_remote_deb(release)
+        hookenv.log("Jenkins comes from the '%s' apt source, not prefetching it" % release)
+        return None
 
     def install_tools(self):
         """Install the configured tools."""
@@ -154,6 +280,37 @@ class Packages(object):
             self._setup_source(release)
         self._apt.queue_install(["jenkins"])
 
+    def _use_jre(self, packages):
+        """Point the java alternative to the JRE among the given packages."""
+        for package in packages:
+            match = JRE_PACKAGE_PATTERN.match(package)
+            if match is None:
+                continue
+            binaries = glob.glob(JAVA_BINARIES % int(match.group(1)))
+            if binaries:
+                hookenv.log("Switching java to %s" % binaries[0])
+                subprocess.check_call(("update-alternatives", "--set", "java", binaries[0]))
+
+    def _installed_javas(self, installed_packages=None):
+        """Return the major versions of the installed JREs."""
+        if installed_packages is None:
+            installed_packages = self._installed_packages()
+        matches = map(JRE_PACKAGE_PATTERN.match, installed_packages)
+        return sorted(int(match.group(1)) for match in matches if match)
+
+    def _installed_packages(self):
+        """Return the names of the packages installed according to dpkg."""
+        output = subprocess.check_output(
+            ("dpkg-query", "--show", "--showformat", "${Package} ${db:Status-Abbrev}\n")
+        ).decode("utf-8")
+        installed = set()
+        for line in output.splitlines():
+            fields = line.split()
+            # "ii" is a package that's wanted and installed.
+            if len(fields) == 2 and fields[1] == "ii":
+                installed.add(fields[0].split(":")[0])
+        return installed
+
     def jenkins_version(self):
         return self._apt.get_package_version("jenkins", full_version=True)
 
@@ -168,13 +325,32 @@ class Packages(object):
                 message = "'%s' doesn't exist. No package bundled." % (bundle_path)
                 raise Exception(message)
         else:
-            self._jc.jenkins_repo = hookenv.config()["bundle-site"]
-            download_path = os.path.join(hookenv.charm_dir(), "files")
-            self._bundle_download(download_path)
-            bundle_path = os.path.join(download_path, "jenkins_%s_all.deb" % self._jc.core_version)
+            bundle_path = self._fetch_bundle()
         hookenv.log("Installing from bundled Jenkins package: %s:" % bundle_path)
         self._install_local_deb(bundle_path)
 
+    def _fetch_bundle(self):
+        """Download the package from bundle-site, unless it's cached.
+
+        The package is first looked up at the top of bundle-site, where the
+        cache can resume interrupted downloads, and otherwise fetched by
+        JenkinsCore in one go.
+        """
+        bundle_site = hookenv.config()["bundle-site"]
+        self._jc.jenkins_repo = bundle_site
+        name = "jenkins_%s_all.deb" % self._jc.core_version
+        bundle_path = self._cache.get(name)
+        if bundle_path is None:
+            try:
+                bundle_path = self._cache.download("%s/%s" % (bundle_site.rstrip("/"), name), name)
+            except requests.exceptions.HTTPError as error:
+                hookenv.log("Can't download %s directly: %s" % (name, error))
+                os.makedirs(paths.DEBS_CACHE, exist_ok=True)
+                self._bundle_download(paths.DEBS_CACHE)
+                bundle_path = self._cache.add(name)
+        self._cache.evict()
+        return bundle_path
+
     def _install_local_deb(self, filename):
         """Install the given local jenkins deb"""
         # Run dpkg to install bundled deb.
@@ -182,12 +358,24 @@ class Packages(object):
 
     def _install_from_remote_deb(self, url):
         """Install Jenkins from http(s) deb file."""
-        hookenv.log("Getting remote jenkins package: %s" % url)
-        tempdir = tempfile.mkdtemp()
-        target = os.path.join(tempdir, "jenkins.deb")
-        subprocess.check_call(("wget", "-q", "-O", target, url))
-        self._install_local_deb(target)
-        shutil.rmtree(tempdir)
+        self._install_local_deb(self._fetch_remote_deb(url))
+
+    def _fetch_remote_deb(self, url):
+        """Download the deb at url, unless it's cached.
+
+        Packages are cached by URL, which is expected to point to a given
+        version of Jenkins, under a name following dpkg's convention, like
+        bundles.
+
+        @returns: The path of the downloaded package.
+        """
+        name = "jenkins_%s_all.deb" % hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+        target = self._cache.get(name)
+        if target is None:
+            hookenv.log("Getting remote jenkins package: %s" % url)
+            target = self._cache.download(url, name)
+        self._cache.evict()
+        return target
 
     def _setup_source(self, release):
         """Install Jenkins archive."""
@@ -215,6 +403,20 @@ class Packages(object):
         hookenv.log("Downloading bundle from %s" % self._jc.jenkins_repo)
         self._jc.get_binary_package(path)
 
+    def available_version(self):
+        """Return the version of Jenkins that install_jenkins() would install.
+
+        That's the version on bundle-site, if it's set, or else the one of the
+        package bundled with the charm, if any.
+        """
+        if hookenv.config()["bundle-site"] != "":
+            return self._jc.core_version
+        bundle_path = os.path.join(hookenv.charm_dir(), "files", "jenkins.deb")
+        if not os.path.isfile(bundle_path):
+            return None
+        output = subprocess.check_output(("dpkg-deb", "--field", bundle_path, "Version"))
+        return output.decode("utf-8").strip()
+
     def jenkins_upgradable(self):
         """
         Verify if there's a new version of jenkins available.
@@ -231,14 +433,67 @@ class Packages(object):
         """
         Remove old plugins directories created by jenkins.deb and old versions
         of this charm.
+
+        The plugins directory is scanned once and everything to remove is
+        deleted in-process, a few entries at a time.
+
+        @returns: A tuple of the number of files and of bytes freed.
         """
-        hookenv.log("Removing outdated detached plugins from jenkins.deb")
-        os.system("sudo rm -r /var/cache/jenkins/war/WEB-INF/detached-plugins")
-        hookenv.log("Removing plugins from old charm versions")
-        for directory in glob("%s/*/" % paths.PLUGINS):
-            os.system("sudo rm -r %s" % directory)
-        # Remove plugin files with no version in its name
-        for plugin_file in glob("%s/*.jpi" % paths.PLUGINS):
-            if not re.search(r"\d\.jpi", plugin_file):
-                hookenv.log("Removing old plugin %s" % plugin_file)
-                os.system("sudo rm %s" % plugin_file)
+        targets = []
+        if os.path.isdir(paths.DETACHED_PLUGINS):
+            hookenv.log("Removing outdated detached plugins from jenkins.deb")
+            targets.append(paths.DETACHED_PLUGINS)
+        if os.path.isdir(paths.PLUGINS):
+            for name in os.listdir(paths.PLUGINS):
+                path = os.path.join(paths.PLUGINS, name)
+                # Directories are plugins exploded by old charm versions, and
+                # files with no version in their name are old plugins.
+                is_dir = os.path.isdir(path) and not os.path.islink(path)
+                if is_dir or (name.endswith(".jpi") and not re.search(r"\d\.jpi$", name)):
+                    targets.append(path)
+        if not targets:
+            return 0, 0
+        hookenv.log("Removing %d plugins from old charm versions" % len(targets))
+        with ThreadPoolExecutor(max_workers=min(CLEANUP_WORKERS, len(targets))) as executor:
+            results = list(executor.map(_remove_path, targets))
+        files = sum(result[0] for result in results)
+        size = sum(result[1] for result in results)
+        hookenv.log("Removed %d old plugin files, freeing %d bytes" % (files, size))
+        return files, size
+
+
+def _supports(java, jenkins_version):
+    """Whether the given Jenkins version runs on the given Java version.
+
+    A jenkins_version of None stands for the latest version.
+    """
+    first, unsupported = JAVA_SUPPORT[java]
+    if jenkins_version is None:
+        return unsupported is None
+    version = parse_version(jenkins_version)
+    if first is not None and version < parse_version(first):
+        return False
+    return unsupported is None or version < parse_version(unsupported)
+
+
+def _remove_path(path):
+    """Remove the file or directory tree at path.
+
+    @returns: A tuple of the number of files and of bytes removed.
+    """
+    files = size = 0
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            for root, _, names in os.walk(path):
+                for name in names:
+                    files += 1
+                    size += os.lstat(os.path.join(root, name)).st_size
+            shutil.rmtree(path)
+        else:
+            files = 1
+            size = os.lstat(path).st_size
+            os.remove(path)
+    except OSError as error:
+        hookenv.log("Failed to remove %s: %s" % (path, error), level=ERROR)
+        return 0, 0
+    return files, size
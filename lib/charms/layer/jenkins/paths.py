@@ -6,9 +6,11 @@ HOME = "/var/lib/jenkins"
 USERS = os.path.join(HOME, "users")
 PLUGINS = os.path.join(HOME, "plugins")
 PLUGINS_BACKUP = os.path.join(HOME, "plugins_charm_backup")
+PLUGINS_STAGING = os.path.join(HOME, "plugins_charm_staging")
 SECRETS = os.path.join(HOME, "secrets")
 CONFIG_FILE = os.path.join(HOME, "config.xml")
 PROXY_CONFIG_FILE = os.path.join(HOME, "proxy.xml")
+UPDATE_CENTER_CONFIG_FILE = os.path.join(HOME, "hudson.model.UpdateCenter.xml")
 SERVICE_CONFIG_FILE_OVERRIDE = "/etc/systemd/system/jenkins.service.d/override.conf"
 LOCATION_CONFIG_FILE = os.path.join(HOME, "jenkins.model.JenkinsLocationConfiguration.xml")
 DEFAULTS_CONFIG_FILE = "/etc/default/jenkins"
@@ -16,6 +18,19 @@ ADMIN_TOKEN = os.path.join(HOME, ".admin_token")
 ADMIN_PASSWORD = os.path.join(HOME, ".admin_password")
 INITIAL_PASSWORD = os.path.join(SECRETS, "initialAdminPassword")
 LAST_EXEC = os.path.join(HOME, "jenkins.install.InstallUtil.lastExecVersion")
+UPGRADE_WIZARD_STATE = os.path.join(HOME, "jenkins.install.UpgradeWizard.state")
+INIT_GROOVY = os.path.join(HOME, "init.groovy.d")
+HELPER_SCRIPT = os.path.join(INIT_GROOVY, "jenkins-charm.groovy")
+ADMIN_SEED_SCRIPT = os.path.join(INIT_GROOVY, "jenkins-charm-admin.groovy")
 LEGACY_BOOTSTRAP_FLAG = os.path.join(HOME, "config.bootstrapped")
 UPDATE_CENTER_ROOT_CAS = os.path.join(HOME, "update-center-rootCAs")
 APT_PREFERENCES = "/etc/apt/preferences"
+POLICY_RC_D = "/usr/sbin/policy-rc.d"
+PLUGINS_CACHE = "/var/cache/jenkins-charm/plugins"
+UPDATE_CENTER_CACHE = "/var/cache/jenkins-charm/update-center"
+DEBS_CACHE = "/var/cache/jenkins-charm/debs"
+CDS_ARCHIVE = "/var/cache/jenkins/jenkins.jsa"
+DETACHED_PLUGINS = "/var/cache/jenkins/war/WEB-INF/detached-plugins"
+LOG_FILE = "/var/log/jenkins/jenkins.log"
+SERVICE_UNIT_FILE = "/lib/systemd/system/jenkins.service"
+JAVA_BIN = "/usr/bin/java"
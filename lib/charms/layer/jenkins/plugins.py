@@ -1,27 +1,35 @@
+import base64
+import hashlib
 import itertools
 import glob
 import os
 import shutil
-import urllib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from distutils.dir_util import copy_tree, remove_tree
 
+import requests
+from requests.adapters import HTTPAdapter
+
 from charmhelpers.core import hookenv, host
+from charmhelpers.core.decorators import retry_on_exception
 from charms.layer.jenkins import paths
 from charms.layer.jenkins.api import Api
-
-from jenkins_plugin_manager.plugin import UpdateCenter
+from charms.layer.jenkins.cache import PluginCache
+from charms.layer.jenkins.restarts import Restarts
+from charms.layer.jenkins.staging import PluginStaging
+from charms.layer.jenkins.updatecenter import PluginSiteError, UpdateCenter  # noqa: F401
 
 
 # The plugins that are required for Jenkins to work
 REQUIRED_PLUGINS = ["instance-identity"]
 
+# Seconds to wait for the plugin site before giving up on a request.
+DOWNLOAD_TIMEOUT = 60
 
-class PluginSiteError(Exception):
-    def __init__(self):
-        self.message = (
-            "The configured plugin-site doesn't provide an "
-            "update-center.json file or is not acessible."
-        )
+
+class PluginChecksumError(requests.exceptions.RequestException):
+    """Raised when a downloaded plugin doesn't match its published sha256."""
 
 
 class Plugins(object):
@@ -43,7 +51,7 @@ class Plugins(object):
         else:
             proxy_address = None
 
-        # urllib supports the http_proxy env variable
+        # requests supports the http_proxy env variable
         if proxy_address:
             hookenv.log("Setting http_proxy env variable to %s" % proxy_address)
             os.environ["http_proxy"] = proxy_address
@@ -56,12 +64,13 @@ class Plugins(object):
             self.update_center = UpdateCenter()
         else:
             plugins_site = hookenv.config()["plugins-site"]
-            try:
-                update_center = plugins_site + "/update-center.json"
-                urllib.request.urlopen(update_center)
-                self.update_center = UpdateCenter(uc_url=update_center)
-            except urllib.error.HTTPError:
-                raise PluginSiteError()
+            self.update_center = UpdateCenter(url=plugins_site + "/update-center.json")
+
+        self._api = Api()
+        self._cache = PluginCache()
+        # Memoized resolver state, see _get_plugins_to_install().
+        self._compatible = {}
+        self._jenkins_version = None
 
     def install(self, plugins):
         """Install the given plugins, optionally removing unlisted ones.
@@ -69,28 +78,33 @@ class Plugins(object):
         @params plugins: A whitespace-separated list of plugins to install.
         """
         hookenv.log("Starting plugins installation process")
-        plugins = itertools.chain(REQUIRED_PLUGINS, (plugins or "").split())
+        plugins = list(itertools.chain(REQUIRED_PLUGINS, (plugins or "").split()))
         plugins, incompatible_plugins = self._get_plugins_to_install(plugins)
         if len(incompatible_plugins) != 0:
             hookenv.log(
                 "The following plugins require a higher jenkins version"
                 " and were not installed: (%s)" % " ".join(incompatible_plugins)
             )
-        configured_plugins = self._get_plugins_to_install(hookenv.config()["plugins"].split())
+        # The resolver memoizes its results, so resolving the configured
+        # plugins again is cheap (and free when they're the ones installed).
+        configured_plugins, _ = self._get_plugins_to_install(
+            list(itertools.chain(REQUIRED_PLUGINS, hookenv.config()["plugins"].split()))
+        )
         host.mkdir(paths.PLUGINS, owner="jenkins", group="jenkins", perms=0o0755)
         existing_plugins = set(glob.glob("%s/*.[h|j]pi" % paths.PLUGINS))
         try:
-            self._install_plugins(plugins)
+            plugin_paths = self._install_plugins(plugins)
         except Exception:
             hookenv.log("Plugin installation failed, check logs for details")
             raise
+        removed_plugins = set()
 
         plugin_file_names = tuple(map(lambda x: "/{}.jpi".format(x), configured_plugins))
         installed_plugins = set(filter(lambda x: x.endswith(plugin_file_names), existing_plugins))
         unlisted_plugins = existing_plugins - installed_plugins
         if unlisted_plugins:
             if hookenv.config()["remove-unlisted-plugins"] == "yes":
-                self._remove_plugins(unlisted_plugins)
+                removed_plugins = self._remove_plugins(unlisted_plugins)
             else:
                 hookenv.log(
                     "Unlisted plugins: (%s) Not removed. Set "
@@ -98,60 +112,264 @@ class Plugins(object):
                     "away." % ", ".join(unlisted_plugins)
                 )
 
-        # Restarting jenkins to pickup configuration changes
-        Api().restart()
+        # Only restart jenkins if the plugins on disk actually changed. The
+        # restart happens at the end of the hook, together with any other.
+        if plugin_paths or removed_plugins:
+            hookenv.log(
+                "Restarting jenkins to pick up plugin changes: %d installed or updated, "
+                "%d removed" % (len(plugin_paths), len(removed_plugins))
+            )
+            Restarts().request_restart("plugins changed")
+        else:
+            hookenv.log("Plugins are unchanged, not restarting jenkins")
         return installed_plugins, incompatible_plugins
 
+    def seed(self, plugins, jenkins_version):
+        """Download the given plugins before Jenkins is first started.
+
+        Nothing is installed yet and Jenkins isn't running, so compatibility
+        is checked against the given version and no restart is needed.
+
+        @params plugins: A whitespace-separated list of plugins to install.
+        @returns: The plugins that are incompatible with jenkins_version.
+        """
+        hookenv.log("Seeding plugins for jenkins %s" % jenkins_version)
+        self._jenkins_version = jenkins_version
+        plugins = list(itertools.chain(REQUIRED_PLUGINS, (plugins or "").split()))
+        plugins, incompatible_plugins = self._get_plugins_to_install(plugins)
+        host.mkdir(paths.PLUGINS, owner="jenkins", group="jenkins", perms=0o0755)
+        self._stage_plugins(plugins)
+        host.chownr(paths.PLUGINS, owner="jenkins", group="jenkins", chowntopdir=True)
+        return incompatible_plugins
+
+    def prefetch(self, plugins):
+        """Download the given plugins and their dependencies into the cache.
+
+        The Jenkins version isn't known yet, so nothing is excluded: seed()
+        or install() later pick the compatible plugins from the cache.
+
+        @params plugins: A whitespace-separated list of plugins to prefetch.
+        @returns: The number of plugins fetched.
+        """
+        if not self._cache.enabled:
+            hookenv.log("The plugins cache is disabled, not prefetching plugins")
+            return 0
+        plugins = list(itertools.chain(REQUIRED_PLUGINS, (plugins or "").split()))
+        requested = set(plugins)
+        resolved = set()
+        while plugins:
+            plugin = plugins.pop()
+            if plugin in resolved:
+                continue
+            resolved.add(plugin)
+            for dependency in self._get_plugin_info(plugin).get("dependencies", ()):
+                if dependency.get("optional") and dependency["name"] not in requested:
+                    continue
+                plugins.append(dependency["name"])
+        hookenv.log("Prefetching %d plugins" % len(resolved))
+        directory = tempfile.mkdtemp()
+        try:
+            return len(self._download_plugins(sorted(resolved), directory=directory))
+        finally:
+            shutil.rmtree(directory)
+
     def _install_plugins(self, plugins):
         """Install the plugins with the given names."""
         hookenv.log("Installing plugins (%s)" % " ".join(plugins))
         config = hookenv.config()
         update = config["plugins-auto-update"]
-        plugin_paths = set()
-        for plugin in plugins:
-            plugin_path = self._install_plugin(plugin, update)
-            if plugin_path is None:
-                pass
-            elif plugin_path:
-                plugin_paths.add(plugin_path)
-            else:
-                hookenv.log("Failed to download %s" % plugin)
+        installed_plugins = self._api.get_installed_plugins()
+        plugins = [
+            plugin
+            for plugin in plugins
+            if self._install_plugin(plugin, update, installed_plugins)
+        ]
+        plugin_paths = self._stage_plugins(plugins, running=True)
         # Make sure that the plugin directory is owned by jenkins
         host.chownr(paths.PLUGINS, owner="jenkins", group="jenkins", chowntopdir=True)
         return plugin_paths
 
-    def _install_plugin(self, plugin, update):
+    def _stage_plugins(self, plugins, running=False):
+        """Download and explode the given plugins, then swap them in.
+
+        @param running: Whether Jenkins is running, in which case the
+            exploded directories of updated plugins are swapped in by the
+            next restart, while Jenkins is stopped.
+        @returns: The paths of the installed plugins.
+        """
+        if not plugins:
+            return set()
+        staging = PluginStaging()
+        staging.prepare()
+        try:
+            archives = sorted(self._download_plugins(plugins, directory=staging.directory))
+            staging.explode(archives)
+            plugin_paths = staging.swap_in(archives)
+        except Exception:
+            staging.cleanup()
+            raise
+        if running and staging.deferred:
+            Restarts().run_while_stopped(staging.swap_exploded)
+        else:
+            staging.swap_exploded()
+        return plugin_paths
+
+    def _install_plugin(self, plugin, update, installed_plugins):
         """
         Verify if the plugin is not installed before installing it
         or if it needs an update .
+
+        @params installed_plugins: The inventory returned by
+            Api.get_installed_plugins().
+        @returns: Whether the plugin needs to be downloaded.
         """
-        plugin_version = Api().get_plugin_version(plugin)
+        plugin_version = installed_plugins.get(plugin, {}).get("version", False)
         latest_version = self._get_latest_version(plugin)
         if not plugin_version or (update and plugin_version != latest_version):
             hookenv.log("Installing plugin %s-%s" % (plugin, latest_version))
-            return self.update_center.download_plugin(plugin, paths.PLUGINS, with_version=False)
+            return True
         hookenv.log("Plugin %s-%s already installed" % (plugin, plugin_version))
+        return False
+
+    def _download_plugins(self, plugins, directory=paths.PLUGINS):
+        """Download the given plugins concurrently into the plugins directory.
+
+        The number of parallel downloads is bounded by the
+        plugins-download-workers config option, and all of them share one
+        pool of connections to the plugin site.
+        """
+        plugin_paths = set()
+        if not plugins:
+            return plugin_paths
+        workers = max(1, hookenv.config()["plugins-download-workers"])
+        session = self._make_session(workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(self._download_plugin, session, plugin, directory): plugin
+                for plugin in plugins
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                hookenv.status_set(
+                    "maintenance", "Downloading plugins (%d/%d)" % (done, len(plugins))
+                )
+                plugin = futures[future]
+                try:
+                    plugin_paths.add(future.result())
+                except requests.exceptions.RequestException as error:
+                    hookenv.log("Failed to download %s: %s" % (plugin, error))
+        self._cache.evict()
+        return plugin_paths
+
+    @retry_on_exception(3, base_delay=2, exc_type=requests.exceptions.RequestException)
+    def _download_plugin(self, session, plugin, directory=paths.PLUGINS):
+        """Download a single plugin, returning the path it was saved to.
+
+        Plugins whose published sha256 is in the local cache are copied from
+        there instead of being fetched again.
+        """
+        plugin_info = self._get_plugin_info(plugin)
+        url = plugin_info["url"]
+        sha256 = plugin_info.get("sha256")
+        plugin_path = os.path.join(directory, "%s.jpi" % plugin)
+        if self._cache.fetch(sha256, plugin_path):
+            hookenv.log("Installing plugin %s from cache" % plugin)
+            return plugin_path
+        hookenv.log("Downloading plugin %s from %s" % (plugin, url))
+        response = session.get(
+            url,
+            stream=True,
+            timeout=DOWNLOAD_TIMEOUT,
+            verify=hookenv.config()["plugins-check-certificate"] != "no",
+        )
+        response.raise_for_status()
+        # Download next to the final path, so that a failure never leaves a
+        # truncated plugin behind.
+        partial_path = plugin_path + ".part"
+        digest = hashlib.sha256()
+        with open(partial_path, "wb") as fd:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                digest.update(chunk)
+                fd.write(chunk)
+        if sha256 and base64.b64encode(digest.digest()).decode("ascii") != sha256:
+            os.remove(partial_path)
+            raise PluginChecksumError("Checksum mismatch for %s" % url)
+        self._cache.store(sha256, partial_path)
+        os.rename(partial_path, plugin_path)
+        return plugin_path
+
+    def _make_session(self, workers):
+        """Build an HTTP session with a connection pool sized for workers."""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
 
     def _remove_plugins(self, paths):
-        """Remove the plugins at the given paths."""
-        for path in paths:
-            self._remove_plugin(path)
+        """Remove the plugins at the given paths.
+
+        @returns: The paths that were actually removed.
+        """
+        return set(path for path in paths if self._remove_plugin(path))
 
     def _remove_plugin(self, path):
-        """Remove the plugin at the given path."""
+        """Remove the plugin at the given path, returning whether it was removed."""
         if not os.path.isfile(path):
-            return
+            return False
         hookenv.log("Deleting unlisted plugin '%s'" % path)
         os.remove(path)
+        return True
 
-    def _get_plugins_to_install(self, plugins, uc=None):
-        """Get all plugins needed to be installed"""
-        uc = uc or self.update_center
-        plugins_and_dependencies = uc.get_plugins(plugins)
-        if plugins == plugins_and_dependencies:
-            return self._exclude_incompatible_plugins(plugins)
-        else:
-            return self._get_plugins_to_install(plugins_and_dependencies, uc)
+    def _get_plugins_to_install(self, plugins):
+        """Resolve the given plugins and all their dependencies.
+
+        The dependency graph is walked depth first, so every plugin comes
+        after its dependencies. Optional dependencies are only followed if
+        they're requested too. Plugins requiring a newer jenkins, or depending
+        on one that does, are excluded in the same pass.
+
+        @returns: A tuple of the plugins to install, in install order, and of
+            the plugins that are incompatible with the jenkins version.
+        """
+        requested = set(plugins)
+        ordered = []
+        excluded = []
+        visited = set()
+        for plugin in plugins:
+            self._resolve_plugin(plugin, requested, visited, ordered, excluded)
+        return ordered, excluded
+
+    def _resolve_plugin(self, plugin, requested, visited, ordered, excluded):
+        """Add the plugin, after its dependencies, to ordered or excluded.
+
+        @returns: Whether the plugin is compatible with the jenkins version.
+        """
+        if plugin in visited:
+            # Already placed, or a dependency cycle we're in the middle of.
+            return self._compatible.get(plugin, True)
+        visited.add(plugin)
+        compatible = self._compatible.get(plugin)
+        for dependency in self._get_plugin_info(plugin).get("dependencies", ()):
+            if dependency.get("optional") and dependency["name"] not in requested:
+                continue
+            dependency_compatible = self._resolve_plugin(
+                dependency["name"], requested, visited, ordered, excluded
+            )
+            if compatible is None and not dependency_compatible:
+                compatible = False
+        if compatible is None:
+            compatible = self.update_center.check_min_core_version(
+                self._get_jenkins_version(), self._get_required_jenkins(plugin)
+            )
+        self._compatible[plugin] = compatible
+        (ordered if compatible else excluded).append(plugin)
+        return compatible
+
+    def _get_jenkins_version(self):
+        """Get the version of the running jenkins, asking it only once."""
+        if self._jenkins_version is None:
+            self._jenkins_version = self._api.version()
+        return self._jenkins_version
 
     def _get_plugin_info(self, plugin):
         """Get info of the given plugin from the UpdateCenter"""
@@ -166,18 +384,6 @@ class Plugins(object):
         """Get the jenkins version required for a plugin"""
         return self._get_plugin_info(plugin)["requiredCore"]
 
-    def _exclude_incompatible_plugins(self, plugins):
-        """Exclude plugins incompatible with the jenkins version"""
-        excluded_plugins = []
-        jenkins_version = Api().version()
-        for plugin in plugins:
-            required_version = self._get_required_jenkins(plugin)
-            if not self.update_center._check_min_core_version(jenkins_version, required_version):
-                excluded_plugins.append(plugin)
-        plugins = [plugin for plugin in plugins if plugin not in excluded_plugins]
-
-        return plugins, excluded_plugins
-
     def backup(self):
         """Backup plugins."""
         hookenv.log("Backing up plugins.")
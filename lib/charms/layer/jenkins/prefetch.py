@@ -0,0 +1,61 @@
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from charmhelpers.core import hookenv
+
+from charms.layer.jenkins.packages import Packages
+from charms.layer.jenkins.plugins import Plugins
+
+
+class Prefetch(object):
+    """Download what the install needs, all at once.
+
+    The JRE and other dependencies, the Jenkins package and the plugins are
+    installed by successive reactive handlers, but downloading them doesn't
+    depend on each other. They're fetched concurrently up front, into the
+    places the installing handlers look first: the apt cache, the package
+    cache and the plugins cache.
+    """
+
+    def __init__(self, packages=None):
+        self._packages = packages or Packages()
+
+    def run(self):
+        """Run all downloads concurrently, waiting for them to finish.
+
+        A failed download is only logged, the handler installing the
+        artifact will fetch it again.
+
+        @returns: The seconds saved over running the downloads one by one.
+        """
+        tasks = [
+            ("dependencies", self._packages.prefetch_dependencies),
+            ("jenkins", self._packages.prefetch_jenkins),
+            ("plugins", self._prefetch_plugins),
+        ]
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+            futures = [(name, executor.submit(self._timed, task)) for name, task in tasks]
+            durations = [(name, future.result()) for name, future in futures]
+        elapsed = time.time() - start
+        saved = max(0, sum(duration for _, duration in durations) - elapsed)
+        hookenv.log(
+            "Prefetched %s in %.1fs, saving %.1fs"
+            % (", ".join("%s (%.1fs)" % item for item in durations), elapsed, saved)
+        )
+        return saved
+
+    def _prefetch_plugins(self):
+        """Prefetch the configured plugins."""
+        # Fetching the update center is part of the work to overlap.
+        Plugins().prefetch(hookenv.config()["plugins"])
+
+    def _timed(self, task):
+        """Run task, returning how long it took."""
+        start = time.time()
+        try:
+            task()
+        except Exception as error:
+            hookenv.log("Prefetch failed, continuing: %s" % error, level=hookenv.WARNING)
+        return time.time() - start
@@ -0,0 +1,110 @@
+import os
+import select
+import subprocess
+import time
+
+import requests
+from charmhelpers.core import hookenv
+
+from charms.layer.jenkins import paths
+
+# Logged by Jenkins once it's done starting up.
+READY_MARKER = "Jenkins is fully up and running"
+
+# Bounds, in seconds, of the exponential backoff between probes.
+INITIAL_DELAY = 0.5
+MAX_DELAY = 10
+
+
+class ServiceUnavailable(Exception):
+    """Raised if Jenkins isn't ready before the deadline."""
+
+
+class Readiness(object):
+    """Wait for Jenkins to be ready to serve requests.
+
+    Jenkins' log is followed for the message it prints once fully up, so
+    that readiness is noticed as soon as it happens. In case the message is
+    missed (or was printed before we started looking), the home page is
+    probed with HEAD requests, backing off exponentially between them.
+    """
+
+    def __init__(self, url, timeout=None):
+        """
+        @param url: The Jenkins URL to probe.
+        @param timeout: Seconds to wait before giving up. Defaults to the
+            startup-timeout config option.
+        """
+        self.url = url
+        if timeout is None:
+            timeout = hookenv.config()["startup-timeout"]
+        self._timeout = timeout
+
+    def wait(self):
+        """Block until Jenkins is ready, raising ServiceUnavailable on timeout."""
+        deadline = time.time() + self._timeout
+        delay = INITIAL_DELAY
+        follower = self._follow_log()
+        try:
+            while not self._probe():
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise ServiceUnavailable(
+                        "Jenkins not ready after %d seconds" % self._timeout
+                    )
+                if self._wait_for_marker(follower, min(delay, remaining)):
+                    hookenv.log("Jenkins reported it's fully up and running")
+                    return
+                delay = min(delay * 2, MAX_DELAY)
+        finally:
+            if follower is not None:
+                follower.terminate()
+                follower.wait()
+
+    def _probe(self):
+        """Whether Jenkins answers requests without a server error."""
+        try:
+            response = requests.head(self.url, timeout=MAX_DELAY)
+        except requests.exceptions.RequestException:
+            return False
+        return response.status_code < 500
+
+    def _follow_log(self):
+        """Start following new Jenkins log lines, if the log can be found.
+
+        Older packages log to a file, newer ones to the systemd journal.
+        """
+        if os.path.exists(paths.LOG_FILE):
+            command = ["tail", "-F", "-n", "0", paths.LOG_FILE]
+        elif os.path.exists(paths.SERVICE_UNIT_FILE):
+            command = ["journalctl", "-u", "jenkins", "-f", "-n", "0", "-o", "cat"]
+        else:
+            return None
+        try:
+            # Unbuffered, so that select() sees every line not read yet.
+            return subprocess.Popen(
+                command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0
+            )
+        except OSError as error:
+            hookenv.log("Can't follow the Jenkins log: %s" % error)
+            return None
+
+    def _wait_for_marker(self, follower, timeout):
+        """Wait up to timeout seconds for the follower to see READY_MARKER."""
+        if follower is None:
+            time.sleep(timeout)
+            return False
+        end = time.time() + timeout
+        while True:
+            remaining = end - time.time()
+            if remaining <= 0:
+                return False
+            readable, _, _ = select.select([follower.stdout], [], [], remaining)
+            line = follower.stdout.readline() if readable else None
+            if not line:
+                # Nothing was logged in time, or the follower exited: wait
+                # for whatever is left of the timeout before the next probe.
+                time.sleep(max(0, end - time.time()))
+                return False
+            if READY_MARKER in line.decode("utf-8", "replace"):
+                return True
@@ -0,0 +1,98 @@
+import subprocess
+from typing import Any, Dict  # noqa: F401
+
+from charmhelpers.core import hookenv
+from charmhelpers.core.host import service_restart, service_start, service_stop
+
+from charms.layer.jenkins.api import Api
+
+RELOAD = "reload"
+RESTART = "restart"
+
+# Requests made during the current hook dispatch. Every hook runs in its own
+# process, so module state lives exactly as long as the dispatch.
+_pending = {
+    "action": None,
+    "daemon_reload": False,
+    "reasons": [],
+    "scheduled": False,
+    "while_stopped": [],
+}  # type: Dict[str, Any]
+
+
+class Restarts(object):
+    """Coalesce the restarts and reloads requested during a hook dispatch.
+
+    Handlers request a restart or a reload instead of performing it, and a
+    single one is carried out when the dispatch ends, a restart superseding
+    any reload.
+    """
+
+    def request_reload(self, reason):
+        """Ask for the configuration to be reloaded from disk."""
+        self._request(RELOAD, reason)
+
+    def request_restart(self, reason, daemon_reload=False):
+        """Ask for Jenkins to be restarted.
+
+        @param daemon_reload: Whether the systemd unit changed, in which case
+            systemd is reloaded and the service restarted, instead of
+            performing a safe restart through Jenkins.
+        """
+        self._request(RESTART, reason)
+        _pending["daemon_reload"] = _pending["daemon_reload"] or daemon_reload
+
+    def run_while_stopped(self, callback):
+        """Have the next restart call callback while Jenkins is stopped.
+
+        This doesn't request a restart by itself. With such callbacks, the
+        service is stopped and started again, instead of performing a safe
+        restart through Jenkins.
+        """
+        _pending["while_stopped"].append(callback)
+
+    def pending(self):
+        """Return the pending action, if any."""
+        return _pending["action"]
+
+    def flush(self):
+        """Perform the pending restart or reload now, if any.
+
+        This is called automatically at the end of the dispatch, but
+        handlers needing the outcome straight away can call it too.
+        """
+        action = _pending["action"]
+        if action is None:
+            return None
+        hookenv.log("Performing a Jenkins %s: %s" % (action, "; ".join(_pending["reasons"])))
+        api = Api()
+        if action == RESTART and (_pending["daemon_reload"] or _pending["while_stopped"]):
+            if _pending["daemon_reload"]:
+                subprocess.call(["systemctl", "daemon-reload"])
+            if _pending["while_stopped"]:
+                service_stop("jenkins")
+                try:
+                    for callback in _pending["while_stopped"]:
+                        callback()
+                finally:
+                    service_start("jenkins")
+                _pending["while_stopped"] = []
+            else:
+                service_restart("jenkins")
+            api.invalidate_client()
+        elif action == RESTART:
+            api.restart()
+        else:
+            api.reload()
+        api.wait()
+        _pending.update(action=None, daemon_reload=False, reasons=[])
+        return action
+
+    def _request(self, action, reason):
+        hookenv.log("Jenkins %s requested: %s" % (action, reason))
+        if _pending["action"] != RESTART:
+            _pending["action"] = action
+        _pending["reasons"].append(reason)
+        if not _pending["scheduled"]:
+            hookenv.atexit(self.flush)
+            _pending["scheduled"] = True
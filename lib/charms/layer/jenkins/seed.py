@@ -0,0 +1,74 @@
+import os
+import subprocess
+
+from charmhelpers.core import hookenv, host
+
+from charms.layer.jenkins import paths
+from charms.layer.jenkins.configuration import Configuration
+from charms.layer.jenkins.plugins import Plugins
+from charms.layer.jenkins.users import Users
+
+# Denies starting jenkins from maintainer scripts, see invoke-rc.d(8), while
+# leaving the services of other packages alone. The marker tells ours apart
+# from one set up by the admin.
+POLICY_RC_D_MARKER = "# Installed by the jenkins charm"
+POLICY_RC_D = """#!/bin/sh
+%s until Jenkins is seeded.
+[ "$1" = jenkins ] && exit 101
+exit 0
+""" % POLICY_RC_D_MARKER
+
+
+class Seed(object):
+    """Prepare JENKINS_HOME before Jenkins is started for the first time.
+
+    The package is kept from starting Jenkins on install, so that config
+    files, the admin user and plugins are all in place when it first starts,
+    and that first start is also the last one.
+    """
+
+    def block_start(self):
+        """Keep the package from starting Jenkins when it's installed.
+
+        @return: Whether the start is blocked.
+        """
+        if os.path.exists(paths.POLICY_RC_D) and not self.start_blocked():
+            hookenv.log("%s exists, not seeding jenkins" % paths.POLICY_RC_D)
+            return False
+        hookenv.log("Keeping jenkins from starting until it's seeded")
+        host.write_file(paths.POLICY_RC_D, POLICY_RC_D.encode("utf-8"), perms=0o755)
+        return True
+
+    def start_blocked(self):
+        """Whether block_start() kept Jenkins from starting."""
+        if not os.path.exists(paths.POLICY_RC_D):
+            return False
+        with open(paths.POLICY_RC_D) as fd:
+            return POLICY_RC_D_MARKER in fd.read()
+
+    def seed(self, jenkins_version):
+        """Write the configuration, admin user and plugins.
+
+        @param jenkins_version: The version of the installed package.
+        @return: The plugins incompatible with jenkins_version, which were
+            left out, or None if the configuration is invalid, see
+            Configuration.bootstrap().
+        """
+        configuration = Configuration()
+        if not configuration.bootstrap():
+            return None
+        configuration.set_url()
+        configuration.configure_proxy(live=False)
+        configuration.set_update_center(live=False)
+        configuration.install_helper()
+        Users().seed_admin(jenkins_version)
+        return Plugins().seed(hookenv.config()["plugins"], jenkins_version)
+
+    def start(self):
+        """Allow services to start again, and start Jenkins."""
+        if self.start_blocked():
+            os.unlink(paths.POLICY_RC_D)
+        hookenv.log("Starting seeded jenkins")
+        # Seeding may have written a systemd override.
+        subprocess.call(["systemctl", "daemon-reload"])
+        host.service_start("jenkins")
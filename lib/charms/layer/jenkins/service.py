@@ -1,24 +1,17 @@
-import requests
-
-from charmhelpers.core.decorators import retry_on_exception
-
 from charms.layer.jenkins.api import Api
-
-
-class ServiceUnavailable(Exception):
-    """Raised internally by check_ready() if the service is not ready."""
+from charms.layer.jenkins.readiness import (  # noqa: F401
+    Readiness,
+    ServiceUnavailable,
+)
 
 
 class Service(object):
     """Interact with the jenkins system service."""
 
-    _check_ready_retry = (requests.ConnectionError, ServiceUnavailable)
-
-    # Wait up to 140 seconds for Jenkins to be fully up.
-    @retry_on_exception(7, base_delay=5, exc_type=_check_ready_retry)
     def check_ready(self):
-        """Build a Jenkins client instance."""
+        """Wait for Jenkins to be ready to serve requests.
+
+        Raises ServiceUnavailable if it isn't ready within startup-timeout.
+        """
         api = Api()
-        response = requests.get(api.url)
-        if response.status_code >= 500:
-            raise ServiceUnavailable()
+        Readiness(api.url).wait()
@@ -0,0 +1,164 @@
+import os
+import shutil
+import time
+import zipfile
+
+from concurrent.futures import ThreadPoolExecutor
+
+from charmhelpers.core import hookenv, host
+
+from charms.layer.jenkins import paths
+
+# Marker of an exploded plugin, see ClassicPluginStrategy.explode(). Jenkins
+# doesn't explode the archive again as long as the marker's modification time
+# is the archive's.
+TIMESTAMP_MARKER = ".timestamp2"
+
+# Classes of old plugins, which Jenkins packs into CLASSES_JAR when exploding.
+WEB_INF_CLASSES = "WEB-INF/classes/"
+CLASSES_JAR = "WEB-INF/lib/classes.jar"
+
+# Upper bound on plugins exploded concurrently.
+MAX_WORKERS = 4
+
+
+class PluginStaging(object):
+    """Prepare plugins next to the plugins directory, and swap them in.
+
+    Plugins are downloaded and exploded the way Jenkins would do it at
+    startup, while Jenkins is still running, so restarting it doesn't take
+    unpacking them anymore. A running Jenkins loads classes from the
+    exploded directories of its plugins though, so those of updated plugins
+    are only swapped in while Jenkins is stopped, see swap_exploded().
+    """
+
+    def __init__(self, directory=paths.PLUGINS_STAGING):
+        """
+        @param directory: Where plugins are staged. It must be on the same
+            file system as the plugins directory.
+        """
+        self.directory = directory
+        # Exploded directories waiting for swap_exploded().
+        self.deferred = []
+
+    def prepare(self):
+        """Create an empty staging directory."""
+        self.cleanup()
+        host.mkdir(self.directory, owner="jenkins", group="jenkins", perms=0o755)
+
+    def cleanup(self):
+        """Remove the staging directory, and whatever was left in there."""
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+
+    def explode(self, archives):
+        """Explode the given staged plugin archives.
+
+        An archive that can't be exploded is still installed, Jenkins will
+        try again at startup.
+        """
+        if not archives:
+            return
+        workers = min(MAX_WORKERS, len(archives))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for archive, error in zip(archives, executor.map(self._explode, archives)):
+                if error is not None:
+                    hookenv.log("Not exploding %s: %s" % (os.path.basename(archive), error))
+
+    def swap_in(self, archives):
+        """Move the given staged plugins into the plugins directory.
+
+        The exploded directory of a new plugin is moved in before its
+        archive, so that Jenkins never sees an archive with an outdated
+        exploded directory. That of an updated plugin is kept for
+        swap_exploded(): until then, Jenkins would explode the plugin again
+        itself, as its archive is newer than its exploded directory.
+
+        @returns: The paths of the plugins in the plugins directory.
+        """
+        host.chownr(self.directory, owner="jenkins", group="jenkins", chowntopdir=True)
+        plugin_paths = set()
+        for archive in sorted(archives):
+            name = os.path.basename(archive)
+            exploded = os.path.splitext(archive)[0]
+            target = os.path.join(paths.PLUGINS, name)
+            if os.path.isdir(exploded):
+                if os.path.exists(_installed(archive)):
+                    self.deferred.append(exploded)
+                else:
+                    os.rename(exploded, _installed(archive))
+            os.rename(archive, target)
+            plugin_paths.add(target)
+        return plugin_paths
+
+    def swap_exploded(self):
+        """Replace the exploded directories of updated plugins, then clean up.
+
+        Jenkins must not be running, see swap_in().
+        """
+        for exploded in self.deferred:
+            target = _installed(exploded)
+            if not os.path.isdir(target):
+                os.rename(exploded, target)
+                continue
+            old = exploded + ".old"
+            os.rename(target, old)
+            os.rename(exploded, target)
+            shutil.rmtree(old)
+        self.deferred = []
+        self.cleanup()
+
+    def _explode(self, archive):
+        """Explode the given archive like ClassicPluginStrategy.explode().
+
+        @returns: The error preventing it, if any.
+        """
+        destination = os.path.splitext(archive)[0]
+        # Java may only see the modification time to the second.
+        mtime = int(time.time())
+        try:
+            with open(archive, "rb") as fd, zipfile.ZipFile(fd) as plugin:
+                classes = []
+                for info in plugin.infolist():
+                    if info.filename.startswith(WEB_INF_CLASSES):
+                        classes.append(info)
+                        continue
+                    path = plugin.extract(info, destination)
+                    _set_mtime(path, info)
+                if classes:
+                    self._pack_classes(plugin, classes, destination)
+        except (zipfile.BadZipFile, OSError) as error:
+            if os.path.isdir(destination):
+                shutil.rmtree(destination)
+            return error
+        os.utime(archive, (mtime, mtime))
+        marker = os.path.join(destination, TIMESTAMP_MARKER)
+        with open(marker, "w"):
+            pass
+        os.utime(marker, (mtime, mtime))
+        return None
+
+    def _pack_classes(self, plugin, classes, destination):
+        """Pack the WEB-INF/classes entries of plugin into classes.jar."""
+        classes_jar = os.path.join(destination, CLASSES_JAR)
+        os.makedirs(os.path.dirname(classes_jar), exist_ok=True)
+        with open(classes_jar, "wb") as fd, zipfile.ZipFile(fd, "w", zipfile.ZIP_DEFLATED) as jar:
+            for info in classes:
+                name = info.filename[len(WEB_INF_CLASSES):]
+                if not name:
+                    continue
+                entry = zipfile.ZipInfo(name, date_time=info.date_time)
+                entry.external_attr = info.external_attr
+                entry.compress_type = zipfile.ZIP_DEFLATED
+                jar.writestr(entry, plugin.read(info))
+
+
+def _installed(archive):
+    """Return where Jenkins explodes the given plugin archive."""
+    return os.path.join(paths.PLUGINS, os.path.splitext(os.path.basename(archive))[0])
+
+
+def _set_mtime(path, info):
+    """Give the extracted file the modification time of its zip entry."""
+    mtime = time.mktime(info.date_time + (0, 0, -1))
+    os.utime(path, (mtime, mtime))
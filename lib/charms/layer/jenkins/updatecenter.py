@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import time
+
+import requests
+from charmhelpers.core import hookenv, host
+from jenkins_plugin_manager.exceptions import InvalidPluginError
+from pkg_resources import parse_version
+
+from charms.layer.jenkins import paths
+
+DEFAULT_URL = "https://updates.jenkins.io/update-center.actual.json"
+
+# Seconds to wait for the plugin site before giving up on a request.
+TIMEOUT = 60
+
+
+class PluginSiteError(Exception):
+    def __init__(self):
+        self.message = (
+            "The configured plugin-site doesn't provide an "
+            "update-center.json file or is not acessible."
+        )
+
+
+class UpdateCenter(object):
+    """Plugin metadata from an update-center.json document.
+
+    The document is several megabytes, so it's kept on disk between hooks
+    along with its ETag and Last-Modified validators. It's used as is while
+    younger than the plugins-site-max-age config option, and refreshed with
+    a conditional GET afterwards.
+    """
+
+    def __init__(self, url=DEFAULT_URL, max_age=None, cache_dir=paths.UPDATE_CENTER_CACHE):
+        """
+        @param url: The URL of the update-center.json document.
+        @param max_age: Seconds the cached document is used without checking
+            for a newer one. Defaults to the plugins-site-max-age config option.
+        @param cache_dir: Where cached documents are kept.
+        """
+        self.url = url
+        if max_age is None:
+            max_age = hookenv.config()["plugins-site-max-age"] * 60
+        self._max_age = max_age
+        key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        self._cache_dir = cache_dir
+        self._document_path = os.path.join(cache_dir, key + ".json")
+        self._meta_path = os.path.join(cache_dir, key + ".meta")
+        self._data = self._load()
+
+    @property
+    def plugins(self):
+        return self._data["plugins"]
+
+    def get_plugin_data(self, plugin):
+        """Get the update center entry of the given plugin."""
+        try:
+            return self.plugins[plugin]
+        except KeyError:
+            raise InvalidPluginError("Plugin '%s' not found in %s" % (plugin, self.url))
+
+    @staticmethod
+    def check_min_core_version(jenkins_version, required_version):
+        """Whether jenkins_version satisfies the required core version."""
+        return parse_version(jenkins_version) >= parse_version(required_version)
+
+    def _load(self):
+        """Load the document, downloading it only if it's stale or changed."""
+        meta = self._read_meta()
+        cached = meta is not None and os.path.isfile(self._document_path)
+        if cached and time.time() - meta["fetched"] < self._max_age:
+            return self._parse_cached()
+
+        headers = {}
+        if cached and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if cached and meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        try:
+            response = requests.get(
+                self.url,
+                headers=headers,
+                timeout=TIMEOUT,
+                verify=hookenv.config()["plugins-check-certificate"] != "no",
+            )
+        except requests.exceptions.RequestException as error:
+            if not cached:
+                raise PluginSiteError()
+            hookenv.log("Using cached %s, refreshing it failed: %s" % (self.url, error))
+            return self._parse_cached()
+
+        if cached and response.status_code == 304:
+            hookenv.log("Cached %s is up to date" % self.url)
+            meta["fetched"] = time.time()
+            self._write_meta(meta)
+            return self._parse_cached()
+        if not response.ok:
+            raise PluginSiteError()
+
+        hookenv.log("Downloaded %s" % self.url)
+        host.mkdir(self._cache_dir, perms=0o755)
+        host.write_file(self._document_path, response.content, perms=0o644)
+        self._write_meta(
+            {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "fetched": time.time(),
+            }
+        )
+        return self._parse(response.text)
+
+    def _parse_cached(self):
+        with open(self._document_path) as fd:
+            return self._parse(fd.read())
+
+    def _parse(self, text):
+        """Parse the document, which may be wrapped in a JSONP callback."""
+        return json.loads(text[text.index("{") : text.rindex("}") + 1])
+
+    def _read_meta(self):
+        if not os.path.isfile(self._meta_path):
+            return None
+        with open(self._meta_path) as fd:
+            return json.load(fd)
+
+    def _write_meta(self, meta):
+        host.write_file(self._meta_path, json.dumps(meta).encode("utf-8"), perms=0o644)
@@ -6,15 +6,18 @@ from charmhelpers.core import hookenv
 from charmhelpers.core import host
 
 from charms.layer.jenkins import paths
-from charms.layer.jenkins.api import Api
-from charms.layer.jenkins.packages import Packages
+from charms.layer.jenkins.api import (
+    UPDATE_PASSWORD_SCRIPT,
+    Api,
+    render_init_script,
+)
 
 
 class Users(object):
     """Manage Jenkins users."""
 
     def __init__(self, packages=None):
-        self._packages = packages or Packages()
+        self._packages = packages
 
     def configure_admin(self):
         """Configure the admin user."""
@@ -24,23 +27,54 @@ class Users(object):
         api = Api(packages=self._packages)
         api.update_password(admin.username, admin.password)
 
+        self._save_password(admin.password)
+
+        if not os.path.exists(paths.LAST_EXEC):
+            # This mean it's the very first time we configure the user,
+            # and we want to create this file in order to avoid Jenkins
+            # presenting the setup wizard.
+            self._mark_setup_done(api.version())
+
+    def seed_admin(self, jenkins_version):
+        """Set up the admin user before Jenkins is first started.
+
+        The password is set by a self-deleting init.groovy.d script, and
+        the setup wizard is marked as done, so Jenkins comes up ready.
+        """
+        hookenv.log("Seeding user for jenkins")
+
+        admin = self._admin_data()
+        params = {"username": admin.username, "password": admin.password}
+        script = render_init_script(UPDATE_PASSWORD_SCRIPT, params, paths.ADMIN_SEED_SCRIPT)
+        host.mkdir(paths.INIT_GROOVY, owner="jenkins", group="nogroup")
+        host.write_file(
+            paths.ADMIN_SEED_SCRIPT,
+            script.encode("utf-8"),
+            owner="jenkins",
+            group="nogroup",
+            perms=0o0600,
+        )
+
+        self._save_password(admin.password)
+        self._mark_setup_done(jenkins_version)
+
+    def _save_password(self, password):
         # Save the password to a file. It's not used directly by this charm
         # but it's convenient for integration with third-party tools.
         host.write_file(
             paths.ADMIN_PASSWORD,
-            admin.password.encode("utf-8"),
+            password.encode("utf-8"),
             owner="root",
             group="root",
             perms=0o0600,
         )
 
-        if not os.path.exists(paths.LAST_EXEC):
-            # This mean it's the very first time we configure the user,
-            # and we want to create this file in order to avoid Jenkins
-            # presenting the setup wizard.
+    def _mark_setup_done(self, jenkins_version):
+        """Keep Jenkins from presenting the setup and upgrade wizards."""
+        for path in (paths.LAST_EXEC, paths.UPGRADE_WIZARD_STATE):
             host.write_file(
-                paths.LAST_EXEC,
-                "{}\n".format(api.version()).encode("utf-8"),
+                path,
+                "{}\n".format(jenkins_version).encode("utf-8"),
                 owner="jenkins",
                 group="nogroup",
                 perms=0o0600,
@@ -1,3 +1,4 @@
+import os
 import subprocess
 import time
 
@@ -48,6 +49,11 @@ from charms.layer.jenkins.plugins import Plugins
 from charms.layer.jenkins.plugins import PluginSiteError
 from charms.layer.jenkins.api import Api
 from charms.layer.jenkins.credentials import Credentials
+from charms.layer.jenkins.jvm import JvmProfile, java_version
+from charms.layer.jenkins.nodes import Nodes
+from charms.layer.jenkins.prefetch import Prefetch
+from charms.layer.jenkins.restarts import RESTART, Restarts
+from charms.layer.jenkins.seed import Seed
 from charms.layer.jenkins.service import Service
 from charms.layer.jenkins.storage import Storage
 
@@ -65,11 +71,26 @@ JRE_DEPENDENCIES_EVENTS = ["apt.installed.%s" % dep for dep in POSSIBLE_JRE_DEPE
 def exec_install_hooks():
     log("Invoking pre-install hooks under hooks/install.d")
     execd_preinstall("hooks/install.d")
+    # Hook handlers run before the install handlers below, which then find
+    # the downloads in place.
+    status_set("maintenance", "Downloading Jenkins and its dependencies")
+    Prefetch().run()
 
 
 def install_dependencies(jenkins_version=None):
     packages = Packages()
-    packages.install_dependencies(jenkins_version=jenkins_version)
+    java = java_version()
+    satisfied = packages.install_dependencies(jenkins_version=jenkins_version)
+    # The apt layer only flags the packages it installs itself.
+    for package in satisfied:
+        set_state("apt.installed.%s" % package)
+    if java is not None and java_version() != java and get_state("jenkins.bootstrapped"):
+        # The JVM options depend on the Java version too.
+        Configuration().set_jvm_options()
+        check_jvm_profile()
+        Restarts().request_restart(
+            "switched from Java %s to Java %s" % (java, java_version()), daemon_reload=True
+        )
 
 
 def plugins_layer():
@@ -97,6 +118,11 @@ install_dependencies = when_not(*JRE_DEPENDENCIES_EVENTS)(install_dependencies)
 def install_jenkins():
     status_set("maintenance", "Installing Jenkins")
     packages = Packages()
+    # Unless there's an existing JENKINS_HOME (e.g. on storage), keep the
+    # package from starting Jenkins: it's started once seeded, see
+    # bootstrap_jenkins().
+    if not os.path.exists(paths.CONFIG_FILE):
+        Seed().block_start()
     packages.install_jenkins()
 
 
@@ -108,13 +134,17 @@ def upgrade_jenkins():
         packages = Packages()
         if packages.jenkins_upgradable():
             status_set("maintenance", "Upgrading Jenkins")
-            packages.install_dependencies()
+            # The new version may need another JRE.
+            install_dependencies(jenkins_version=packages.available_version())
             packages.install_jenkins()
             api = Api()
+            # The package upgrade restarted Jenkins.
+            api.invalidate_client()
             api.wait()  # Wait for the upgrade to finish
             packages.clean_old_plugins()
             unitdata.kv().set("jenkins.plugins.last_update", 0)
             update_plugins()
+            refresh_class_data_sharing()
         else:
             log("No newer jenkins package is available")
 
@@ -128,12 +158,42 @@ def upgrade_jenkins():
 def bootstrap_jenkins():
     status_set("maintenance", "Bootstrapping Jenkins configuration")
     service = Service()
+    seed = Seed()
+    if seed.start_blocked():
+        status_set("maintenance", "Seeding Jenkins home")
+        try:
+            incompatible_plugins = seed.seed(Packages().jenkins_version())
+        except InvalidPluginError as err:
+            log(
+                "Found one or more invalid plugins, check if they exist at %s. "
+                "Error was: %s" % (config("plugins-site"), str(err)),
+                "ERROR",
+            )
+            status_set("blocked", str(err))
+            return
+        finally:
+            # Whatever happened, don't keep Jenkins from starting: if it
+            # wasn't fully seeded, it gets bootstrapped the usual way.
+            seed.start()
+        if incompatible_plugins is not None:
+            service.check_ready()
+            set_state("jenkins.bootstrapped")
+            check_incompatible_plugins(incompatible_plugins)
+        return
     service.check_ready()
     configuration = Configuration()
     if configuration.bootstrap():
+        configuration.install_helper()
         set_state("jenkins.bootstrapped")
 
 
+# Called once we're bootstrapped and every time the configured JRE changes.
+@when("jenkins.bootstrapped", "config.changed.jre")
+def configure_jre():
+    status_set("maintenance", "Configuring the Java runtime")
+    install_dependencies()
+
+
 # Called once we're bootstrapped and every time the configured tools
 # change.
 @when("jenkins.bootstrapped", "config.changed.tools")
@@ -151,22 +211,25 @@ def configure_tools():
 @when_any("config.changed.username", "config.changed.password", "config.changed.public-url")
 def configure_admin():
     remove_state("jenkins.configured.admin")
-    api = Api()
+    restarts = Restarts()
 
+    # All the settings below are written to files Jenkins reads at boot and
+    # applied live, so only a prefix change needs a restart.
     status_set("maintenance", "Configuring Jenkins public url")
     configuration = Configuration()
-    configuration.set_url()
-    status_set("maintenance", "Restarting Jenkins")
-    subprocess.call(["systemctl", "daemon-reload"])
-    service_restart("jenkins")
-    api.wait()
+    if configuration.set_url():
+        # The API is only served under the new prefix once Jenkins restarts,
+        # so this one can't wait for the end of the hook.
+        status_set("maintenance", "Restarting Jenkins")
+        restarts.request_restart("prefix changed", daemon_reload=True)
+        restarts.flush()
+    else:
+        Api().set_url(config("public-url"))
 
     status_set("maintenance", "Configuring admin user")
     users = Users()
     users.configure_admin()
 
-    api.reload()
-    api.wait()  # Wait for the service to be fully up
     # Inform any extension that the username/password changed
     if get_state("extension.connected"):
         extension_relation = RelationBase.from_state("extension.connected")
@@ -174,12 +237,28 @@ def configure_admin():
 
     status_set("maintenance", "Configuring proxy settings")
     configuration.configure_proxy()
-    service_restart("jenkins")
-    api.wait()
 
     set_state("jenkins.configured.admin")
 
 
+# Called once we're bootstrapped and every time the JVM options change.
+@when("jenkins.bootstrapped")
+@when_any(
+    "config.changed.jvm-heap",
+    "config.changed.jvm-gc",
+    "config.changed.jvm-gc-logging",
+    "config.changed.jvm-max-metaspace",
+    "config.changed.jvm-extra-options",
+    "config.changed.jvm-cds",
+)
+def configure_jvm():
+    status_set("maintenance", "Configuring the JVM")
+    configuration = Configuration()
+    if configuration.set_jvm_options():
+        Restarts().request_restart("JVM options changed", daemon_reload=True)
+    check_jvm_profile()
+
+
 # Called once we're bootstrapped, every time the configured plugins change
 @when("jenkins.configured.admin", "config.changed.plugins")
 def configure_plugins():
@@ -217,6 +296,7 @@ def configure_plugins():
         # so we can see what errors occur.
     set_state("jenkins.configured.plugins")
     unitdata.kv().set("jenkins.plugins.last_update", time.time())
+    refresh_class_data_sharing()
 
 
 # Called on every update-status but only runs after the
@@ -234,11 +314,31 @@ def update_plugins():
     update_interval = time.time() - (config("plugins-auto-update-interval") * 60)
     if last_update < update_interval:
         api = Api()
-        api.try_update_plugins()
+        if api.try_update_plugins(restart=False):
+            Restarts().request_restart("plugins updated")
+            refresh_class_data_sharing()
     unitdata.kv().set("jenkins.plugins.last_update", time.time())
 
 
+# Called on every update-status, to start using a class data sharing archive
+# dumped by the last stop, or to dump a new one after Jenkins or Java changed.
+@hook("update-status")
+def refresh_class_data_sharing():
+    if not config("jvm-cds") or not get_state("jenkins.bootstrapped"):
+        return
+    if Configuration().set_jvm_options():
+        restarts = Restarts()
+        # The archive isn't worth a restart of its own, but a pending one
+        # must pick up the new options.
+        if restarts.pending() == RESTART:
+            restarts.request_restart("class data sharing changed", daemon_reload=True)
+        else:
+            # Whatever restarts Jenkins next must pick up the new override.
+            subprocess.call(["systemctl", "daemon-reload"])
+
+
 @when("jenkins.configured.tools", "jenkins.configured.admin", "jenkins.configured.plugins")
+@when_not("jenkins.jvm.invalid")
 def ready():
     status_set("active", "Jenkins is running")
 
@@ -254,11 +354,33 @@ def add_slaves(master):
     if not data_changed("master.slaves", slaves):
         log("Slaves are unchanged - no need to do anything")
         return
-    api = Api()
+    secrets = Nodes().reconcile(slaves)
     for slave in slaves:
-        api.add_node(slave["slavehost"], slave["executors"], labels=slave["labels"] or ())
-        secret = api.get_node_secret(slave["slavehost"])
-        relation_set(secret=secret)
+        relation_set(secret=secrets.get(slave["slavehost"]))
+
+
+@when("jenkins.configured.admin")
+@when_not("master.available")
+def remove_slaves():
+    nodes = Nodes()
+    if not nodes.managed():
+        return
+    log("All agents departed - removing their nodes")
+    nodes.reconcile([])
+    # Make sure agents joining again are picked up by add_slaves.
+    data_changed("master.slaves", [])
+
+
+@hook("update-status")
+def remove_offline_slaves():
+    timeout = config("agent-offline-timeout")
+    if not timeout or not get_state("jenkins.configured.admin"):
+        return
+    related = ()
+    master = RelationBase.from_state("master.available")
+    if master:
+        related = {slave["slavehost"] for slave in master.slaves()}
+    Nodes().sweep(timeout, keep=related)
 
 
 @hook("jenkins-storage-attached")
@@ -277,6 +399,9 @@ def detaching():
 def migrate_charm_data():
     configuration = Configuration()
     configuration.migrate()
+    # The helper's functions may have changed with the charm.
+    if get_state("jenkins.bootstrapped"):
+        configuration.install_helper()
 
 
 @when("nrpe-external-master.available")
@@ -377,6 +502,16 @@ def check_incompatible_plugins(incompatible_plugins):
         )
 
 
+def check_jvm_profile():
+    problem = JvmProfile().problem()
+    if problem is None:
+        remove_state("jenkins.jvm.invalid")
+        return
+    log("The JVM options were not fully applied: %s" % problem, "ERROR")
+    set_state("jenkins.jvm.invalid")
+    status_set("blocked", problem)
+
+
 def recover_jenkins(plugins):
     """Try to recover jenkins in case of failure.
     Restore previous plugins and restart.
@@ -388,6 +523,7 @@ def recover_jenkins(plugins):
     plugins.restore()
     status_set("maintenance", "Restarting Jenkins")
     service_restart("jenkins")
+    api.invalidate_client()
     api.wait()  # Wait for the service to be fully up
     plugins.clean_backup()
 
@@ -397,8 +533,8 @@ def recover_jenkins(plugins):
 def configure_update_center():
     """Change Update Center configuration when config has changed."""
     log("Modifying Update Center url")
-    api = Api()
-    api.set_update_center(config("update-center"))
+    configuration = Configuration()
+    configuration.set_update_center()
 
 
 # Called when jenkins is fully bootstrapped and update-center-ca changes
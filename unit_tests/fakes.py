@@ -1,3 +1,7 @@
+import base64
+import json
+import re
+
 from collections import namedtuple
 from urllib.parse import urljoin
 
@@ -6,18 +10,32 @@ from fixtures import (
     MonkeyPatch,
 )
 
+from charms.layer.jenkins.api import HELPER_FUNCTIONS, HELPER_PROBE_SCRIPT
+
 Node = namedtuple(
     "Node", ["host", "executors", "description", "labels", "launcher"])
 
+# A call rendered by charms.layer.jenkins.api.render_script(), either inline
+# or to a resident helper function.
+SCRIPT_CALL = re.compile(
+    r'runBody\((?:\{ params ->\n(.*?)\n\}|functions\["(\w+)"\]), "([A-Za-z0-9+/=]*)"\)',
+    re.DOTALL)
+
 
 class FakeJenkins(Fixture):
     """Testable fake for the Jenkins python client."""
 
     def _setUp(self):
         self.nodes = []
-        self.scripts = {}
+        # The resident helper isn't registered, unless a test says so.
+        self.scripts = {HELPER_PROBE_SCRIPT: False}
         self.responses = {}
         self.useFixture(MonkeyPatch("jenkins.Jenkins", new_value=self))
+        # Make sure no client cached by a previous test leaks in.
+        self.useFixture(MonkeyPatch(
+            "charms.layer.jenkins.api.Api._clients", new_value={}))
+        self.useFixture(MonkeyPatch(
+            "charms.layer.jenkins.api.Api._helpers", new_value={}))
 
     def __call__(self, url, username, password):
         self.url = url
@@ -44,7 +62,33 @@ class FakeJenkins(Fixture):
                 self.nodes.remove(node)
 
     def run_script(self, script):
-        return self.scripts[script]
+        """Return the output registered for the given script.
+
+        Scripts rendered by the Api are run body by body instead: the
+        registered value is the body's result, or a callable taking its
+        params and returning it. Calls to resident helper functions are
+        dispatched to their bodies.
+        """
+        if script in self.scripts:
+            return self.scripts[script]
+        calls = SCRIPT_CALL.findall(script)
+        if not calls:
+            raise KeyError(script)
+        bodies = {key.strip(): value for key, value in self.scripts.items()}
+        results = []
+        for body, name, encoded in calls:
+            if name:
+                body = HELPER_FUNCTIONS[name].strip()
+            params = json.loads(base64.b64decode(encoded).decode("utf-8"))
+            value = bodies[body]
+            if callable(value):
+                try:
+                    value = value(params)
+                except Exception as error:
+                    results.append({"error": str(error)})
+                    continue
+            results.append({"value": value})
+        return json.dumps(results) + "\n"
 
     def jenkins_open(self, request):
         response = self.responses[request.url]
@@ -38,6 +38,7 @@ class AptInstalledJenkins(State):
 
         api = Api()
         self.fakes.network.get(api.url, headers={"X-Jenkins": "2.0.0"})
+        self.fakes.network.head(api.url, headers={"X-Jenkins": "2.0.0"})
 
 
 class JenkinsConfiguredAdmin(State):
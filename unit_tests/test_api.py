@@ -1,18 +1,35 @@
+import base64
+import os
 from unittest import mock
 from urllib.parse import urljoin
 
 from charmhelpers.core import hookenv
 from charms.layer.jenkins.api import (
-    CONFIGURE_PROXY_NO_PROXY_WITH_AUTH_SCRIPT,
-    CONFIGURE_PROXY_WITH_AUTH_SCRIPT,
-    CONFIGURE_PROXY_WITHOUT_AUTH_SCRIPT,
+    CHECK_UPDATE_CENTER_SCRIPT,
+    CONFIGURE_PROXY_SCRIPT,
+    DELETE_NODES_SCRIPT,
     DISABLE_PROXY_SCRIPT,
+    GET_INSTALLED_PLUGINS_SCRIPT,
     GET_LEGACY_TOKEN_SCRIPT,
     GET_NEW_TOKEN_SCRIPT,
+    GET_NODE_SECRET_SCRIPT,
+    GET_NODE_SECRETS_SCRIPT,
+    GET_NODES_SCRIPT,
+    GET_PLUGIN_VERSION_SCRIPT,
+    GET_UPDATABLE_PLUGINS_SCRIPT,
+    HELPER_PROBE_SCRIPT,
     SET_UPDATE_CENTER_SCRIPT,
+    SET_URL_SCRIPT,
+    UPDATE_NODES_SCRIPT,
     UPDATE_PASSWORD_SCRIPT,
+    UPDATE_PLUGINS_SCRIPT,
     Api,
+    ScriptError,
+    parse_results,
+    render_helper,
+    render_script,
 )
+from charms.layer.jenkins import paths
 from charms.layer.jenkins.packages import Packages
 from jenkins import JenkinsException
 from requests import Request, Response
@@ -26,8 +43,8 @@ class ApiTest(JenkinsTest):
     def setUp(self):
         super(ApiTest, self).setUp()
         self.useFixture(JenkinsConfiguredAdmin(self.fakes))
-        self.fakes.jenkins.scripts[GET_LEGACY_TOKEN_SCRIPT.format("admin")] = "abc\n"
-        self.fakes.jenkins.scripts[GET_NEW_TOKEN_SCRIPT.format("admin")] = "xyz\n"
+        self.fakes.jenkins.scripts[GET_LEGACY_TOKEN_SCRIPT] = "abc"
+        self.fakes.jenkins.scripts[GET_NEW_TOKEN_SCRIPT] = "xyz"
         self.apt = AptStub()
         self.packages = Packages(apt=self.apt)
         self.api = Api(packages=self.packages)
@@ -51,17 +68,79 @@ class ApiTest(JenkinsTest):
         self.fakes.jenkins.get_whoami = transient_failure
         self.assertIsNone(self.api.wait())
 
+    def test_client_reused(self):
+        """
+        The authenticated client is built once and then reused, without
+        further handshakes.
+        """
+        self.apt._set_jenkins_version("2.120.1")
+        get_whoami = self.fakes.jenkins.get_whoami
+        calls = []
+
+        def counting_get_whoami():
+            calls.append(True)
+            return get_whoami()
+
+        self.fakes.jenkins.get_whoami = counting_get_whoami
+        self.api.wait()
+        Api(packages=self.packages).wait()
+        self.assertEqual(1, len(calls))
+
+    def test_packages_lazy(self):
+        """
+        The Packages dependency is only built when it's first needed, and
+        then reused.
+        """
+        with mock.patch("charms.layer.jenkins.api.Packages") as packages:
+            api = Api()
+            packages.assert_not_called()
+            self.assertIs(packages.return_value, api._packages)
+            self.assertIs(packages.return_value, api._packages)
+        packages.assert_called_once_with()
+
+    def test_client_invalidated_on_restart(self):
+        """After a restart, a new client is built."""
+        self.apt._set_jenkins_version("2.120.1")
+        error = self._make_httperror(self.api.url, 503, "Service Unavailable")
+        self.fakes.jenkins.responses[urljoin(self.api.url, "safeRestart")] = error
+        self.api.wait()
+        with mock.patch.object(self.api, "_build_client") as mock_build_client:
+            mock_build_client.return_value = self.fakes.jenkins
+            self.api.restart()
+            mock_build_client.assert_called_once_with()
+
+    def test_client_invalidated_on_auth_failure(self):
+        """If a cached client gets a 401, the script is retried with a new client."""
+        self.apt._set_jenkins_version("2.120.1")
+        self.api.wait()
+        # The resident helper is probed once, before the first script.
+        self.api._has_helper()
+        run_script = self.fakes.jenkins.run_script
+        tries = []
+
+        def auth_failure(script):
+            try:
+                if not tries:
+                    raise JenkinsException("[401]")
+                return run_script(script)
+            finally:
+                tries.append(True)
+
+        self.fakes.jenkins.run_script = auth_failure
+        self.fakes.jenkins.scripts[DISABLE_PROXY_SCRIPT] = ""
+        self.assertIsNone(self.api.configure_proxy())
+        self.assertEqual(2, len(tries))
+
     def test_update_password(self):
         """
         The update_password() method runs a groovy script to update the
         password for the given user.
         """
         self.apt._set_jenkins_version("2.120.1")
-        username = "joe"
-        password = "new"
-        script = UPDATE_PASSWORD_SCRIPT.format(username=username, password=password)
-        self.fakes.jenkins.scripts[script] = ""
-        self.assertIsNone(self.api.update_password(username, password))
+        calls = []
+        self.fakes.jenkins.scripts[UPDATE_PASSWORD_SCRIPT] = calls.append
+        self.assertIsNone(self.api.update_password("joe", "it's new"))
+        self.assertEqual([{"username": "joe", "password": "it's new"}], calls)
 
     def test_version(self):
         """The version() method returns the version of the Jenkins server."""
@@ -195,50 +274,94 @@ class ApiTest(JenkinsTest):
         self.fakes.jenkins.responses[urljoin(self.api.url, "safeRestart")] = error
         self.api.restart()
 
+    def test_set_url(self):
+        """
+        The set_url() method updates the Jenkins URL live.
+        """
+        calls = []
+        self.fakes.jenkins.scripts[SET_URL_SCRIPT] = calls.append
+        self.assertIsNone(self.api.set_url("http://jenkins.example.com/"))
+        self.assertEqual([{"url": "http://jenkins.example.com/"}], calls)
+
     def test_get_plugin_version(self):
         """
         If the plugin is installed it will return its version
         otherwise it will return false.
         """
-        self.fakes.jenkins.scripts[
-            "println(Jenkins.instance.pluginManager.plugins.find{it.shortName == 'installed-plugin'}?.version)"
-        ] = "1"
-        self.fakes.jenkins.scripts[
-            "println(Jenkins.instance.pluginManager.plugins.find{it.shortName == 'not-installed-plugin'}?.version)"
-        ] = "null"
+        versions = {"installed-plugin": "1"}
+        self.fakes.jenkins.scripts[GET_PLUGIN_VERSION_SCRIPT] = lambda params: versions.get(
+            params["name"]
+        )
         self.assertEqual(self.api.get_plugin_version("installed-plugin"), "1")
         self.assertFalse(self.api.get_plugin_version("not-installed-plugin"))
 
+    def test_get_installed_plugins(self):
+        """
+        The get_installed_plugins() method returns the details of all the
+        installed plugins, keyed by their short name.
+        """
+        self.fakes.jenkins.scripts[GET_INSTALLED_PLUGINS_SCRIPT] = {
+            "git": {
+                "version": "4.0",
+                "enabled": True,
+                "active": True,
+                "pinned": False,
+                "hasUpdate": False,
+            }
+        }
+        self.assertEqual(
+            {
+                "git": {
+                    "version": "4.0",
+                    "enabled": True,
+                    "active": True,
+                    "pinned": False,
+                    "hasUpdate": False,
+                }
+            },
+            self.api.get_installed_plugins(),
+        )
+
     def test_configure_proxy(self):
         """Test proxy configuration."""
+        calls = []
+        self.fakes.jenkins.scripts[CONFIGURE_PROXY_SCRIPT] = calls.append
         # Firstly without authentication
         hostname = "proxy.example.tld"
         port = 3128
-        script = CONFIGURE_PROXY_WITHOUT_AUTH_SCRIPT.format(hostname=hostname, port=port)
-        self.fakes.jenkins.scripts[script] = ""
-        self.assertIsNone(self.api.configure_proxy(hostname, port))
+        self.assertIsNone(self.api.configure_proxy(hostname, str(port)))
         # Then with authentication
-        username = "admin"
-        password = "x"
-        script = CONFIGURE_PROXY_WITH_AUTH_SCRIPT.format(
-            hostname=hostname, port=port, username=username, password=password
-        )
-        self.fakes.jenkins.scripts[script] = ""
-        self.assertIsNone(self.api.configure_proxy(hostname, port, username, password))
+        self.assertIsNone(self.api.configure_proxy(hostname, port, "admin", "x"))
         # Then with no proxy
-        no_proxy = "testing.test"
-        script = CONFIGURE_PROXY_NO_PROXY_WITH_AUTH_SCRIPT.format(
-            hostname=hostname,
-            port=port,
-            username=username,
-            password=password,
-            no_proxy_hosts=no_proxy,
+        self.assertIsNone(self.api.configure_proxy(hostname, port, "admin", "x", "testing.test"))
+        self.assertEqual(
+            [
+                {
+                    "hostname": hostname,
+                    "port": port,
+                    "username": None,
+                    "password": None,
+                    "noProxyHosts": None,
+                },
+                {
+                    "hostname": hostname,
+                    "port": port,
+                    "username": "admin",
+                    "password": "x",
+                    "noProxyHosts": None,
+                },
+                {
+                    "hostname": hostname,
+                    "port": port,
+                    "username": "admin",
+                    "password": "x",
+                    "noProxyHosts": "testing.test",
+                },
+            ],
+            calls,
         )
-        self.fakes.jenkins.scripts[script] = ""
-        self.assertIsNone(self.api.configure_proxy(hostname, port, username, password, no_proxy))
         # And finally removal
-        script = DISABLE_PROXY_SCRIPT
-        self.fakes.jenkins.scripts[script] = ""
+        self.fakes.jenkins.scripts[DISABLE_PROXY_SCRIPT] = None
         self.assertIsNone(self.api.configure_proxy())
 
     def test_quiet_down(self):
@@ -305,97 +428,245 @@ class ApiTest(JenkinsTest):
         def failure(*args, **kwargs):
             raise JenkinsException("error")
 
-        self.fakes.jenkins.scripts[
-            'println(jenkins.model.Jenkins.getInstance().getComputer("jenkins-agent-0").getJnlpMac())'
-        ] = "23737cc9d891deaeb117fea094b62ee34cbedfd3478bf2209c97c390f73d48f2"
+        secret = "23737cc9d891deaeb117fea094b62ee34cbedfd3478bf2209c97c390f73d48f2"
+        secrets = {"jenkins-agent-0": secret}
+        self.fakes.jenkins.scripts[GET_NODE_SECRET_SCRIPT] = lambda params: secrets[
+            params["name"]
+        ]
+        self.assertEqual(self.api.get_node_secret("jenkins-agent-0"), secret)
+        self.fakes.jenkins.scripts[GET_NODE_SECRET_SCRIPT] = failure
+        self.assertFalse(self.api.get_node_secret("jenkins-agent-10"))
+
+    def test_get_nodes(self):
+        """
+        The get_nodes() method returns the nodes defined in Jenkins.
+        """
+        self.fakes.jenkins.scripts[GET_NODES_SCRIPT] = {
+            "slave-0": {"executors": 2, "labels": "python"}
+        }
         self.assertEqual(
-            self.api.get_node_secret("jenkins-agent-0"),
-            "23737cc9d891deaeb117fea094b62ee34cbedfd3478bf2209c97c390f73d48f2",
+            {"slave-0": {"executors": 2, "labels": "python"}}, self.api.get_nodes()
         )
-        self.fakes.jenkins.run_script = failure
-        self.assertFalse(self.api.get_node_secret("jenkins-agent-10"))
+
+    def test_update_nodes(self):
+        """
+        The update_nodes() method patches existing nodes with one script.
+        """
+        calls = []
+        self.fakes.jenkins.scripts[UPDATE_NODES_SCRIPT] = calls.append
+        nodes = {"slave-0": {"executors": 2, "labels": "python"}}
+        self.api.update_nodes(nodes)
+        self.assertEqual([{"nodes": nodes}], calls)
+        self.assertIn("INFO: Updating nodes: slave-0", self.fakes.juju.log)
+
+    def test_delete_nodes(self):
+        """
+        The delete_nodes() method deletes all the given nodes with one script.
+        """
+        calls = []
+        self.fakes.jenkins.scripts[DELETE_NODES_SCRIPT] = calls.append
+        self.assertIsNone(self.api.delete_nodes(["slave-1", "slave-0"]))
+        self.assertEqual([{"names": ["slave-0", "slave-1"]}], calls)
+        self.assertIn("INFO: Deleting nodes: slave-0, slave-1", self.fakes.juju.log)
+
+    def test_get_node_secrets(self):
+        """
+        The get_node_secrets() method fetches all secrets with one script.
+        """
+        secrets = {"slave-0": "abc"}
+        self.fakes.jenkins.scripts[GET_NODE_SECRETS_SCRIPT] = lambda params: {
+            name: secrets.get(name) for name in params["names"]
+        }
+        self.assertEqual(
+            {"slave-0": "abc", "slave-1": None},
+            self.api.get_node_secrets(["slave-1", "slave-0"]),
+        )
+
+    def test_get_node_secrets_none(self):
+        """
+        No script is run if no secret is needed.
+        """
+        self.assertEqual({}, self.api.get_node_secrets([]))
 
     def test_set_update_center(self):
         """
         The set_update_center() method runs a groovy script to modify the
         update center url.
         """
+        calls = []
+        self.fakes.jenkins.scripts[SET_UPDATE_CENTER_SCRIPT] = calls.append
         url = "https://example.jenkins.io/update_center.json"
-        script = SET_UPDATE_CENTER_SCRIPT.format(url=url)
-        self.fakes.jenkins.scripts[script] = ""
         self.assertIsNone(self.api.set_update_center(url))
+        self.assertEqual([{"url": url}], calls)
 
     def test_reset_update_center(self):
         """
         The set_update_center() method runs a groovy script to modify the
         update center url to default when no url value is given.
         """
-        url = "https://updates.jenkins.io/stable/update-center.json"
-        script = SET_UPDATE_CENTER_SCRIPT.format(url=url)
-        self.fakes.jenkins.scripts[script] = ""
+        calls = []
+        self.fakes.jenkins.scripts[SET_UPDATE_CENTER_SCRIPT] = calls.append
         self.assertIsNone(self.api.set_update_center())
+        self.assertEqual([{"url": "https://updates.jenkins.io/stable/update-center.json"}], calls)
 
     def test_check_update_center(self):
         """
-        The set_update_center() method runs a groovy script to modify the
-        update center url to default when no url value is given.
+        The check_update_center() method runs a groovy script to refresh the
+        update center metadata.
         """
-        script = (
-            "Jenkins.instance.getUpdateCenter().getSites().each { site ->"
-            "  site.updateDirectlyNow(hudson.model.DownloadService.signatureCheck)"
-            "};"
-            "hudson.model.DownloadService.Downloadable.all().each { downloadable ->"
-            "  downloadable.updateNow();"
-            "}"
-        )
-        self.fakes.jenkins.scripts[script] = ""
+        self.fakes.jenkins.scripts[CHECK_UPDATE_CENTER_SCRIPT] = None
         self.assertIsNone(self.api.check_update_center())
 
     def test_get_updatable_plugins(self):
         """get_updatable_plugins() should return a list of plugins"""
-        script = (
-            "println(Jenkins.instance.pluginManager.activePlugins.findAll {"
-            "  it -> it.hasUpdate()"
-            "}.collect {"
-            "  it -> it.getShortName()"
-            "})"
-        )
-        self.fakes.jenkins.scripts[script] = "[ plugin1 plugin2 ]"
+        self.fakes.jenkins.scripts[GET_UPDATABLE_PLUGINS_SCRIPT] = ["plugin1", "plugin2"]
         self.assertEqual(self.api.get_updatable_plugins(), ["plugin1", "plugin2"])
 
     def test_update_plugins(self):
         """update_plugins() should return the number of plugins updated"""
-        script = (
-            "def plugins = Jenkins.instance.pluginManager.activePlugins.findAll {"
-            "  it -> it.hasUpdate()"
-            "}.collect {"
-            "  it -> it.getShortName()"
-            "};"
-            "long count;"
-            "Jenkins.instance.pluginManager.install(plugins, false).each { plugin ->"
-            "  ++count"
-            "};"
-            "println(count)"
-        )
-        self.fakes.jenkins.scripts[script] = "2"
+        self.fakes.jenkins.scripts[UPDATE_PLUGINS_SCRIPT] = 2
         self.assertEqual(self.api.update_plugins(), 2)
 
+    def test_run_scripts(self):
+        """
+        Several script bodies can be run in a single round trip, getting
+        their results back in order.
+        """
+        scripts = []
+        run_script = self.fakes.jenkins.run_script
+
+        def counting_run_script(script):
+            scripts.append(script)
+            return run_script(script)
+
+        self.api.wait()
+        # The resident helper is probed once, before the first script.
+        self.api._has_helper()
+        self.fakes.jenkins.run_script = counting_run_script
+        self.fakes.jenkins.scripts[GET_UPDATABLE_PLUGINS_SCRIPT] = ["plugin1"]
+        self.fakes.jenkins.scripts[UPDATE_PLUGINS_SCRIPT] = 1
+        self.assertEqual(
+            [["plugin1"], 1],
+            self.api._run_scripts(
+                [(GET_UPDATABLE_PLUGINS_SCRIPT, {}), (UPDATE_PLUGINS_SCRIPT, {})]
+            ),
+        )
+        self.assertEqual(1, len(scripts))
+
+    def test_run_script_error(self):
+        """
+        Failures on the Jenkins side are raised as ScriptError.
+        """
+        def failure(params):
+            raise Exception("java.lang.NullPointerException")
+
+        self.fakes.jenkins.scripts[GET_NODES_SCRIPT] = failure
+        error = self.assertRaises(ScriptError, self.api.get_nodes)
+        self.assertEqual("Script failed: java.lang.NullPointerException", str(error))
+
+    def test_run_script_unexpected_output(self):
+        """
+        Output which isn't a JSON document is raised as ScriptError.
+        """
+        self.api.wait()
+        self.fakes.jenkins.run_script = lambda script: "groovy.lang.MissingMethodException"
+        self.assertRaises(ScriptError, self.api.get_nodes)
+
+    def test_resident_helper(self):
+        """
+        If the resident helper is registered, its functions are called by
+        name instead of sending the script bodies.
+        """
+        scripts = []
+        run_script = self.fakes.jenkins.run_script
+
+        def recording_run_script(script):
+            scripts.append(script)
+            return run_script(script)
+
+        self.api.wait()
+        self.fakes.jenkins.run_script = recording_run_script
+        self.fakes.jenkins.scripts[HELPER_PROBE_SCRIPT] = True
+        self.fakes.jenkins.scripts[GET_NODES_SCRIPT] = {}
+        self.assertEqual({}, self.api.get_nodes())
+        self.assertEqual({}, self.api.get_nodes())
+        # The helper is probed only once.
+        self.assertEqual(3, len(scripts))
+        self.assertIn('runBody(functions["getNodes"], "e30=")', scripts[-1])
+        self.assertNotIn("collectEntries", scripts[-1])
+
+    def test_resident_helper_not_registered(self):
+        """
+        If the resident helper isn't registered, script bodies are sent.
+        """
+        self.fakes.jenkins.scripts[GET_NODES_SCRIPT] = {}
+        self.assertEqual({}, self.api.get_nodes())
+        self.assertFalse(self.api._has_helper())
+
+    def test_resident_helper_load(self):
+        """
+        If the resident helper was installed but Jenkins didn't run it yet,
+        it gets loaded.
+        """
+        os.makedirs(paths.INIT_GROOVY)
+        with open(paths.HELPER_SCRIPT, "w") as fd:
+            fd.write(render_helper())
+        self.fakes.jenkins.scripts[render_helper()] = ""
+        self.assertTrue(self.api._has_helper())
+        self.assertEqual(
+            "INFO: Loading the charm helper into Jenkins", self.fakes.juju.log[-1]
+        )
+
+    def test_resident_helper_load_failure(self):
+        """
+        If the resident helper can't be loaded, script bodies are sent.
+        """
+        os.makedirs(paths.INIT_GROOVY)
+        with open(paths.HELPER_SCRIPT, "w") as fd:
+            fd.write(render_helper())
+        run_script = self.fakes.jenkins.run_script
+
+        def failing_run_script(script):
+            if script == render_helper():
+                raise JenkinsException("error")
+            return run_script(script)
+
+        self.api.wait()
+        self.fakes.jenkins.run_script = failing_run_script
+        self.assertFalse(self.api._has_helper())
+        self.assertEqual(
+            "ERROR: Failed to load the charm helper: error", self.fakes.juju.log[-1]
+        )
+
+    def test_render_script(self):
+        """
+        Parameters are passed as base64-encoded JSON, so they need no quoting.
+        """
+        script = render_script([(GET_PLUGIN_VERSION_SCRIPT, {"name": "it's"})])
+        encoded = base64.b64encode(b'{"name": "it\'s"}').decode("ascii")
+        self.assertIn('"%s")' % encoded, script)
+        self.assertNotIn("it's", script)
+
+    def test_parse_results(self):
+        """
+        Output printed by script bodies before the results is ignored.
+        """
+        self.assertEqual([1, None], parse_results('hello\n[{"value": 1}, {"value": null}]\n'))
+
     @mock.patch("charms.layer.jenkins.api.Api.restart")
     @mock.patch("charms.layer.jenkins.api.Api.update_plugins")
-    @mock.patch("charms.layer.jenkins.api.Api.get_updatable_plugins")
-    @mock.patch("charms.layer.jenkins.api.Api.check_update_center")
-    def test_try_update_plugins(
-        self,
-        mock_check_update_center,
-        mock_get_updatable_plugins,
-        mock_update_plugins,
-        mock_restart,
-    ):
+    def test_try_update_plugins(self, mock_update_plugins, mock_restart):
         """try_update_plugins() should return the number of plugins updated"""
         plugins = ["plugin1", "plugin2"]
-        mock_get_updatable_plugins.return_value = plugins
+        self.fakes.jenkins.scripts[CHECK_UPDATE_CENTER_SCRIPT] = None
+        self.fakes.jenkins.scripts[GET_UPDATABLE_PLUGINS_SCRIPT] = plugins
         # Test the update
         self.assertEqual(self.api.try_update_plugins(), plugins)
+        mock_restart.assert_called_once_with()
+        # Restarting can be left to the caller
+        mock_restart.reset_mock()
+        self.assertEqual(self.api.try_update_plugins(restart=False), plugins)
+        mock_restart.assert_not_called()
         # Test when there are no plugins to be updated
-        mock_get_updatable_plugins.return_value = []
+        self.fakes.jenkins.scripts[GET_UPDATABLE_PLUGINS_SCRIPT] = []
         self.assertEqual(self.api.try_update_plugins(), False)
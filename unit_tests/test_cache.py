@@ -0,0 +1,209 @@
+import base64
+import hashlib
+import os
+
+from testtools.matchers import (
+    FileContains,
+    PathExists,
+    Not,
+)
+
+from charmtest import CharmTest
+
+from charms.layer.jenkins import paths
+from charms.layer.jenkins.cache import IncompleteDownload, PackageCache, PluginCache
+
+
+def checksum(data):
+    return base64.b64encode(hashlib.sha256(data).digest()).decode("ascii")
+
+
+class PluginCacheTest(CharmTest):
+
+    def setUp(self):
+        super(PluginCacheTest, self).setUp()
+        self.fakes.fs.add(paths.PLUGINS)
+        os.makedirs(paths.PLUGINS)
+        self.cache = PluginCache(max_size=10)
+        self.source = os.path.join(paths.PLUGINS, "source.jpi")
+        self.dest = os.path.join(paths.PLUGINS, "dest.jpi")
+
+    def _write(self, path, data):
+        with open(path, "wb") as fd:
+            fd.write(data)
+
+    def test_store_and_fetch(self):
+        """A stored file can be fetched back using its checksum."""
+        self._write(self.source, b"data")
+        self.cache.store(checksum(b"data"), self.source)
+        self.assertTrue(self.cache.fetch(checksum(b"data"), self.dest))
+        self.assertThat(self.dest, FileContains("data"))
+
+    def test_fetch_miss(self):
+        """Fetching an unknown checksum returns False."""
+        self.assertFalse(self.cache.fetch(checksum(b"data"), self.dest))
+        self.assertThat(self.dest, Not(PathExists()))
+
+    def test_no_checksum(self):
+        """Without a checksum nothing is cached."""
+        self._write(self.source, b"data")
+        self.cache.store(None, self.source)
+        self.assertFalse(self.cache.fetch(None, self.dest))
+        self.assertThat(paths.PLUGINS_CACHE, Not(PathExists()))
+
+    def test_invalid_checksum(self):
+        """Checksums that aren't valid base64 are ignored."""
+        self._write(self.source, b"data")
+        self.cache.store("!", self.source)
+        self.assertThat(paths.PLUGINS_CACHE, Not(PathExists()))
+
+    def test_short_checksum(self):
+        """Checksums that aren't sha256 digests are ignored."""
+        self._write(self.source, b"data")
+        self.cache.store(base64.b64encode(b"short").decode("ascii"), self.source)
+        self.assertThat(paths.PLUGINS_CACHE, Not(PathExists()))
+
+    def test_fetch_corrupted(self):
+        """Cached files not matching their checksum are discarded."""
+        self._write(self.source, b"data")
+        self.cache.store(checksum(b"data"), self.source)
+        self._write(self.cache._cached_path(checksum(b"data")), b"corrupted")
+        self.assertFalse(self.cache.fetch(checksum(b"data"), self.dest))
+        self.assertThat(self.cache._cached_path(checksum(b"data")), Not(PathExists()))
+        self.assertThat(self.dest, Not(PathExists()))
+
+    def test_disabled(self):
+        """A cache with a maximum size of 0 is disabled."""
+        cache = PluginCache(max_size=0)
+        self._write(self.source, b"data")
+        cache.store(checksum(b"data"), self.source)
+        self.assertFalse(cache.fetch(checksum(b"data"), self.dest))
+
+    def test_evict(self):
+        """Least recently used entries are evicted first."""
+        for data in (b"aaaa", b"bbbb", b"cccc"):
+            self._write(self.source, data)
+            self.cache.store(checksum(data), self.source)
+        old = self.cache._cached_path(checksum(b"aaaa"))
+        os.utime(old, (0, 0))
+        self.cache.evict()
+        self.assertFalse(self.cache.fetch(checksum(b"aaaa"), self.dest))
+        self.assertTrue(self.cache.fetch(checksum(b"bbbb"), self.dest))
+        self.assertTrue(self.cache.fetch(checksum(b"cccc"), self.dest))
+
+    def test_evict_no_cache(self):
+        """Evicting from a cache that was never populated is a no-op."""
+        self.assertIsNone(self.cache.evict())
+
+
+class PackageCacheTest(CharmTest):
+
+    def setUp(self):
+        super(PackageCacheTest, self).setUp()
+        self.cache = PackageCache()
+
+    def test_download(self):
+        """Downloaded packages are found in the cache."""
+        self.fakes.network.get("http://x/jenkins.deb", content=b"data")
+        self.assertIsNone(self.cache.get("jenkins.deb"))
+        path = self.cache.download("http://x/jenkins.deb", "jenkins.deb")
+        self.assertThat(path, FileContains("data"))
+        self.assertThat(
+            path + ".sha256",
+            FileContains("%s  jenkins.deb\n" % hashlib.sha256(b"data").hexdigest()),
+        )
+        self.assertEqual(path, self.cache.get("jenkins.deb"))
+
+    def test_download_resume(self):
+        """An interrupted download is resumed where it stopped."""
+        os.makedirs(paths.DEBS_CACHE)
+        partial_path = self.cache.path("jenkins.deb") + ".part"
+        with open(partial_path, "wb") as fd:
+            fd.write(b"da")
+        with open(partial_path + ".validator", "w") as fd:
+            fd.write('"etag"')
+        self.fakes.network.get(
+            "http://x/jenkins.deb",
+            status_code=206,
+            content=b"ta",
+            headers={"Content-Range": "bytes 2-3/4"},
+        )
+        path = self.cache.download("http://x/jenkins.deb", "jenkins.deb")
+        self.assertThat(path, FileContains("data"))
+        self.assertThat(partial_path + ".validator", Not(PathExists()))
+        request = self.fakes.network.request_history[-1]
+        self.assertEqual("bytes=2-", request.headers["Range"])
+        self.assertEqual('"etag"', request.headers["If-Range"])
+
+    def test_download_resume_changed(self):
+        """A package that changed since the download started is fetched again."""
+        os.makedirs(paths.DEBS_CACHE)
+        partial_path = self.cache.path("jenkins.deb") + ".part"
+        with open(partial_path, "wb") as fd:
+            fd.write(b"da")
+        with open(partial_path + ".validator", "w") as fd:
+            fd.write('"old"')
+        self.fakes.network.get("http://x/jenkins.deb", content=b"new data")
+        path = self.cache.download("http://x/jenkins.deb", "jenkins.deb")
+        self.assertThat(path, FileContains("new data"))
+
+    def test_download_resume_no_validator(self):
+        """Without a validator to check it against, a partial file is dropped."""
+        os.makedirs(paths.DEBS_CACHE)
+        with open(self.cache.path("jenkins.deb") + ".part", "wb") as fd:
+            fd.write(b"da")
+        self.fakes.network.get("http://x/jenkins.deb", content=b"data")
+        path = self.cache.download("http://x/jenkins.deb", "jenkins.deb")
+        self.assertThat(path, FileContains("data"))
+        request = self.fakes.network.request_history[-1]
+        self.assertNotIn("Range", request.headers)
+
+    def test_download_truncated(self):
+        """A download shorter than announced is resumed by the next retry."""
+        self.fakes.network.get(
+            "http://x/jenkins.deb",
+            [
+                {"content": b"da", "headers": {"Content-Length": "4", "ETag": '"etag"'}},
+                {
+                    "status_code": 206,
+                    "content": b"ta",
+                    "headers": {"Content-Range": "bytes 2-3/4"},
+                },
+            ],
+        )
+        path = self.cache.download("http://x/jenkins.deb", "jenkins.deb")
+        self.assertThat(path, FileContains("data"))
+        request = self.fakes.network.request_history[-1]
+        self.assertEqual("bytes=2-", request.headers["Range"])
+        self.assertEqual('"etag"', request.headers["If-Range"])
+
+    def test_download_truncated_give_up(self):
+        """Downloads that keep coming up short are never added to the cache."""
+        self.fakes.network.get(
+            "http://x/jenkins.deb", content=b"da", headers={"Content-Length": "4"}
+        )
+        self.assertRaises(
+            IncompleteDownload, self.cache.download, "http://x/jenkins.deb", "jenkins.deb"
+        )
+        self.assertIsNone(self.cache.get("jenkins.deb"))
+
+    def test_get_corrupted(self):
+        """Packages not matching their checksum are discarded."""
+        self.fakes.network.get("http://x/jenkins.deb", content=b"data")
+        path = self.cache.download("http://x/jenkins.deb", "jenkins.deb")
+        with open(path, "wb") as fd:
+            fd.write(b"dat")
+        self.assertIsNone(self.cache.get("jenkins.deb"))
+        self.assertThat(path, Not(PathExists()))
+
+    def test_evict(self):
+        """Only the most recently used packages are kept."""
+        for mtime, name in enumerate(("one.deb", "two.deb", "three.deb")):
+            self.fakes.network.get("http://x/%s" % name, content=b"data")
+            path = self.cache.download("http://x/%s" % name, name)
+            os.utime(path, (mtime, mtime))
+        self.cache.evict(keep=2)
+        self.assertEqual(
+            ["three.deb", "three.deb.sha256", "two.deb", "two.deb.sha256"],
+            sorted(os.listdir(paths.DEBS_CACHE)),
+        )
@@ -1,5 +1,5 @@
 import os
-from lib.charms.layer.jenkins.api import DISABLE_PROXY_SCRIPT, CONFIGURE_PROXY_WITHOUT_AUTH_SCRIPT
+from lib.charms.layer.jenkins.api import DISABLE_PROXY_SCRIPT
 
 from testtools.matchers import (
     FileContains,
@@ -13,6 +13,7 @@ from systemfixtures.matchers import HasOwnership
 from charmtest import CharmTest
 
 from charms.layer.jenkins import paths
+from charms.layer.jenkins.api import HELPER_KEY
 from charms.layer.jenkins.configuration import Configuration
 
 from states import AptInstalledJenkins
@@ -59,6 +60,71 @@ class ConfigurationTest(JenkinsTest):
         # being tested in `test_api.py`).
         self.configuration.configure_proxy()
 
+    @mock.patch("charms.layer.jenkins.api.Api.configure_proxy")
+    def test_configure_proxy_file(self, mock_configure_proxy):
+        """
+        The proxy settings are written to proxy.xml for Jenkins to pick them
+        up at boot, and applied live.
+        """
+        config = hookenv.config()
+        orig_config = dict(config)
+        try:
+            config["proxy-hostname"] = "proxy.example.tld"
+            config["proxy-username"] = "joe"
+            config["proxy-password"] = "p&ss"
+            config["no-proxy"] = "a<b"
+            self.configuration.configure_proxy()
+            self.assertThat(paths.PROXY_CONFIG_FILE, HasOwnership(123, 456))
+            for line in (
+                "<name>proxy.example.tld</name>",
+                "<port>3128</port>",
+                "<userName>joe</userName>",
+                "<password>cCZzcw==</password>",
+                "<noProxyHost>a&lt;b</noProxyHost>",
+            ):
+                self.assertThat(
+                    paths.PROXY_CONFIG_FILE, FileContains(matcher=Contains(line)))
+            mock_configure_proxy.assert_called_once_with(
+                "proxy.example.tld", 3128, "joe", "p&ss", "a<b")
+
+            # Without a proxy, the file is removed.
+            config["proxy-hostname"] = ""
+            self.configuration.configure_proxy(live=False)
+            self.assertThat(paths.PROXY_CONFIG_FILE, Not(FileExists()))
+            self.assertEqual(1, mock_configure_proxy.call_count)
+        finally:
+            config.update(orig_config)
+
+    @mock.patch("charms.layer.jenkins.api.Api.set_update_center")
+    def test_set_update_center(self, mock_set_update_center):
+        """
+        The update center is written to its configuration file for Jenkins
+        to pick it up at boot, and applied live.
+        """
+        url = "https://example.jenkins.io/update-center.json"
+        orig_update_center = hookenv.config()["update-center"]
+        try:
+            hookenv.config()["update-center"] = url
+            self.configuration.set_update_center()
+        finally:
+            hookenv.config()["update-center"] = orig_update_center
+        self.assertThat(
+            paths.UPDATE_CENTER_CONFIG_FILE,
+            FileContains(matcher=Contains("<url>%s</url>" % url)))
+        mock_set_update_center.assert_called_once_with(url)
+
+    @mock.patch("charms.layer.jenkins.api.Api.set_update_center")
+    def test_set_update_center_default(self, mock_set_update_center):
+        """
+        Without a custom Update Center, the default one is configured.
+        """
+        self.configuration.set_update_center(live=False)
+        self.assertThat(
+            paths.UPDATE_CENTER_CONFIG_FILE,
+            FileContains(matcher=Contains(
+                "<url>https://updates.jenkins.io/stable/update-center.json</url>")))
+        mock_set_update_center.assert_not_called()
+
     def test_set_prefix1(self):
         # No previous config, a prefix, expected change
         self.configuration._set_prefix("/jenkins")
@@ -76,6 +142,12 @@ class ConfigurationTest(JenkinsTest):
             FileContains(
                 matcher=Contains("/jenkins-alt")))
 
+    def test_set_prefix_unchanged(self):
+        # Setting the same prefix again is reported as no change
+        self.assertTrue(self.configuration._set_prefix("/jenkins"))
+        self.assertFalse(self.configuration._set_prefix("/jenkins"))
+        self.assertTrue(self.configuration._set_prefix(""))
+
     def test_set_prefix3(self):
         # Previous config, no prefix, expected change
         self.configuration._set_prefix("/jenkins")
@@ -85,6 +157,37 @@ class ConfigurationTest(JenkinsTest):
             Not(FileContains(
                 matcher=Contains("/jenkins"))))
 
+    @mock.patch("charms.layer.jenkins.jvm.JvmProfile._total_memory", return_value=2048)
+    def test_set_jvm_options(self, mock_total_memory):
+        # The JVM options are rendered next to the prefix, and only reported
+        # as changed when they do.
+        orig_heap = hookenv.config()["jvm-heap"]
+        try:
+            hookenv.config()["jvm-heap"] = "auto"
+            self.assertTrue(self.configuration.set_jvm_options())
+            self.assertThat(
+                paths.SERVICE_CONFIG_FILE_OVERRIDE,
+                FileContains(matcher=Contains(
+                    'Environment="JAVA_OPTS=-Djava.awt.headless=true -Xms1024m -Xmx1024m')))
+            self.assertFalse(self.configuration.set_jvm_options())
+            hookenv.config()["jvm-heap"] = "512m"
+            self.assertTrue(self.configuration.set_jvm_options())
+        finally:
+            hookenv.config()["jvm-heap"] = orig_heap
+        self.assertThat(
+            paths.SERVICE_CONFIG_FILE_OVERRIDE,
+            FileContains(matcher=Contains("-Xmx512m")))
+
+    def test_set_jvm_options_default(self):
+        # Without JVM options configured, the override only sets the
+        # prefix, as it did before JVM options could be configured.
+        self.configuration.set_jvm_options()
+        self.assertThat(
+            paths.SERVICE_CONFIG_FILE_OVERRIDE,
+            FileContains(
+                '# This file is managed by Juju. Do not edit manually.\n[Service]\n'
+                'Environment="JENKINS_PREFIX="\n'))
+
     def test_bad_jnlp_port(self):
         # Bootstrap should fail and return False if we set an invalid port
         orig_port = hookenv.config()["jnlp-port"]
@@ -127,6 +230,17 @@ class ConfigurationTest(JenkinsTest):
         self.configuration.migrate()
         self.assertThat(paths.LEGACY_BOOTSTRAP_FLAG, Not(FileExists()))
 
+    def test_install_helper(self):
+        """
+        The charm helper is installed into init.groovy.d, and only rewritten
+        when its content changes.
+        """
+        self.assertTrue(self.configuration.install_helper())
+        self.assertThat(paths.HELPER_SCRIPT, HasOwnership(123, 456))
+        self.assertThat(
+            paths.HELPER_SCRIPT, FileContains(matcher=Contains(HELPER_KEY)))
+        self.assertFalse(self.configuration.install_helper())
+
     def test_update_center_ca(self):
         ca_cert = """-----BEGIN CERTIFICATE-----
 -----END CERTIFICATE-----"""
@@ -0,0 +1,190 @@
+import os
+
+from unittest import mock
+
+from testtools.matchers import Not, PathExists
+
+from charmhelpers.core import hookenv
+
+from charmtest import CharmTest
+
+from charms.layer.jenkins import paths
+from charms.layer.jenkins.jvm import JvmProfile, java_version
+
+
+@mock.patch("charms.layer.jenkins.jvm.JvmProfile._total_memory", return_value=8192)
+class JvmProfileTest(CharmTest):
+
+    def setUp(self):
+        super(JvmProfileTest, self).setUp()
+        self.profile = JvmProfile()
+        self.orig_config = dict(hookenv.config())
+
+    def tearDown(self):
+        super(JvmProfileTest, self).tearDown()
+        hookenv.config().update(self.orig_config)
+
+    def test_options_default(self, mock_total_memory):
+        """By default no option is set, leaving the package's alone."""
+        self.assertEqual([], self.profile.options())
+
+    def test_options_auto_heap(self, mock_total_memory):
+        """The automatic heap size is half of the memory, and G1 can be used."""
+        hookenv.config().update({"jvm-heap": "auto", "jvm-gc": "g1"})
+        self.assertEqual(
+            [
+                "-Djava.awt.headless=true",
+                "-Xms4096m",
+                "-Xmx4096m",
+                "-XX:+UseG1GC",
+                "-XX:+UseStringDeduplication",
+                "-XX:+ParallelRefProcEnabled",
+            ],
+            self.profile.options(),
+        )
+
+    def test_options_auto_heap_bounds(self, mock_total_memory):
+        """The automatic heap size is bounded."""
+        hookenv.config()["jvm-heap"] = "auto"
+        mock_total_memory.return_value = 256
+        self.assertIn("-Xmx256m", self.profile.options())
+        mock_total_memory.return_value = 65536
+        self.assertIn("-Xmx16384m", self.profile.options())
+
+    @mock.patch("charms.layer.jenkins.jvm.java_version", return_value=11)
+    def test_options(self, mock_java_version, mock_total_memory):
+        """Every option is rendered, extra options last."""
+        hookenv.config().update({
+            "jvm-heap": "2g",
+            "jvm-gc": "zgc",
+            "jvm-max-metaspace": "512m",
+            "jvm-extra-options": "-Dfoo=bar -Dbaz=1",
+        })
+        self.assertEqual(
+            [
+                "-Djava.awt.headless=true",
+                "-Xms2g",
+                "-Xmx2g",
+                "-XX:MaxMetaspaceSize=512m",
+                "-XX:+UnlockExperimentalVMOptions",
+                "-XX:+UseZGC",
+                "-Dfoo=bar",
+                "-Dbaz=1",
+            ],
+            self.profile.options(),
+        )
+
+    @mock.patch("charms.layer.jenkins.jvm.java_version", return_value=17)
+    def test_options_zgc(self, mock_java_version, mock_total_memory):
+        """ZGC needs no unlocking from Java 15."""
+        hookenv.config()["jvm-gc"] = "zgc"
+        options = self.profile.options()
+        self.assertIn("-XX:+UseZGC", options)
+        self.assertNotIn("-XX:+UnlockExperimentalVMOptions", options)
+        self.assertIsNone(self.profile.problem())
+
+    @mock.patch("charms.layer.jenkins.jvm.java_version", return_value=8)
+    def test_options_zgc_unsupported(self, mock_java_version, mock_total_memory):
+        """ZGC is left out before Java 11, which is reported as a problem."""
+        hookenv.config()["jvm-gc"] = "zgc"
+        self.assertEqual([], self.profile.options())
+        self.assertEqual("jvm-gc zgc needs Java 11 or later, not 8", self.profile.problem())
+
+    def test_options_invalid(self, mock_total_memory):
+        """Invalid values are ignored, and logged."""
+        hookenv.config().update({
+            "jvm-heap": "lots",
+            "jvm-gc": "cms",
+            "jvm-max-metaspace": "-1",
+        })
+        self.assertEqual([], self.profile.options())
+        self.assertIn("ERROR: Ignoring invalid jvm-heap lots", self.fakes.juju.log)
+        self.assertIn("ERROR: Ignoring unknown jvm-gc cms", self.fakes.juju.log)
+
+    @mock.patch("charms.layer.jenkins.jvm.java_version")
+    def test_options_gc_logging(self, mock_java_version, mock_total_memory):
+        """GC logging flags depend on the Java version."""
+        hookenv.config()["jvm-gc-logging"] = True
+        mock_java_version.return_value = 11
+        self.assertIn(
+            "-Xlog:gc*:file=/var/log/jenkins/gc.log:time,uptime:filecount=5,filesize=20m",
+            self.profile.options(),
+        )
+        mock_java_version.return_value = 8
+        self.assertIn("-Xloggc:/var/log/jenkins/gc.log", self.profile.options())
+
+    @mock.patch("charms.layer.jenkins.jvm.JvmProfile._cds_fingerprint")
+    @mock.patch("charms.layer.jenkins.jvm.java_version", return_value=17)
+    def test_options_cds_dump(self, mock_java_version, mock_fingerprint, mock_total_memory):
+        """
+        Before Java 19, an archive is dumped at exit, and then used until
+        Java, Jenkins or the plugins change.
+        """
+        hookenv.config()["jvm-cds"] = True
+        mock_fingerprint.return_value = "one"
+        dump = "-XX:ArchiveClassesAtExit=%s" % paths.CDS_ARCHIVE
+        use = "-XX:SharedArchiveFile=%s" % paths.CDS_ARCHIVE
+        self.assertIn(dump, self.profile.options())
+        # Until the archive is dumped, it keeps being asked for.
+        self.assertIn(dump, self.profile.options())
+        os.makedirs(os.path.dirname(paths.CDS_ARCHIVE))
+        with open(paths.CDS_ARCHIVE, "w") as fd:
+            fd.write("archive")
+        self.assertIn(use, self.profile.options())
+        self.assertIn(use, self.profile.options())
+        # A plugin changed.
+        mock_fingerprint.return_value = "two"
+        self.assertIn(dump, self.profile.options())
+        self.assertThat(paths.CDS_ARCHIVE, Not(PathExists()))
+
+    @mock.patch("charms.layer.jenkins.jvm.JvmProfile._cds_fingerprint")
+    @mock.patch("charms.layer.jenkins.jvm.java_version", return_value=21)
+    def test_options_cds_auto(self, mock_java_version, mock_fingerprint, mock_total_memory):
+        """From Java 19, the JVM manages the archive, dropped on changes."""
+        hookenv.config()["jvm-cds"] = True
+        mock_fingerprint.return_value = "one"
+        options = self.profile.options()
+        self.assertIn("-XX:+AutoCreateSharedArchive", options)
+        self.assertIn("-XX:SharedArchiveFile=%s" % paths.CDS_ARCHIVE, options)
+        os.makedirs(os.path.dirname(paths.CDS_ARCHIVE))
+        with open(paths.CDS_ARCHIVE, "w") as fd:
+            fd.write("archive")
+        self.profile.options()
+        self.assertThat(paths.CDS_ARCHIVE, PathExists())
+        mock_fingerprint.return_value = "two"
+        self.assertEqual(options, self.profile.options())
+        self.assertThat(paths.CDS_ARCHIVE, Not(PathExists()))
+
+    @mock.patch("subprocess.check_output", return_value=b"2.479.1")
+    def test_cds_fingerprint(self, mock_check_output, mock_total_memory):
+        """
+        The fingerprint changes when a plugin is updated in place, even if
+        its file name stays the same.
+        """
+        self.fakes.fs.add(paths.PLUGINS)
+        os.makedirs(paths.PLUGINS)
+        plugin = os.path.join(paths.PLUGINS, "git.jpi")
+        with open(plugin, "w") as fd:
+            fd.write("old")
+        os.utime(plugin, (1000, 1000))
+        fingerprint = self.profile._cds_fingerprint(17)
+        self.assertEqual(fingerprint, self.profile._cds_fingerprint(17))
+        self.assertNotEqual(fingerprint, self.profile._cds_fingerprint(21))
+        with open(plugin, "w") as fd:
+            fd.write("new")
+        os.utime(plugin, (2000, 2000))
+        self.assertNotEqual(fingerprint, self.profile._cds_fingerprint(17))
+
+    @mock.patch("charms.layer.jenkins.jvm.java_version", return_value=11)
+    def test_options_cds_unsupported(self, mock_java_version, mock_total_memory):
+        """Class data sharing needs Java 13 or later."""
+        hookenv.config()["jvm-cds"] = True
+        self.assertNotIn("Archive", " ".join(self.profile.options()))
+
+    @mock.patch("os.path.realpath")
+    def test_java_version(self, mock_realpath, mock_total_memory):
+        """The Java version is taken from the JRE the alternative points to."""
+        mock_realpath.return_value = "/usr/lib/jvm/java-11-openjdk-amd64/bin/java"
+        self.assertEqual(11, java_version())
+        mock_realpath.return_value = "/usr/bin/java"
+        self.assertIsNone(java_version())
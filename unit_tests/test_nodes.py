@@ -0,0 +1,145 @@
+import time
+
+from charmhelpers.core import unitdata
+from charms.layer.jenkins.api import (
+    DELETE_NODES_SCRIPT,
+    GET_LEGACY_TOKEN_SCRIPT,
+    GET_NEW_TOKEN_SCRIPT,
+    GET_NODE_SECRETS_SCRIPT,
+    GET_NODES_SCRIPT,
+    UPDATE_NODES_SCRIPT,
+    Api,
+)
+from charms.layer.jenkins.nodes import MANAGED_NODES_KEY, Nodes
+from charms.layer.jenkins.packages import Packages
+from states import JenkinsConfiguredAdmin
+from stubs.apt import AptStub
+from testing import JenkinsTest
+
+
+class NodesTest(JenkinsTest):
+    def setUp(self):
+        super(NodesTest, self).setUp()
+        self.useFixture(JenkinsConfiguredAdmin(self.fakes))
+        self.fakes.jenkins.scripts[GET_LEGACY_TOKEN_SCRIPT] = "abc"
+        self.fakes.jenkins.scripts[GET_NEW_TOKEN_SCRIPT] = "xyz"
+        self.nodes = Nodes(api=Api(packages=Packages(apt=AptStub())))
+
+    def _set_nodes(self, nodes):
+        self.fakes.jenkins.scripts[GET_NODES_SCRIPT] = nodes
+
+    def _set_secrets(self, secrets):
+        self.fakes.jenkins.scripts[GET_NODE_SECRETS_SCRIPT] = lambda params: {
+            name: secrets[name] for name in params["names"]
+        }
+
+    def _expect_delete(self):
+        deleted = []
+        self.fakes.jenkins.scripts[DELETE_NODES_SCRIPT] = lambda params: deleted.extend(
+            params["names"]
+        )
+        return deleted
+
+    def test_reconcile_add(self):
+        """
+        Agents without a node get one, and their secrets are returned.
+        """
+        self._set_nodes({})
+        self._set_secrets({"slave-0": "abc", "slave-1": "def"})
+        slaves = [
+            {"slavehost": "slave-0", "executors": "1", "labels": "python"},
+            {"slavehost": "slave-1", "executors": "2", "labels": None},
+        ]
+        secrets = self.nodes.reconcile(slaves)
+        self.assertEqual({"slave-0": "abc", "slave-1": "def"}, secrets)
+        nodes = sorted(self.fakes.jenkins.nodes)
+        self.assertEqual(["slave-0", "slave-1"], [node.host for node in nodes])
+        self.assertEqual([1, 2], [node.executors for node in nodes])
+        self.assertEqual(["python", ()], [node.labels for node in nodes])
+        self.assertEqual({"slave-0", "slave-1"}, self.nodes.managed())
+
+    def test_reconcile_existing(self):
+        """
+        Agents which already have a node are left alone.
+        """
+        self._set_nodes({"slave-0": {"executors": 1, "labels": ""}})
+        self._set_secrets({"slave-0": "abc"})
+
+        def create_node(*args, **kwargs):
+            raise AssertionError("Unexpected node creation")
+
+        self.fakes.jenkins.create_node = create_node
+        slaves = [{"slavehost": "slave-0", "executors": "1", "labels": ""}]
+        self.assertEqual({"slave-0": "abc"}, self.nodes.reconcile(slaves))
+        self.assertEqual(["slave-0"], unitdata.kv().get(MANAGED_NODES_KEY))
+
+    def test_reconcile_update(self):
+        """
+        Existing nodes whose executors or labels changed are patched in
+        place, differences in label order are ignored.
+        """
+        self._set_nodes({
+            "slave-0": {"executors": 1, "labels": "python java"},
+            "slave-1": {"executors": 1, "labels": "python java"},
+        })
+        self._set_secrets({"slave-0": "abc", "slave-1": "def"})
+        updated = []
+        self.fakes.jenkins.scripts[UPDATE_NODES_SCRIPT] = updated.append
+        slaves = [
+            {"slavehost": "slave-0", "executors": "1", "labels": "java python"},
+            {"slavehost": "slave-1", "executors": "4", "labels": "python java go"},
+        ]
+        self.nodes.reconcile(slaves)
+        self.assertIn(
+            "INFO: Reconciling nodes: 0 to add, 0 to remove, 1 to update, 1 unchanged",
+            self.fakes.juju.log,
+        )
+        self.assertEqual(
+            [{"nodes": {"slave-1": {"executors": 4, "labels": "go java python"}}}], updated
+        )
+        self.assertEqual([], self.fakes.jenkins.nodes)
+
+    def test_reconcile_remove(self):
+        """
+        Nodes of departed agents are deleted, other nodes are left alone.
+        """
+        unitdata.kv().set(MANAGED_NODES_KEY, ["slave-0", "slave-1", "slave-2"])
+        self._set_nodes({
+            "slave-0": {"executors": 1, "labels": ""},
+            "slave-1": {"executors": 1, "labels": ""},
+            "static": {"executors": 1, "labels": ""},
+        })
+        self._set_secrets({"slave-0": "abc"})
+        deleted = self._expect_delete()
+        slaves = [{"slavehost": "slave-0", "executors": "1", "labels": ""}]
+        self.nodes.reconcile(slaves)
+        self.assertEqual(["slave-1"], deleted)
+        self.assertEqual({"slave-0"}, self.nodes.managed())
+
+    def test_sweep(self):
+        """
+        Nodes offline for longer than the timeout are deleted, unless they
+        are kept, never connected, were taken offline on purpose or weren't
+        created by the charm.
+        """
+        now = time.time() * 1000
+        unitdata.kv().set(MANAGED_NODES_KEY, ["old", "kept", "recent", "new", "online"])
+        self._set_nodes({
+            "old": {"executors": 1, "labels": "", "offlineSince": now - 3600001},
+            "manual": {"executors": 1, "labels": "", "offlineSince": now - 3600001},
+            "recent": {"executors": 1, "labels": "", "offlineSince": now - 60000},
+            "kept": {"executors": 1, "labels": "", "offlineSince": now - 3600001},
+            "new": {"executors": 1, "labels": "", "offlineSince": 0},
+            "online": {"executors": 1, "labels": "", "offlineSince": None},
+        })
+        deleted = self._expect_delete()
+        self.assertEqual(["old"], self.nodes.sweep(60, keep={"kept"}))
+        self.assertEqual(["old"], deleted)
+        self.assertEqual({"kept", "recent", "new", "online"}, self.nodes.managed())
+
+    def test_sweep_nothing(self):
+        """
+        If no node is stale, nothing is deleted.
+        """
+        self._set_nodes({"online": {"executors": 1, "labels": "", "offlineSince": None}})
+        self.assertEqual([], self.nodes.sweep(60))
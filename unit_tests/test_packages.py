@@ -1,9 +1,10 @@
+import io
 import os
 
-from glob import glob
 from unittest import mock
 
 from testtools.matchers import (
+    FileContains,
     PathExists,
     Not,
 )
@@ -18,13 +19,16 @@ from stubs.apt import AptStub
 from stubs.host import CharmHelpersCoreHostStub
 
 from charms.layer.jenkins.packages import (
-    APT_DEPENDENCIES,
     APT_SOURCE,
     JENKINS_XENIAL_VERSION,
     Packages,
 )
 
 
+JAVA_8_DEPENDENCIES = ["daemon", "openjdk-8-jre-headless"]
+JAVA_17_DEPENDENCIES = ["daemon", "openjdk-17-jre-headless"]
+
+
 class PackagesTest(CharmTest):
     def setUp(self):
         super(PackagesTest, self).setUp()
@@ -54,16 +58,18 @@ class PackagesTest(CharmTest):
         self.packages.installs = []
         self.packages.sources = []
 
-    def test_install_dependencies(self):
+    @mock.patch("charms.layer.jenkins.packages.Packages._installed_packages")
+    def test_install_dependencies(self, mock_installed_packages):
         """
         The Jenkins dependencies get installed by the install_dependencies method.
         """
+        mock_installed_packages.return_value = set()
         # Start with old Jenkins version and default distro version (xenial).
         self.apt._set_jenkins_version("2.150.3")
         self.assertEqual(self.packages.jenkins_version(), "2.150.3")
         self.assertEqual(self.packages.distro_codename(), "xenial")
         self.packages.install_dependencies()
-        self.assertItemsEqual(APT_DEPENDENCIES["xenial"], self.apt.installs)
+        self.assertItemsEqual(JAVA_8_DEPENDENCIES, self.apt.installs)
         # Now check with a distro of bionic.
         self.apt.installs = []
         self.apt._set_jenkins_version("2.150.3")
@@ -71,7 +77,7 @@ class PackagesTest(CharmTest):
         self.ch_host._set_distro_version("bionic")
         self.assertEqual(self.packages.distro_codename(), "bionic")
         self.packages.install_dependencies()
-        self.assertItemsEqual(APT_DEPENDENCIES["pre-jenkins-2.164"], self.apt.installs)
+        self.assertItemsEqual(JAVA_8_DEPENDENCIES, self.apt.installs)
         # Now with new Jenkins version and xenial
         self.apt._set_jenkins_version("2.361.1")
         self.assertEqual(self.packages.jenkins_version(), "2.361.1")
@@ -79,7 +85,7 @@ class PackagesTest(CharmTest):
         self.assertEqual(self.packages.distro_codename(), "xenial")
         self.apt.installs = []
         self.packages.install_dependencies()
-        self.assertItemsEqual(APT_DEPENDENCIES["xenial"], self.apt.installs)
+        self.assertItemsEqual(JAVA_8_DEPENDENCIES, self.apt.installs)
         # Now with new Jenkins version and bionic
         self.apt._set_jenkins_version("2.361.1")
         self.assertEqual(self.packages.jenkins_version(), "2.361.1")
@@ -87,15 +93,142 @@ class PackagesTest(CharmTest):
         self.assertEqual(self.packages.distro_codename(), "bionic")
         self.apt.installs = []
         self.packages.install_dependencies()
-        self.assertItemsEqual(APT_DEPENDENCIES["jenkins-2.164-and-later"], self.apt.installs)
+        self.assertItemsEqual(JAVA_17_DEPENDENCIES, self.apt.installs)
         # Now with no Jenkins version installed
         del self.apt._package_versions["jenkins"]
         self.apt.installs = []
         self.packages.install_dependencies()
-        self.assertItemsEqual(APT_DEPENDENCIES["jenkins-2.164-and-later"], self.apt.installs)
+        self.assertItemsEqual(JAVA_17_DEPENDENCIES, self.apt.installs)
         # Set jenkins version again
         self.apt._set_jenkins_version("2.150.3")
 
+    @mock.patch("charms.layer.jenkins.packages.Packages._installed_packages")
+    def test_install_dependencies_satisfied(self, mock_installed_packages):
+        """
+        Apt isn't used at all if the required dependencies are installed, and
+        no unneeded JRE is.
+        """
+        self.ch_host._set_distro_version("bionic")
+        self.apt._set_jenkins_version("2.361.1")
+        mock_installed_packages.return_value = {"daemon", "openjdk-17-jre-headless", "git"}
+        self.apt.purge = mock.Mock()
+        self.apt.install_queued = mock.Mock()
+        satisfied = self.packages.install_dependencies()
+        self.assertEqual(JAVA_17_DEPENDENCIES, satisfied)
+        self.apt.purge.assert_not_called()
+        self.apt.install_queued.assert_not_called()
+        self.assertEqual([], self.apt.installs)
+        # The dpkg status is read only once.
+        mock_installed_packages.assert_called_once_with()
+
+    @mock.patch("charms.layer.jenkins.packages.Packages._installed_packages")
+    def test_plan_dependencies(self, mock_installed_packages):
+        """Only installed JREs get purged, and only missing dependencies installed."""
+        self.ch_host._set_distro_version("bionic")
+        self.apt._set_jenkins_version("2.361.1")
+        mock_installed_packages.return_value = {"daemon", "openjdk-8-jre-headless"}
+        self.assertEqual(
+            (["openjdk-8-jre-headless"], ["openjdk-17-jre-headless"], ["daemon"]),
+            self.packages.plan_dependencies(),
+        )
+
+    @mock.patch("charms.layer.jenkins.packages.Packages._installed_packages")
+    def test_pick_java(self, mock_installed_packages):
+        """
+        The newest Java version supported by both Jenkins and the series is
+        picked.
+        """
+        mock_installed_packages.return_value = set()
+        self.ch_host._set_distro_version("jammy")
+        self.assertEqual(8, self.packages.pick_java("2.150.3"))
+        self.assertEqual(11, self.packages.pick_java("2.300"))
+        self.assertEqual(17, self.packages.pick_java("2.361.1"))
+        self.assertEqual(21, self.packages.pick_java("2.426.1"))
+        del self.apt._package_versions["jenkins"]
+        self.assertEqual(21, self.packages.pick_java())
+        self.ch_host._set_distro_version("focal")
+        self.assertEqual(17, self.packages.pick_java("2.426.1"))
+        self.ch_host._set_distro_version("xenial")
+        self.assertEqual(8, self.packages.pick_java())
+        self.apt._set_jenkins_version("2.150.1")
+
+    @mock.patch("charms.layer.jenkins.packages.Packages._installed_packages")
+    def test_pick_java_installed(self, mock_installed_packages):
+        """
+        Once Jenkins is installed, the installed JRE is kept as long as
+        Jenkins supports it.
+        """
+        self.ch_host._set_distro_version("jammy")
+        mock_installed_packages.return_value = {"daemon", "openjdk-11-jre-headless"}
+        self.assertEqual(11, self.packages.pick_java("2.426.1"))
+        self.assertEqual(21, self.packages.pick_java("2.479.1"))
+        # On a fresh install, whatever JRE is around doesn't matter.
+        del self.apt._package_versions["jenkins"]
+        self.assertEqual(21, self.packages.pick_java())
+        self.apt._set_jenkins_version("2.150.1")
+
+    def test_pick_java_configured(self):
+        """The jre config option is honored if it's supported."""
+        self.ch_host._set_distro_version("jammy")
+        orig_jre = hookenv.config()["jre"]
+        try:
+            hookenv.config()["jre"] = "11"
+            self.assertEqual(11, self.packages.pick_java("2.426.1"))
+            # The closest newer Java version is picked instead.
+            self.assertEqual(17, self.packages.pick_java("2.479.1"))
+            self.assertIn(
+                "ERROR: Java 11 is not supported by jenkins 2.479.1 on jammy, "
+                "picking one of 17, 21",
+                self.fakes.juju.log,
+            )
+            hookenv.config()["jre"] = "25"
+            self.assertEqual(21, self.packages.pick_java("2.479.1"))
+        finally:
+            hookenv.config()["jre"] = orig_jre
+
+    @mock.patch("subprocess.check_call")
+    @mock.patch("charms.layer.jenkins.packages.Packages._installed_packages")
+    def test_install_dependencies_switch_jre(self, mock_installed_packages, mock_check_call):
+        """
+        When switching JRE, java points to the new one before the old one is
+        purged.
+        """
+        self.ch_host._set_distro_version("bionic")
+        self.apt._set_jenkins_version("2.361.1")
+        mock_installed_packages.return_value = {"daemon", "openjdk-11-jre-headless"}
+        java = "/usr/lib/jvm/java-17-openjdk-amd64/bin/java"
+        self.fakes.fs.add("/usr/lib/jvm")
+        os.makedirs(os.path.dirname(java))
+        with open(java, "w") as fd:
+            fd.write("")
+        calls = []
+        self.apt.purge = lambda packages: calls.append(("purge", packages))
+        mock_check_call.side_effect = lambda args: calls.append(args)
+        orig_jre = hookenv.config()["jre"]
+        try:
+            hookenv.config()["jre"] = "17"
+            self.packages.install_dependencies()
+        finally:
+            hookenv.config()["jre"] = orig_jre
+        self.assertEqual(
+            [
+                ("update-alternatives", "--set", "java", java),
+                ("purge", ["openjdk-11-jre-headless"]),
+            ],
+            calls,
+        )
+        self.assertEqual(["openjdk-17-jre-headless"], self.apt.installs)
+
+    @mock.patch("subprocess.check_output")
+    def test_installed_packages(self, mock_check_output):
+        """Only packages dpkg reports as installed are returned."""
+        mock_check_output.return_value = (
+            b"daemon ii \nopenjdk-11-jre-headless:amd64 ii \ngit rc \n"
+        )
+        self.assertEqual(
+            {"daemon", "openjdk-11-jre-headless"}, self.packages._installed_packages()
+        )
+
     def test_install_tools(self):
         """
         The requested tools get installed by the install_tools method.
@@ -170,15 +303,51 @@ class PackagesTest(CharmTest):
         If the 'release' config is set to a remote URL, then Jenkins will be
         installed from the deb files pointed by that url.
         """
-        self.fakes.processes.wget.locations["http://jenkins-1.2.3.deb"] = b"data"
+        self.fakes.network.get("http://jenkins-1.2.3.deb", content=b"data")
+        orig_release = hookenv.config()["release"]
+        try:
+            hookenv.config()["release"] = "http://jenkins-1.2.3.deb"
+            self.packages.install_jenkins()
+            self.assertEqual(["install"], self.fakes.processes.dpkg.actions["jenkins"])
+        finally:
+            hookenv.config()["release"] = orig_release
+
+    def test_install_jenkins_remote_cached(self):
+        """
+        A remote package downloaded before, e.g. by prefetch_jenkins(), is
+        installed from the cache without being downloaded again.
+        """
+        self.fakes.network.get("http://jenkins-1.2.3.deb", content=b"data")
         orig_release = hookenv.config()["release"]
         try:
             hookenv.config()["release"] = "http://jenkins-1.2.3.deb"
+            target = self.packages.prefetch_jenkins()
+            self.assertThat(target, FileContains("data"))
             self.packages.install_jenkins()
             self.assertEqual(["install"], self.fakes.processes.dpkg.actions["jenkins"])
+            self.assertThat(target, PathExists())
+            self.assertEqual(1, len(self.fakes.network.request_history))
         finally:
             hookenv.config()["release"] = orig_release
 
+    def test_prefetch_jenkins_apt_source(self):
+        """Packages coming from an apt source aren't prefetched."""
+        self.assertIsNone(self.packages.prefetch_jenkins())
+
+    @mock.patch("charms.layer.jenkins.packages.Packages._installed_packages")
+    @mock.patch("subprocess.check_call")
+    def test_prefetch_dependencies(self, mock_check_call, mock_installed_packages):
+        """The dependencies are only downloaded into the apt cache."""
+        mock_installed_packages.return_value = set()
+        self.ch_host._set_distro_version("bionic")
+        self.packages.prefetch_dependencies()
+        mock_check_call.assert_called_once_with(
+            ("apt-get", "install", "--download-only", "--yes", "--quiet", "daemon",
+             "openjdk-8-jre-headless"),
+            env=mock.ANY,
+        )
+        self.assertEqual([], self.apt.installs)
+
     def test_install_jenkins_lts_release_xenial(self):
         """
         If the 'release' config is set to 'lts' on xenial, an APT source entry will be
@@ -244,6 +413,30 @@ class PackagesTest(CharmTest):
         self.apt._set_jenkins_version("2.128.1")
         self.assertEqual(self.packages.jenkins_version(), "2.128.1")
 
+    def test_available_version_bundled(self):
+        """
+        Without bundle-site, the available version is the one of the package
+        bundled with the charm, so that the JRE is picked for it on upgrades.
+        """
+        files = os.path.join(hookenv.charm_dir(), "files")
+        os.mkdir(files)
+        bundle_path = os.path.join(files, "jenkins.deb")
+        with open(bundle_path, "w") as fd:
+            fd.write("")
+        commands = []
+
+        def dpkg_deb(proc_args):
+            commands.append(list(proc_args["args"]))
+            return {"stdout": io.BytesIO(b"2.479.1\n")}
+
+        self.fakes.processes.add(dpkg_deb, name="dpkg-deb")
+        self.assertEqual("2.479.1", self.packages.available_version())
+        self.assertEqual([["dpkg-deb", "--field", bundle_path, "Version"]], commands)
+
+    def test_available_version_nothing_bundled(self):
+        """Without bundle-site nor bundled package, no version is available."""
+        self.assertIsNone(self.packages.available_version())
+
     def test_jenkins_upgradable_without_bundle_site(self):
         """
         Jenkins should always be upgradable when bundle-site
@@ -287,46 +480,49 @@ class PackagesTest(CharmTest):
         try:
             hookenv.config()["release"] = "bundle"
             hookenv.config()["bundle-site"] = "https://pkg.jenkins.io"
-            bundle_path = os.path.join(hookenv.charm_dir(), "files")
             self.packages.install_jenkins()
-            self.assertTrue(len(os.listdir(bundle_path)) > 0)
+            self.assertTrue(len(os.listdir(paths.DEBS_CACHE)) > 0)
             self.assertEqual(["install"], self.fakes.processes.dpkg.actions["jenkins"])
         finally:
             hookenv.config()["release"] = orig_release
             hookenv.config()["bundle-site"] = orig_bundle_site
 
-    @mock.patch("charms.layer.jenkins.packages.glob")
-    @mock.patch("charms.layer.jenkins.packages.os.system")
-    def test_clean_old_plugins(self, mock_os_system, mock_os_glob):
-        """Make sure old plugin directories are excluded."""
+    @mock.patch("charms.layer.jenkins.packages.JenkinsCore")
+    def test_fetch_bundle_direct(self, mock_jenkins_core):
+        """
+        Bundles found at the top of bundle-site are downloaded by the package
+        cache, which resumes interrupted downloads.
+        """
+        orig_bundle_site = hookenv.config()["bundle-site"]
+        try:
+            hookenv.config()["bundle-site"] = "http://test/"
+            mock_jenkins_core.return_value.core_version = "2.479.1"
+            self.packages = Packages(apt=self.apt, ch_host=self.ch_host)
+            self.fakes.network.get("http://test/jenkins_2.479.1_all.deb", content=b"data")
+            path = self.packages._fetch_bundle()
+            self.assertThat(path, FileContains("data"))
+            mock_jenkins_core.return_value.get_binary_package.assert_not_called()
+        finally:
+            hookenv.config()["bundle-site"] = orig_bundle_site
+
+    def test_clean_old_plugins(self):
+        """
+        Old plugin directories, detached plugins and plugin files with no
+        version are removed, and the space freed is reported.
+        """
+        os.mkdir(paths.DETACHED_PLUGINS)
+        with open(os.path.join(paths.DETACHED_PLUGINS, "detached.hpi"), "w") as fd:
+            fd.write("detached")
         plugins = ["test1_plugin", "test2_plugin", "test3_plugin"]
         kept_plugins = []
-        detached_plugins_dir = "/var/cache/jenkins/war/WEB-INF/detached-plugins"
-        os_expected_calls = [mock.call("sudo rm -r %s" % detached_plugins_dir)]
-
-        def side_effect(value):
-            if value == "%s/*/" % paths.PLUGINS:
-                return ["/var/lib/jenkins/plugins/"]
-            if value == "%s/*.jpi" % paths.PLUGINS:
-                return [
-                    "/var/lib/jenkins/plugins/test1_plugin.jpi",
-                    "/var/lib/jenkins/plugins/test2_plugin.jpi",
-                    "/var/lib/jenkins/plugins/test3_plugin.jpi",
-                ]
-
-        mock_os_glob.side_effect = side_effect
-        os_expected_calls.append(mock.call("sudo rm -r %s/" % paths.PLUGINS))
-
-        os.mkdir(detached_plugins_dir)
         for plugin in plugins:
             # Create old plugins directories and .jpi files with no version
             plugin_dir = os.path.join(paths.PLUGINS, plugin)
-            plugin_file = os.path.join(paths.PLUGINS, "%s.jpi" % plugin)
             os.mkdir(plugin_dir)
-            with open(plugin_file, "w") as fd:
-                fd.write("")
-            # And expect them to be removed
-            os_expected_calls.append(mock.call("sudo rm %s" % plugin_file))
+            with open(os.path.join(plugin_dir, "MANIFEST.MF"), "w") as fd:
+                fd.write("manifest")
+            with open(os.path.join(paths.PLUGINS, "%s.jpi" % plugin), "w") as fd:
+                fd.write("plugin")
 
             # Create plugins with version that should not be removed
             plugin_to_keep = os.path.join(paths.PLUGINS, "%s-1.jpi" % plugin)
@@ -334,7 +530,15 @@ class PackagesTest(CharmTest):
             with open(plugin_to_keep, "w") as fd:
                 fd.write("")
 
-        self.packages.clean_old_plugins()
-        self.assertThat(paths.PLUGINS, PathExists())
-        self.assertCountEqual(mock_os_system.mock_calls, os_expected_calls)
-        mock_os_system.assert_has_calls(os_expected_calls, any_order=True)
+        self.assertEqual((7, 8 + 3 * (8 + 6)), self.packages.clean_old_plugins())
+        self.assertThat(paths.DETACHED_PLUGINS, Not(PathExists()))
+        self.assertCountEqual(
+            kept_plugins, [os.path.join(paths.PLUGINS, name) for name in os.listdir(paths.PLUGINS)]
+        )
+        self.assertEqual(
+            "INFO: Removed 7 old plugin files, freeing 50 bytes", self.fakes.juju.log[-1]
+        )
+
+    def test_clean_old_plugins_nothing(self):
+        """Nothing is removed if there are no old plugins."""
+        self.assertEqual((0, 0), self.packages.clean_old_plugins())
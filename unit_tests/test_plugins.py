@@ -1,9 +1,14 @@
+import base64
+import hashlib
 import io
 import os
 import urllib
+import zipfile
 from unittest import mock
 
+import requests
 from testtools.matchers import (
+    FileContains,
     PathExists,
     Not,
 )
@@ -13,16 +18,19 @@ from charmhelpers.core import hookenv
 from charmtest import CharmTest
 
 from charms.layer.jenkins import paths
-from charms.layer.jenkins.plugins import Plugins
+from charms.layer.jenkins.plugins import PluginSiteError, Plugins
+from charms.layer.jenkins.updatecenter import DEFAULT_URL
 
 
-@mock.patch("charms.layer.jenkins.api.Api.restart")
+@mock.patch("charms.layer.jenkins.restarts.Restarts.request_restart")
 class PluginsTest(CharmTest):
     def setUp(self):
         super(PluginsTest, self).setUp()
+        self.fakes.network.get(DEFAULT_URL, json={"plugins": {}})
         self.plugins = Plugins()
 
         self.fakes.fs.add(paths.PLUGINS)
+        self.fakes.fs.add(paths.PLUGINS_STAGING)
         os.makedirs(paths.PLUGINS)
         self.fakes.users.add("jenkins", 123)
         self.fakes.groups.add("jenkins", 123)
@@ -74,38 +82,110 @@ class PluginsTest(CharmTest):
             hookenv.config()["remove-unlisted-plugins"] = "yes"
             with open(plugin_path, "w"):
                 pass
-            # When using a non-existent path it returns None
-            self.assertIsNone(self.plugins._remove_plugin(plugin_name))
-            self.plugins._remove_plugin(plugin_path)
+            # When using a non-existent path it returns False
+            self.assertFalse(self.plugins._remove_plugin(plugin_name))
+            self.assertTrue(self.plugins._remove_plugin(plugin_path))
             self.assertThat(plugin_path, Not(PathExists()))
         finally:
             hookenv.config()["remove-unlisted-plugins"] = orig_remove_unlisted_plugins
 
+    @mock.patch("test_plugins.Plugins._get_plugin_info")
     @mock.patch("test_plugins.Plugins._get_plugins_to_install")
-    @mock.patch("charms.layer.jenkins.api.Api.get_plugin_version")
+    @mock.patch("charms.layer.jenkins.api.Api.get_installed_plugins")
     def test_install(
-        self, mock_get_plugin_version, mock_get_plugins_to_install, mock_restart_jenkins
+        self,
+        mock_get_installed_plugins,
+        mock_get_plugins_to_install,
+        mock_get_plugin_info,
+        mock_restart_jenkins,
     ):
         """
         The given plugins are downloaded from the Jenkins site.
         """
-        mock_get_plugin_version.return_value = False
+        mock_get_installed_plugins.return_value = {}
         plugin_name = "ansicolor"
         mock_get_plugins_to_install.return_value = {plugin_name}, {}
-        installed_plugin = ""
-        installed_plugins, incompatible_plugins = self.plugins.install(plugin_name)
-        installed_plugin.join(installed_plugins)
-        plugin_path = os.path.join(paths.PLUGINS, installed_plugin)
-        self.assertTrue(
-            os.path.exists(plugin_path), msg="Plugin not installed in the proper directory"
-        )
+        mock_get_plugin_info.return_value = {"version": "1", "url": "http://x/ansicolor.hpi"}
+        self.fakes.network.get("http://x/ansicolor.hpi", content=b"data")
+        self.plugins.install(plugin_name)
+        plugin_path = os.path.join(paths.PLUGINS, "ansicolor.jpi")
+        self.assertThat(plugin_path, FileContains("data"))
 
-        mock_restart_jenkins.assert_called_with()
+        mock_restart_jenkins.assert_called_once_with("plugins changed")
 
-    @mock.patch("charms.layer.jenkins.api.Api.get_plugin_version")
+    @mock.patch("test_plugins.Plugins._get_plugin_info")
+    @mock.patch("test_plugins.Plugins._get_plugins_to_install")
+    @mock.patch("charms.layer.jenkins.api.Api.get_installed_plugins")
+    def test_install_exploded(
+        self,
+        mock_get_installed_plugins,
+        mock_get_plugins_to_install,
+        mock_get_plugin_info,
+        mock_restart_jenkins,
+    ):
+        """
+        Plugins are installed already exploded, and the staging directory
+        is cleaned up.
+        """
+        mock_get_installed_plugins.return_value = {}
+        mock_get_plugins_to_install.return_value = ["ansicolor"], []
+        mock_get_plugin_info.return_value = {"version": "1", "url": "http://x/ansicolor.hpi"}
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as plugin:
+            plugin.writestr("WEB-INF/lib/ansicolor.jar", "jar")
+        self.fakes.network.get("http://x/ansicolor.hpi", content=archive.getvalue())
+        self.plugins.install("ansicolor")
+        self.assertThat(os.path.join(paths.PLUGINS, "ansicolor.jpi"), PathExists())
+        self.assertThat(
+            os.path.join(paths.PLUGINS, "ansicolor", "WEB-INF", "lib", "ansicolor.jar"),
+            FileContains("jar"),
+        )
+        self.assertThat(paths.PLUGINS_STAGING, Not(PathExists()))
+
+    @mock.patch("charms.layer.jenkins.restarts.Restarts.run_while_stopped")
+    @mock.patch("test_plugins.Plugins._get_plugin_info")
+    @mock.patch("test_plugins.Plugins._get_plugins_to_install")
+    @mock.patch("charms.layer.jenkins.api.Api.get_installed_plugins")
+    def test_install_update_exploded(
+        self,
+        mock_get_installed_plugins,
+        mock_get_plugins_to_install,
+        mock_get_plugin_info,
+        mock_run_while_stopped,
+        mock_restart_jenkins,
+    ):
+        """
+        Updated plugins are exploded ahead of time too, but their exploded
+        directory is only swapped in while Jenkins is stopped for the restart.
+        """
+        orig_update = hookenv.config()["plugins-auto-update"]
+        hookenv.config()["plugins-auto-update"] = True
+        self.addCleanup(hookenv.config().update, {"plugins-auto-update": orig_update})
+        old = os.path.join(paths.PLUGINS, "ansicolor")
+        os.makedirs(old)
+        with open(os.path.join(old, "loaded"), "w") as fd:
+            fd.write("")
+        mock_get_installed_plugins.return_value = {"ansicolor": {"version": "0"}}
+        mock_get_plugins_to_install.return_value = ["ansicolor"], []
+        mock_get_plugin_info.return_value = {"version": "1", "url": "http://x/ansicolor.hpi"}
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as plugin:
+            plugin.writestr("WEB-INF/lib/ansicolor.jar", "jar")
+        self.fakes.network.get("http://x/ansicolor.hpi", content=archive.getvalue())
+        self.plugins.install("ansicolor")
+        self.assertThat(os.path.join(paths.PLUGINS, "ansicolor.jpi"), PathExists())
+        self.assertThat(os.path.join(old, "loaded"), PathExists())
+        mock_restart_jenkins.assert_called_once_with("plugins changed")
+        (swap_exploded,), _ = mock_run_while_stopped.call_args
+        swap_exploded()
+        self.assertThat(os.path.join(old, "WEB-INF", "lib", "ansicolor.jar"), FileContains("jar"))
+        self.assertThat(os.path.join(old, "loaded"), Not(PathExists()))
+        self.assertThat(paths.PLUGINS_STAGING, Not(PathExists()))
+
+    @mock.patch("charms.layer.jenkins.api.Api.get_installed_plugins")
     @mock.patch("test_plugins.Plugins._get_plugins_to_install")
     def test_install_raises_error(
-        self, mock_get_plugins_to_install, mock_get_plugin_version, mock_restart_jenkins
+        self, mock_get_plugins_to_install, mock_get_installed_plugins, mock_restart_jenkins
     ):
         """
         When install fails it should log and raise an error
@@ -116,7 +196,7 @@ class PluginsTest(CharmTest):
 
         plugin_name = "bad_plugin"
         mock_get_plugins_to_install.return_value = {plugin_name}, {}
-        mock_get_plugin_version.return_value = False
+        mock_get_installed_plugins.return_value = {}
         self.plugins._install_plugins = failed_install
 
         self.assertRaises(Exception, self.plugins.install, plugin_name)
@@ -140,11 +220,9 @@ class PluginsTest(CharmTest):
         plugin_list = "plugin listed"
 
         def side_effect(value):
-            if value == plugin_list.split():
-                fake_result = plugin_list.split()
-                fake_result.append(dependency_plugin_name)
-                return fake_result
-            return {plugin_name, "dependency"}
+            if value == ["instance-identity"] + plugin_list.split():
+                return value + [dependency_plugin_name], []
+            return [plugin_name, dependency_plugin_name], []
 
         mock_get_plugins_to_install.side_effect = side_effect
         mock_install_plugins.return_value = {plugin_path}
@@ -168,7 +246,10 @@ class PluginsTest(CharmTest):
                 pass
             with open(dependency_plugin, "w"):
                 pass
+            mock_install_plugins.return_value = set()
             self.plugins.install(plugin_name)
+            # Removing plugins is a change that requires a restart
+            mock_restart_jenkins.assert_called_once_with("plugins changed")
             # Unlisted plugins should be removed
             self.assertThat(unlisted_plugin_jpi, Not(PathExists()))
             self.assertThat(unlisted_plugin_hpi, Not(PathExists()))
@@ -208,11 +289,11 @@ class PluginsTest(CharmTest):
         with open(unlisted_plugin, "w"):
             pass
         self.plugins.install(plugin_name)
-        self.assertEqual(
+        self.assertIn(
             "INFO: Unlisted plugins: ({}) Not removed. Set "
             "remove-unlisted-plugins to 'yes' to clear them "
             "away.".format(unlisted_plugin_path),
-            self.fakes.juju.log[-1],
+            self.fakes.juju.log,
         )
         mock_remove_plugin.assert_not_called()
 
@@ -238,15 +319,15 @@ class PluginsTest(CharmTest):
         finally:
             hookenv.config()["remove-unlisted-plugins"] = orig_remove_unlisted_plugins
 
-    @mock.patch("jenkins_plugin_manager.plugin.UpdateCenter.download_plugin")
+    @mock.patch("test_plugins.Plugins._download_plugin")
     @mock.patch("test_plugins.Plugins._get_latest_version")
-    @mock.patch("charms.layer.jenkins.api.Api.get_plugin_version")
+    @mock.patch("charms.layer.jenkins.api.Api.get_installed_plugins")
     @mock.patch("test_plugins.Plugins._get_plugins_to_install")
     def test_install_already_installed(
         self,
         mock_get_plugins_to_install,
+        mock_get_installed_plugins,
         mock_get_latest_version,
-        mock_get_plugin_version,
         mock_download_plugin,
         mock_restart_jenkins,
     ):
@@ -255,16 +336,23 @@ class PluginsTest(CharmTest):
         """
         plugin_name = "plugin"
         mock_get_plugins_to_install.return_value = {plugin_name}, {}
-        mock_get_plugin_version.return_value = "1"
+        mock_get_installed_plugins.return_value = {plugin_name: {"version": "1"}}
         mock_get_latest_version.return_value = "1"
         orig_remove_unlisted_plugins = hookenv.config()["remove-unlisted-plugins"]
+        orig_plugins_auto_update = hookenv.config()["plugins-auto-update"]
         try:
             hookenv.config()["remove-unlisted-plugins"] = "yes"
             hookenv.config()["plugins-auto-update"] = False
             self.plugins.install(plugin_name)
             mock_download_plugin.assert_not_called()
+            # Nothing changed, so there's no need to restart
+            mock_restart_jenkins.assert_not_called()
+            self.assertEqual(
+                "INFO: Plugins are unchanged, not restarting jenkins", self.fakes.juju.log[-1]
+            )
         finally:
             hookenv.config()["remove-unlisted-plugins"] = orig_remove_unlisted_plugins
+            hookenv.config()["plugins-auto-update"] = orig_plugins_auto_update
 
     def test_install_bad_plugin(self, mock_restart_jenkins):
         """
@@ -280,14 +368,14 @@ class PluginsTest(CharmTest):
         finally:
             hookenv.config()["remove-unlisted-plugins"] = orig_remove_unlisted_plugins
 
-    @mock.patch("jenkins_plugin_manager.plugin.UpdateCenter.download_plugin")
+    @mock.patch("test_plugins.Plugins._download_plugin")
     @mock.patch("test_plugins.Plugins._get_latest_version")
-    @mock.patch("charms.layer.jenkins.api.Api.get_plugin_version")
+    @mock.patch("charms.layer.jenkins.api.Api.get_installed_plugins")
     @mock.patch("test_plugins.Plugins._get_plugins_to_install")
     def test_install_fail(
         self,
         mock_get_plugins_to_install,
-        mock_get_plugin_version,
+        mock_get_installed_plugins,
         mock_get_latest_version,
         mock_download_plugin,
         mock_restart_jenkins,
@@ -295,23 +383,142 @@ class PluginsTest(CharmTest):
         """If a plugin is already installed, it doesn't get downloaded."""
         plugin_name = "plugin"
         mock_get_plugins_to_install.return_value = {plugin_name}, {}
-        mock_get_plugin_version.return_value = False
+        mock_get_installed_plugins.return_value = {}
         mock_get_latest_version.return_value = "1"
-        mock_download_plugin.return_value = False
+        mock_download_plugin.side_effect = requests.exceptions.ConnectionError("boom")
         hookenv.config()["remove-unlisted-plugins"] = "yes"
         self.plugins.install(plugin_name)
-        self.assertEqual("INFO: Failed to download plugin", self.fakes.juju.log[-1])
+        self.assertIn("INFO: Failed to download plugin: boom", self.fakes.juju.log)
+        mock_restart_jenkins.assert_not_called()
+
+    @mock.patch("charms.layer.jenkins.plugins.hookenv.status_set")
+    @mock.patch("test_plugins.Plugins._get_plugin_info")
+    def test_download_plugins(
+        self, mock_get_plugin_info, mock_status_set, mock_restart_jenkins
+    ):
+        """
+        Plugins are downloaded concurrently, transient failures are retried
+        and progress is reported in the unit status.
+        """
+        mock_get_plugin_info.side_effect = lambda plugin: {"url": "http://x/%s.hpi" % plugin}
+        self.fakes.network.get("http://x/one.hpi", content=b"one")
+        self.fakes.network.get(
+            "http://x/two.hpi", [{"status_code": 503}, {"content": b"two"}]
+        )
+        plugin_paths = self.plugins._download_plugins(["one", "two"])
+        one = os.path.join(paths.PLUGINS, "one.jpi")
+        two = os.path.join(paths.PLUGINS, "two.jpi")
+        self.assertEqual({one, two}, plugin_paths)
+        self.assertThat(one, FileContains("one"))
+        self.assertThat(two, FileContains("two"))
+        self.assertThat(two + ".part", Not(PathExists()))
+        mock_status_set.assert_called_with("maintenance", "Downloading plugins (2/2)")
+
+    @mock.patch("test_plugins.Plugins._get_plugin_info")
+    @mock.patch("charms.layer.jenkins.api.Api.version")
+    def test_seed(self, mock_jenkins_version, mock_get_plugin_info, mock_restart_jenkins):
+        """
+        Plugins are seeded against the given Jenkins version, without asking
+        the API or restarting Jenkins, and incompatible ones are returned.
+        """
+        update_center = {
+            "one": {"url": "http://x/one.hpi", "requiredCore": "2.200", "dependencies": []},
+            "two": {"url": "http://x/two.hpi", "requiredCore": "2.300", "dependencies": []},
+        }
+        mock_get_plugin_info.side_effect = lambda plugin: update_center[plugin]
+        self.fakes.network.get("http://x/one.hpi", content=b"one")
+        with mock.patch("charms.layer.jenkins.plugins.REQUIRED_PLUGINS", []):
+            incompatible = self.plugins.seed("one two", "2.204")
+        self.assertEqual({"two"}, set(incompatible))
+        self.assertThat(os.path.join(paths.PLUGINS, "one.jpi"), FileContains("one"))
+        self.assertThat(os.path.join(paths.PLUGINS, "two.jpi"), Not(PathExists()))
+        mock_jenkins_version.assert_not_called()
+        mock_restart_jenkins.assert_not_called()
+
+    @mock.patch("test_plugins.Plugins._get_plugin_info")
+    def test_prefetch(self, mock_get_plugin_info, mock_restart_jenkins):
+        """
+        Plugins and their required dependencies are downloaded into the cache
+        only, whatever Jenkins version they need.
+        """
+        data = {"one": b"one", "two": b"two"}
+        update_center = {
+            "one": {
+                "url": "http://x/one.hpi",
+                "sha256": base64.b64encode(hashlib.sha256(b"one").digest()).decode("ascii"),
+                "dependencies": [
+                    {"name": "two", "optional": False},
+                    {"name": "three", "optional": True},
+                ],
+            },
+            "two": {
+                "url": "http://x/two.hpi",
+                "sha256": base64.b64encode(hashlib.sha256(b"two").digest()).decode("ascii"),
+                "requiredCore": "9999",
+                "dependencies": [],
+            },
+        }
+        mock_get_plugin_info.side_effect = lambda plugin: update_center[plugin]
+        for plugin in data:
+            self.fakes.network.get("http://x/%s.hpi" % plugin, content=data[plugin])
+        with mock.patch("charms.layer.jenkins.plugins.REQUIRED_PLUGINS", []):
+            self.assertEqual(2, self.plugins.prefetch("one"))
+        self.assertEqual([], os.listdir(paths.PLUGINS))
+        self.plugins._download_plugins(["one", "two"])
+        self.assertThat(os.path.join(paths.PLUGINS, "two.jpi"), FileContains("two"))
+        self.assertEqual(
+            2, len([r for r in self.fakes.network.request_history if r.url.startswith("http://x/")])
+        )
+
+    @mock.patch("test_plugins.Plugins._get_plugin_info")
+    def test_download_plugins_cache(self, mock_get_plugin_info, mock_restart_jenkins):
+        """
+        Downloads are verified against the published sha256 and cached, so
+        the same file is not downloaded twice.
+        """
+        sha256 = base64.b64encode(hashlib.sha256(b"data").digest()).decode("ascii")
+        mock_get_plugin_info.return_value = {"url": "http://x/one.hpi", "sha256": sha256}
+        self.fakes.network.get("http://x/one.hpi", content=b"data")
+        plugin_path = os.path.join(paths.PLUGINS, "one.jpi")
+        self.plugins._download_plugins(["one"])
+        os.remove(plugin_path)
+        self.plugins._download_plugins(["one"])
+        self.assertThat(plugin_path, FileContains("data"))
+        requests_made = [
+            request
+            for request in self.fakes.network.request_history
+            if request.url == "http://x/one.hpi"
+        ]
+        self.assertEqual(1, len(requests_made))
+
+    @mock.patch("test_plugins.Plugins._get_plugin_info")
+    def test_download_plugins_bad_checksum(self, mock_get_plugin_info, mock_restart_jenkins):
+        """Downloads not matching the published sha256 are discarded."""
+        sha256 = base64.b64encode(hashlib.sha256(b"data").digest()).decode("ascii")
+        mock_get_plugin_info.return_value = {"url": "http://x/one.hpi", "sha256": sha256}
+        self.fakes.network.get("http://x/one.hpi", content=b"corrupted")
+        self.assertEqual(set(), self.plugins._download_plugins(["one"]))
+        self.assertThat(os.path.join(paths.PLUGINS, "one.jpi"), Not(PathExists()))
+        self.assertIn("Checksum mismatch", self.fakes.juju.log[-1])
+
+    def test_download_no_plugins(self, mock_restart_jenkins):
+        """Nothing is downloaded if no plugin needs to be installed."""
+        self.assertEqual(set(), self.plugins._download_plugins([]))
 
     def test_using_json_from_plugin_site(self, mock_restart_jenkins):
         """
         If the configured plugin-site has an update-center.json file,
         it should be used instead of the default one.
         """
-        self.plugins = Plugins()
+        self.fakes.network.get(
+            "https://updates.jenkins.io/stable//update-center.json",
+            text='updateCenter.post(\n{"plugins": {"git": {"version": "1"}}}\n);',
+        )
         orig_plugins_site = hookenv.config()["plugins-site"]
         try:
             hookenv.config()["plugins-site"] = "https://updates.jenkins.io/stable/"
             self.plugins = Plugins()
+            self.assertEqual("1", self.plugins._get_latest_version("git"))
         finally:
             hookenv.config()["plugins-site"] = orig_plugins_site
 
@@ -320,10 +527,13 @@ class PluginsTest(CharmTest):
         If the configured plugin-site has no update-center.json file,
         it should error.
         """
+        self.fakes.network.get(
+            "https://updates.jenkins.io/not-valid//update-center.json", status_code=404
+        )
         orig_plugins_site = hookenv.config()["plugins-site"]
         try:
             hookenv.config()["plugins-site"] = "https://updates.jenkins.io/not-valid/"
-            self.assertRaises(Exception, Plugins)
+            self.assertRaises(PluginSiteError, Plugins)
         finally:
             hookenv.config()["plugins-site"] = orig_plugins_site
 
@@ -333,38 +543,85 @@ class PluginsTest(CharmTest):
         self.plugins._get_required_jenkins(plugin_name)
         mock_get_plugin_info.assert_called_with(plugin_name)
 
-    @mock.patch("jenkins_plugin_manager.plugin.UpdateCenter.get_plugins")
-    @mock.patch("test_plugins.Plugins._get_required_jenkins")
+    @mock.patch("test_plugins.Plugins._get_plugin_info")
     @mock.patch("charms.layer.jenkins.api.Api.version")
     def test__get_plugins_to_install(
         self,
         mock_jenkins_version,
-        mock_get_required_jenkins,
-        mock_get_plugins,
+        mock_get_plugin_info,
         mock_restart_jenkins,
     ):
         """
         When getting plugins to install all incompatible plugins will be
         removed from the list and returned separately.
         """
-        plugins = ["plugin_one", "plugin_two"]
-        plugins_dependencies = ["plugin_three"]
+        update_center = {
+            "plugin_one": {"requiredCore": "2.204", "dependencies": []},
+            "plugin_two": {
+                "requiredCore": "2.203",
+                "dependencies": [{"name": "plugin_four", "optional": False}],
+            },
+            "plugin_three": {
+                "requiredCore": "2.203",
+                "dependencies": [{"name": "plugin_five", "optional": False}],
+            },
+            "plugin_four": {"requiredCore": "2.203", "dependencies": []},
+            "plugin_five": {"requiredCore": "2.203.1", "dependencies": []},
+        }
+        mock_jenkins_version.return_value = "2.203"
+        mock_get_plugin_info.side_effect = lambda plugin: update_center[plugin]
 
-        def side_effect(value):
-            if value == "plugin_one":
-                return "2.204"
-            if value == "plugin_two":
-                return "2.203"
-            if value == "plugin_three":
-                return "2.203.1"
+        compatible_plugins, incompatible_plugins = self.plugins._get_plugins_to_install(
+            ["plugin_one", "plugin_two", "plugin_three"]
+        )
+        # Dependencies come first.
+        self.assertEqual(["plugin_four", "plugin_two"], compatible_plugins)
+        # Plugins depending on incompatible ones are incompatible too.
+        self.assertEqual(["plugin_one", "plugin_five", "plugin_three"], incompatible_plugins)
 
+        # Resolving again reuses what is already known.
+        mock_jenkins_version.reset_mock()
+        self.assertEqual(
+            (["plugin_four", "plugin_two"], []), self.plugins._get_plugins_to_install(["plugin_two"])
+        )
+        mock_jenkins_version.assert_not_called()
+
+    @mock.patch("test_plugins.Plugins._get_plugin_info")
+    @mock.patch("charms.layer.jenkins.api.Api.version")
+    def test__get_plugins_to_install_optional(
+        self,
+        mock_jenkins_version,
+        mock_get_plugin_info,
+        mock_restart_jenkins,
+    ):
+        """
+        Optional dependencies are only installed when requested, and then
+        before the plugins depending on them. Dependency cycles are tolerated.
+        """
+        update_center = {
+            "plugin_one": {
+                "requiredCore": "2.203",
+                "dependencies": [
+                    {"name": "plugin_two", "optional": True},
+                    {"name": "plugin_three", "optional": True},
+                ],
+            },
+            "plugin_two": {
+                "requiredCore": "2.203",
+                "dependencies": [{"name": "plugin_one", "optional": False}],
+            },
+            "plugin_three": {"requiredCore": "2.203", "dependencies": []},
+        }
         mock_jenkins_version.return_value = "2.203"
-        mock_get_plugins.return_value = plugins + plugins_dependencies
-        mock_get_required_jenkins.side_effect = side_effect
+        mock_get_plugin_info.side_effect = lambda plugin: update_center[plugin]
 
-        compatible_plugins, incompatible_plugins = self.plugins._get_plugins_to_install(plugins)
-        self.assertEqual(["plugin_two"], compatible_plugins)
-        self.assertEqual(["plugin_one", "plugin_three"], incompatible_plugins)
+        self.assertEqual(
+            (["plugin_one"], []), self.plugins._get_plugins_to_install(["plugin_one"])
+        )
+        self.assertEqual(
+            (["plugin_two", "plugin_one"], []),
+            self.plugins._get_plugins_to_install(["plugin_one", "plugin_two"]),
+        )
 
     @mock.patch("shutil.chown")
     def test__backup_restore_clean(self, mock_shutil_chown, mock_restart_jenkins):
@@ -0,0 +1,41 @@
+import time
+
+from unittest import mock
+
+from charmhelpers.core import hookenv
+
+from charmtest import CharmTest
+
+from charms.layer.jenkins.prefetch import Prefetch
+
+
+class PrefetchTest(CharmTest):
+
+    def setUp(self):
+        super(PrefetchTest, self).setUp()
+        self.packages = mock.Mock()
+        self.prefetch = Prefetch(packages=self.packages)
+
+    @mock.patch("charms.layer.jenkins.prefetch.Plugins")
+    def test_run(self, mock_plugins):
+        """
+        The dependencies, the Jenkins package and the plugins are all
+        prefetched, and the time saved by overlapping them is logged.
+        """
+        self.packages.prefetch_dependencies.side_effect = lambda: time.sleep(3)
+        self.packages.prefetch_jenkins.side_effect = lambda: time.sleep(2)
+        self.prefetch.run()
+        self.packages.prefetch_dependencies.assert_called_once_with()
+        self.packages.prefetch_jenkins.assert_called_once_with()
+        mock_plugins.return_value.prefetch.assert_called_once_with(
+            hookenv.config()["plugins"])
+        self.assertIn("Prefetched dependencies", self.fakes.juju.log[-1])
+
+    @mock.patch("charms.layer.jenkins.prefetch.Plugins")
+    def test_run_failure(self, mock_plugins):
+        """A failed download doesn't stop the others."""
+        self.packages.prefetch_jenkins.side_effect = Exception("boom")
+        self.prefetch.run()
+        self.packages.prefetch_dependencies.assert_called_once_with()
+        mock_plugins.return_value.prefetch.assert_called_once_with(mock.ANY)
+        self.assertIn("WARNING: Prefetch failed, continuing: boom", self.fakes.juju.log)
@@ -0,0 +1,159 @@
+import os
+import subprocess
+import time
+
+from unittest import mock
+
+import requests
+
+from fixtures import MonkeyPatch
+
+from charmtest import CharmTest
+
+from charms.layer.jenkins import paths
+from charms.layer.jenkins.readiness import (
+    READY_MARKER,
+    Readiness,
+    ServiceUnavailable,
+)
+
+URL = "http://localhost:8080/"
+
+
+class ReadinessTest(CharmTest):
+
+    def setUp(self):
+        super().setUp()
+        self.readiness = Readiness(URL)
+
+    def test_timeout_default(self):
+        """
+        The timeout defaults to the startup-timeout config option.
+        """
+        self.assertEqual(300, self.readiness._timeout)
+
+    def test_wait_ready(self):
+        """
+        If Jenkins answers right away, a single probe is made.
+        """
+        self.fakes.network.head(URL, status_code=403)
+        self.readiness.wait()
+        self.assertEqual(1, self.fakes.network.call_count)
+
+    def test_wait_backoff(self):
+        """
+        Probes back off exponentially until Jenkins is ready.
+        """
+        start = time.time()
+        probes = []
+
+        def callback(request, context):
+            probes.append(time.time() - start)
+            context.status_code = 503 if len(probes) < 4 else 200
+            return ""
+
+        self.fakes.network.head(URL, text=callback)
+        self.readiness.wait()
+        self.assertEqual([0, 0.5, 1.5, 3.5], probes)
+
+    def test_wait_connection_error(self):
+        """
+        Connection errors mean Jenkins is not ready yet.
+        """
+        self.readiness = Readiness(URL, timeout=5)
+        self.fakes.network.head(URL, exc=requests.ConnectionError)
+        self.assertRaises(ServiceUnavailable, self.readiness.wait)
+
+    def test_wait_unavailable(self):
+        """
+        If Jenkins isn't ready by the deadline, an error is raised.
+        """
+        self.fakes.network.head(URL, status_code=500)
+        start = time.time()
+        self.assertRaises(ServiceUnavailable, self.readiness.wait)
+        self.assertEqual(300, time.time() - start)
+
+    def test_wait_marker(self):
+        """
+        If the log reports Jenkins as up, waiting stops without probing again.
+        """
+        self.fakes.network.head(URL, status_code=503)
+        read, write = os.pipe()
+        follower = subprocess.Popen(
+            ["cat"], stdin=read, stdout=subprocess.PIPE, bufsize=0)
+        os.close(read)
+        os.write(write, b"Starting\n" + READY_MARKER.encode() + b"\n")
+        self.useFixture(MonkeyPatch(
+            "charms.layer.jenkins.readiness.Readiness._follow_log",
+            lambda _: follower))
+        self.readiness.wait()
+        os.close(write)
+        self.assertEqual(1, self.fakes.network.call_count)
+        self.assertIsNotNone(follower.returncode)
+
+    def test_wait_follower_exited(self):
+        """
+        If the log follower exits, probing carries on.
+        """
+        self.readiness = Readiness(URL, timeout=1)
+        self.fakes.network.head(URL, status_code=503)
+        follower = subprocess.Popen(["true"], stdout=subprocess.PIPE, bufsize=0)
+        self.useFixture(MonkeyPatch(
+            "charms.layer.jenkins.readiness.Readiness._follow_log",
+            lambda _: follower))
+        self.assertRaises(ServiceUnavailable, self.readiness.wait)
+
+    def test_wait_marker_timeout(self):
+        """
+        Waiting for the marker lasts until the timeout if nothing is logged.
+        """
+        read, write = os.pipe()
+        self.addCleanup(os.close, read)
+        self.addCleanup(os.close, write)
+        follower = mock.Mock(stdout=os.fdopen(read, "rb", buffering=0, closefd=False))
+        start = time.time()
+        self.assertFalse(self.readiness._wait_for_marker(follower, 2))
+        self.assertEqual(2, time.time() - start)
+
+    def test_follow_log_file(self):
+        """
+        The log file is followed when the package writes one.
+        """
+        os.makedirs(os.path.dirname(paths.LOG_FILE))
+        with open(paths.LOG_FILE, "w"):
+            pass
+        commands = []
+        self.fakes.processes.add(
+            lambda proc_args: commands.append(proc_args["args"]) or {}, name="tail")
+        self.assertIsNotNone(self.readiness._follow_log())
+        self.assertEqual([["tail", "-F", "-n", "0", paths.LOG_FILE]], commands)
+
+    def test_follow_log_journal(self):
+        """
+        The journal is followed when the package ships a systemd unit.
+        """
+        commands = []
+        self.fakes.processes.add(
+            lambda proc_args: commands.append(proc_args["args"]) or {}, name="journalctl")
+        with mock.patch("os.path.exists", lambda path: path.endswith(".service")):
+            self.assertIsNotNone(self.readiness._follow_log())
+        self.assertEqual(["journalctl", "-u", "jenkins"], commands[0][:3])
+
+    def test_follow_log_missing(self):
+        """
+        Nothing is followed if no log can be found.
+        """
+        self.assertIsNone(self.readiness._follow_log())
+
+    def test_follow_log_error(self):
+        """
+        Failures to start the follower are logged and ignored.
+        """
+        def tail(proc_args):
+            raise OSError("boom")
+
+        self.fakes.processes.add(tail, name="tail")
+        with mock.patch("os.path.exists", lambda path: True):
+            self.assertIsNone(self.readiness._follow_log())
+        self.assertIn(
+            "Can't follow the Jenkins log: boom", self.fakes.juju.log[-1])
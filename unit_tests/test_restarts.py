@@ -0,0 +1,102 @@
+import subprocess
+
+from unittest import mock
+
+from fixtures import MonkeyPatch
+
+from charmtest import CharmTest
+
+from charms.layer.jenkins.restarts import (
+    RELOAD,
+    RESTART,
+    Restarts,
+)
+
+# The real subprocess.call(), which hookenv.log() uses to run juju-log.
+CALL = subprocess.call
+
+
+@mock.patch("charms.layer.jenkins.api.Api.wait")
+@mock.patch("charms.layer.jenkins.api.Api.reload")
+@mock.patch("charms.layer.jenkins.api.Api.restart")
+@mock.patch("charms.layer.jenkins.restarts.service_restart")
+@mock.patch("charms.layer.jenkins.restarts.subprocess.call")
+@mock.patch("charms.layer.jenkins.restarts.hookenv.atexit")
+class RestartsTest(CharmTest):
+
+    def setUp(self):
+        super(RestartsTest, self).setUp()
+        self.useFixture(MonkeyPatch(
+            "charms.layer.jenkins.restarts._pending",
+            {"action": None, "daemon_reload": False, "reasons": [], "scheduled": False,
+             "while_stopped": []}))
+        self.restarts = Restarts()
+
+    def test_nothing_requested(
+            self, mock_atexit, mock_call, mock_service_restart, mock_restart,
+            mock_reload, mock_wait):
+        """If nothing was requested, flushing is a no-op."""
+        self.assertIsNone(self.restarts.flush())
+        mock_atexit.assert_not_called()
+        mock_restart.assert_not_called()
+        mock_reload.assert_not_called()
+
+    def test_reloads_coalesced(
+            self, mock_atexit, mock_call, mock_service_restart, mock_restart,
+            mock_reload, mock_wait):
+        """Several reload requests result in a single reload at exit."""
+        self.restarts.request_reload("one")
+        Restarts().request_reload("two")
+        mock_atexit.assert_called_once_with(self.restarts.flush)
+        self.assertEqual(RELOAD, self.restarts.flush())
+        mock_reload.assert_called_once_with()
+        mock_restart.assert_not_called()
+        self.assertIsNone(self.restarts.pending())
+
+    def test_restart_supersedes_reload(
+            self, mock_atexit, mock_call, mock_service_restart, mock_restart,
+            mock_reload, mock_wait):
+        """A restart supersedes a reload, whatever the order of requests."""
+        self.restarts.request_restart("one")
+        self.restarts.request_reload("two")
+        self.assertEqual(RESTART, self.restarts.pending())
+        self.restarts.flush()
+        mock_restart.assert_called_once_with()
+        mock_reload.assert_not_called()
+        mock_service_restart.assert_not_called()
+
+    def test_daemon_reload(
+            self, mock_atexit, mock_call, mock_service_restart, mock_restart,
+            mock_reload, mock_wait):
+        """If the systemd unit changed, systemd is reloaded and the service restarted."""
+        mock_call.side_effect = lambda args, **kwargs: (
+            0 if args[0] == "systemctl" else CALL(args, **kwargs))
+        self.restarts.request_restart("one")
+        self.restarts.request_restart("two", daemon_reload=True)
+        self.restarts.flush()
+        daemon_reloads = [
+            call for call in mock_call.call_args_list
+            if call == mock.call(["systemctl", "daemon-reload"])]
+        self.assertEqual(1, len(daemon_reloads))
+        mock_service_restart.assert_called_once_with("jenkins")
+        mock_restart.assert_not_called()
+        mock_wait.assert_called_once_with()
+        self.assertEqual(
+            "INFO: Performing a Jenkins restart: one; two", self.fakes.juju.log[-1])
+
+    @mock.patch("charms.layer.jenkins.restarts.service_start")
+    @mock.patch("charms.layer.jenkins.restarts.service_stop")
+    def test_while_stopped(
+            self, mock_service_stop, mock_service_start, mock_atexit, mock_call,
+            mock_service_restart, mock_restart, mock_reload, mock_wait):
+        """Callbacks run while Jenkins is stopped, between stop and start."""
+        calls = []
+        mock_service_stop.side_effect = lambda service: calls.append("stop")
+        mock_service_start.side_effect = lambda service: calls.append("start")
+        self.restarts.run_while_stopped(lambda: calls.append("swap"))
+        self.restarts.request_restart("one")
+        self.restarts.flush()
+        self.assertEqual(["stop", "swap", "start"], calls)
+        mock_service_restart.assert_not_called()
+        mock_restart.assert_not_called()
+        mock_wait.assert_called_once_with()
@@ -0,0 +1,98 @@
+import os
+import subprocess
+
+from unittest import mock
+
+from testtools.matchers import Contains, FileContains, FileExists, Not
+
+from charmtest import CharmTest
+
+from charms.layer.jenkins import paths
+from charms.layer.jenkins.seed import POLICY_RC_D, Seed
+
+
+class SeedTest(CharmTest):
+
+    def setUp(self):
+        super(SeedTest, self).setUp()
+        self.fakes.fs.add(os.path.dirname(paths.POLICY_RC_D))
+        os.makedirs(os.path.dirname(paths.POLICY_RC_D))
+        self.seed = Seed()
+
+    def test_block_start(self):
+        """
+        A policy-rc.d denying service starts is installed, until Jenkins is
+        started.
+        """
+        self.assertFalse(self.seed.start_blocked())
+        self.assertTrue(self.seed.block_start())
+        self.assertThat(paths.POLICY_RC_D, FileContains(matcher=Contains("exit 101")))
+        self.assertTrue(self.seed.start_blocked())
+        # Blocking again is fine.
+        self.assertTrue(self.seed.block_start())
+
+        with mock.patch("subprocess.call") as mock_call:
+            with mock.patch("charmhelpers.core.host.service_start") as mock_start:
+                self.seed.start()
+        # hookenv.log() goes through subprocess.call() too, calling juju-log.
+        self.assertIn(mock.call(["systemctl", "daemon-reload"]), mock_call.call_args_list)
+        mock_start.assert_called_once_with("jenkins")
+        self.assertThat(paths.POLICY_RC_D, Not(FileExists()))
+        self.assertFalse(self.seed.start_blocked())
+
+    def test_block_start_only_jenkins(self):
+        """
+        The policy-rc.d only denies starting jenkins, other packages
+        installed meanwhile can start their services.
+        """
+        def policy(service):
+            return subprocess.call(["sh", "-c", POLICY_RC_D, "policy-rc.d", service])
+
+        self.assertEqual(101, policy("jenkins"))
+        self.assertEqual(0, policy("ssh"))
+
+    def test_block_start_foreign_policy(self):
+        """
+        A policy-rc.d set up by someone else is left alone, and Jenkins is
+        not seeded.
+        """
+        with open(paths.POLICY_RC_D, "w") as fd:
+            fd.write("#!/bin/sh\nexit 0\n")
+        self.assertFalse(self.seed.block_start())
+        self.assertFalse(self.seed.start_blocked())
+        self.assertThat(paths.POLICY_RC_D, FileContains("#!/bin/sh\nexit 0\n"))
+
+    @mock.patch("charms.layer.jenkins.plugins.Plugins.seed")
+    @mock.patch("charms.layer.jenkins.plugins.Plugins.__init__", return_value=None)
+    @mock.patch("charms.layer.jenkins.users.Users.seed_admin")
+    @mock.patch("charms.layer.jenkins.configuration.Configuration.install_helper")
+    @mock.patch("charms.layer.jenkins.configuration.Configuration.set_update_center")
+    @mock.patch("charms.layer.jenkins.configuration.Configuration.configure_proxy")
+    @mock.patch("charms.layer.jenkins.configuration.Configuration.set_url")
+    @mock.patch("charms.layer.jenkins.configuration.Configuration.bootstrap")
+    def test_seed(self, mock_bootstrap, mock_set_url, mock_configure_proxy,
+                  mock_set_update_center, mock_install_helper, mock_seed_admin,
+                  mock_plugins_init, mock_plugins_seed):
+        """
+        Seeding writes the configuration without touching the (not yet
+        running) Jenkins, then the admin user and the plugins.
+        """
+        mock_bootstrap.return_value = True
+        mock_plugins_seed.return_value = ["too-new"]
+        self.assertEqual(["too-new"], self.seed.seed("2.346.1"))
+        mock_set_url.assert_called_once_with()
+        mock_configure_proxy.assert_called_once_with(live=False)
+        mock_set_update_center.assert_called_once_with(live=False)
+        mock_install_helper.assert_called_once_with()
+        mock_seed_admin.assert_called_once_with("2.346.1")
+        mock_plugins_seed.assert_called_once_with("", "2.346.1")
+
+    @mock.patch("charms.layer.jenkins.users.Users.seed_admin")
+    @mock.patch("charms.layer.jenkins.configuration.Configuration.bootstrap")
+    def test_seed_invalid_config(self, mock_bootstrap, mock_seed_admin):
+        """
+        Nothing else is seeded if the configuration is invalid.
+        """
+        mock_bootstrap.return_value = False
+        self.assertIsNone(self.seed.seed("2.346.1"))
+        mock_seed_admin.assert_not_called()
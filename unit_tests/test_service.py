@@ -19,7 +19,7 @@ class ServiceTest(CharmTest):
         """
         If the service is ready, no exception is raised.
         """
-        self.fakes.network.get("http://localhost:8080", status_code=403)
+        self.fakes.network.head("http://localhost:8080", status_code=403)
         self.assertIsNone(self.service.check_ready())
 
     def test_check_ready_transient_failure(self):
@@ -29,14 +29,14 @@ class ServiceTest(CharmTest):
         start = time.time()
 
         def callback(requests, context):
-            if time.time() - start >= 2:
+            if time.time() - start < 2:
                 context.status_code = 503
             else:
                 context.status_code = 200
             return ""
 
         api = Api()
-        self.fakes.network.get(api.url, text=callback)
+        self.fakes.network.head(api.url, text=callback)
         self.assertIsNone(self.service.check_ready())
 
     def test_check_ready_unavailable(self):
@@ -44,5 +44,5 @@ class ServiceTest(CharmTest):
         If the backend keeps returning 5xx, an error is raised.
         """
         api = Api()
-        self.fakes.network.get(api.url, status_code=500)
+        self.fakes.network.head(api.url, status_code=500)
         self.assertRaises(ServiceUnavailable, self.service.check_ready)
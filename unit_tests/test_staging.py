@@ -0,0 +1,100 @@
+import os
+import zipfile
+
+from testtools.matchers import (
+    DirExists,
+    FileContains,
+    FileExists,
+    Not,
+    PathExists,
+)
+
+from charmtest import CharmTest
+
+from charms.layer.jenkins import paths
+from charms.layer.jenkins.staging import PluginStaging
+
+
+class PluginStagingTest(CharmTest):
+
+    def setUp(self):
+        super(PluginStagingTest, self).setUp()
+        self.fakes.fs.add(paths.HOME)
+        os.makedirs(paths.PLUGINS)
+        self.fakes.users.add("jenkins", 123)
+        self.fakes.groups.add("jenkins", 123)
+        self.staging = PluginStaging()
+        self.staging.prepare()
+
+    def _make_plugin(self, name, entries):
+        path = os.path.join(self.staging.directory, "%s.jpi" % name)
+        with open(path, "wb") as fd, zipfile.ZipFile(fd, "w") as plugin:
+            for entry, data in entries.items():
+                plugin.writestr(entry, data)
+        return path
+
+    def test_explode(self):
+        """
+        Plugins are exploded like Jenkins does, classes being packed into
+        classes.jar, and marked as such.
+        """
+        archive = self._make_plugin("one", {
+            "META-INF/MANIFEST.MF": "Short-Name: one\n",
+            "WEB-INF/lib/one.jar": "jar",
+            "WEB-INF/classes/one/Plugin.class": "class",
+        })
+        self.staging.explode([archive])
+        exploded = os.path.join(self.staging.directory, "one")
+        self.assertThat(os.path.join(exploded, "WEB-INF/lib/one.jar"), FileContains("jar"))
+        self.assertThat(os.path.join(exploded, "WEB-INF/classes"), Not(PathExists()))
+        with open(os.path.join(exploded, "WEB-INF/lib/classes.jar"), "rb") as fd:
+            with zipfile.ZipFile(fd) as jar:
+                self.assertEqual(b"class", jar.read("one/Plugin.class"))
+        marker = os.path.join(exploded, ".timestamp2")
+        self.assertEqual(os.stat(archive).st_mtime, os.stat(marker).st_mtime)
+
+    def test_explode_invalid(self):
+        """Archives that can't be exploded are left to Jenkins."""
+        archive = os.path.join(self.staging.directory, "one.jpi")
+        with open(archive, "w") as fd:
+            fd.write("data")
+        self.staging.explode([archive])
+        self.assertThat(os.path.join(self.staging.directory, "one"), Not(PathExists()))
+        self.assertIn("Not exploding one.jpi", self.fakes.juju.log[-1])
+
+    def test_swap_in(self):
+        """Staged plugins are moved in, exploded directory first."""
+        archive = self._make_plugin("one", {"WEB-INF/lib/one.jar": "jar"})
+        self.staging.explode([archive])
+        target = os.path.join(paths.PLUGINS, "one.jpi")
+        self.assertEqual({target}, self.staging.swap_in([archive]))
+        self.assertThat(target, FileExists())
+        exploded = os.path.join(paths.PLUGINS, "one")
+        self.assertThat(os.path.join(exploded, "WEB-INF/lib/one.jar"), FileContains("jar"))
+        self.assertThat(os.path.join(exploded, ".timestamp2"), FileExists())
+        self.staging.cleanup()
+        self.assertThat(self.staging.directory, Not(DirExists()))
+
+    def test_swap_in_update(self):
+        """
+        The exploded directory of an installed plugin, which a running
+        Jenkins may load classes from, is only replaced by swap_exploded().
+        """
+        old = os.path.join(paths.PLUGINS, "one")
+        os.makedirs(old)
+        with open(os.path.join(old, "loaded"), "w") as fd:
+            fd.write("")
+        archive = self._make_plugin("one", {"WEB-INF/lib/one.jar": "jar"})
+        self.staging.explode([archive])
+        target = os.path.join(paths.PLUGINS, "one.jpi")
+        self.assertEqual({target}, self.staging.swap_in([archive]))
+        self.assertThat(target, FileExists())
+        self.assertThat(os.path.join(old, "loaded"), FileExists())
+        self.assertThat(os.path.join(old, "WEB-INF"), Not(PathExists()))
+        self.staging.swap_exploded()
+        self.assertThat(os.path.join(old, "WEB-INF/lib/one.jar"), FileContains("jar"))
+        self.assertThat(os.path.join(old, "loaded"), Not(PathExists()))
+        # Jenkins doesn't explode the plugin again.
+        marker = os.path.join(old, ".timestamp2")
+        self.assertEqual(os.stat(target).st_mtime, os.stat(marker).st_mtime)
+        self.assertThat(self.staging.directory, Not(DirExists()))
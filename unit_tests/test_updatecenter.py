@@ -0,0 +1,105 @@
+import time
+
+from jenkins_plugin_manager.exceptions import InvalidPluginError
+from requests.exceptions import ConnectionError
+
+from charmtest import CharmTest
+
+from charms.layer.jenkins.updatecenter import (
+    PluginSiteError,
+    UpdateCenter,
+)
+
+URL = "http://x/update-center.json"
+
+
+class UpdateCenterTest(CharmTest):
+
+    def setUp(self):
+        super(UpdateCenterTest, self).setUp()
+        self.fakes.time.set()
+
+    def test_download(self):
+        """The document is downloaded and its plugins made available."""
+        self.fakes.network.get(URL, json={"plugins": {"git": {"version": "1"}}})
+        update_center = UpdateCenter(url=URL)
+        self.assertEqual({"version": "1"}, update_center.get_plugin_data("git"))
+
+    def test_jsonp(self):
+        """A document wrapped in a JSONP callback is unwrapped."""
+        self.fakes.network.get(URL, text='updateCenter.post(\n{"plugins": {}}\n);')
+        self.assertEqual({}, UpdateCenter(url=URL).plugins)
+
+    def test_unknown_plugin(self):
+        """Looking up a plugin that doesn't exist raises an error."""
+        self.fakes.network.get(URL, json={"plugins": {}})
+        update_center = UpdateCenter(url=URL)
+        self.assertRaises(InvalidPluginError, update_center.get_plugin_data, "foo")
+
+    def test_fresh_cache(self):
+        """A cached document younger than max_age is used without any request."""
+        self.fakes.network.get(URL, json={"plugins": {"git": {"version": "1"}}})
+        UpdateCenter(url=URL, max_age=60)
+        update_center = UpdateCenter(url=URL, max_age=60)
+        self.assertEqual(1, self.fakes.network.call_count)
+        self.assertEqual({"version": "1"}, update_center.get_plugin_data("git"))
+
+    def test_not_modified(self):
+        """A stale cached document is revalidated with a conditional GET."""
+        self.fakes.network.get(
+            URL,
+            [
+                {
+                    "json": {"plugins": {"git": {"version": "1"}}},
+                    "headers": {"ETag": '"abc"', "Last-Modified": "yesterday"},
+                },
+                {"status_code": 304},
+            ],
+        )
+        UpdateCenter(url=URL, max_age=60)
+        time.sleep(61)
+        update_center = UpdateCenter(url=URL, max_age=60)
+        request = self.fakes.network.request_history[-1]
+        self.assertEqual('"abc"', request.headers["If-None-Match"])
+        self.assertEqual("yesterday", request.headers["If-Modified-Since"])
+        self.assertEqual({"version": "1"}, update_center.get_plugin_data("git"))
+
+    def test_modified(self):
+        """A changed document replaces the cached one."""
+        self.fakes.network.get(
+            URL,
+            [
+                {"json": {"plugins": {"git": {"version": "1"}}}},
+                {"json": {"plugins": {"git": {"version": "2"}}}},
+            ],
+        )
+        UpdateCenter(url=URL, max_age=0)
+        update_center = UpdateCenter(url=URL, max_age=0)
+        self.assertEqual({"version": "2"}, update_center.get_plugin_data("git"))
+
+    def test_unreachable_with_cache(self):
+        """If the site can't be reached, a cached document is used."""
+        self.fakes.network.get(
+            URL,
+            [
+                {"json": {"plugins": {"git": {"version": "1"}}}},
+                {"exc": ConnectionError("boom")},
+            ],
+        )
+        UpdateCenter(url=URL, max_age=0)
+        update_center = UpdateCenter(url=URL, max_age=0)
+        self.assertEqual({"version": "1"}, update_center.get_plugin_data("git"))
+
+    def test_unreachable_without_cache(self):
+        """If the site can't be reached and nothing is cached, an error is raised."""
+        self.fakes.network.get(URL, exc=ConnectionError("boom"))
+        self.assertRaises(PluginSiteError, UpdateCenter, url=URL)
+
+    def test_not_found(self):
+        """If the site doesn't provide the document, an error is raised."""
+        self.fakes.network.get(URL, status_code=404)
+        self.assertRaises(PluginSiteError, UpdateCenter, url=URL)
+
+    def test_check_min_core_version(self):
+        self.assertTrue(UpdateCenter.check_min_core_version("2.203.1", "2.203"))
+        self.assertFalse(UpdateCenter.check_min_core_version("2.203", "2.203.1"))
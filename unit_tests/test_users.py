@@ -15,6 +15,7 @@ from charms.layer.jenkins.users import Users
 from charms.layer.jenkins.api import (
     GET_LEGACY_TOKEN_SCRIPT,
     UPDATE_PASSWORD_SCRIPT,
+    render_init_script,
 )
 
 from testing import JenkinsTest
@@ -28,7 +29,7 @@ class UsersTest(JenkinsTest):
     def setUp(self):
         super(UsersTest, self).setUp()
         self.useFixture(AptInstalledJenkins(self.fakes))
-        self.fakes.jenkins.scripts[GET_LEGACY_TOKEN_SCRIPT.format("admin")] = "abc\n"
+        self.fakes.jenkins.scripts[GET_LEGACY_TOKEN_SCRIPT] = "abc"
         self.apt = AptStub()
         self.packages = Packages(apt=self.apt)
         self.users = Users(packages=self.packages)
@@ -43,11 +44,12 @@ class UsersTest(JenkinsTest):
         try:
             config["password"] = "x"
 
-            script = UPDATE_PASSWORD_SCRIPT.format(username="admin", password="x")
-            self.fakes.jenkins.scripts[script] = ""
+            calls = []
+            self.fakes.jenkins.scripts[UPDATE_PASSWORD_SCRIPT] = calls.append
 
             self.users.configure_admin()
 
+            self.assertEqual([{"username": "admin", "password": "x"}], calls)
             self.assertThat(paths.ADMIN_PASSWORD, FileContains("x"))
             self.assertThat(paths.ADMIN_PASSWORD, HasOwnership(0, 0))
             self.assertThat(paths.ADMIN_PASSWORD, HasPermissions("0600"))
@@ -71,11 +73,35 @@ class UsersTest(JenkinsTest):
             config["password"] = ""
 
             self.apt._set_jenkins_version('2.120.1')
-            script = UPDATE_PASSWORD_SCRIPT.format(username="admin", password="z")
-            self.fakes.jenkins.scripts[script] = ""
+            calls = []
+            self.fakes.jenkins.scripts[UPDATE_PASSWORD_SCRIPT] = calls.append
 
             self.useFixture(MonkeyPatch("charmhelpers.core.host.pwgen", pwgen))
             self.users.configure_admin()
+            self.assertEqual([{"username": "admin", "password": "z"}], calls)
             self.assertThat(paths.ADMIN_PASSWORD, FileContains("z"))
         finally:
             config["password"] = orig_password
+
+    def test_seed_admin(self):
+        """
+        Before Jenkins first starts, the admin user is set up by a
+        self-deleting init script and the setup wizard is marked as done.
+        """
+        config = hookenv.config()
+        orig_password = config["password"]
+        try:
+            config["password"] = "x"
+            self.users.seed_admin("2.346.1")
+        finally:
+            config["password"] = orig_password
+
+        script = render_init_script(
+            UPDATE_PASSWORD_SCRIPT, {"username": "admin", "password": "x"},
+            paths.ADMIN_SEED_SCRIPT)
+        self.assertThat(paths.ADMIN_SEED_SCRIPT, FileContains(script))
+        self.assertThat(paths.ADMIN_SEED_SCRIPT, HasOwnership(123, 456))
+        self.assertThat(paths.ADMIN_SEED_SCRIPT, HasPermissions("0600"))
+        self.assertThat(paths.ADMIN_PASSWORD, FileContains("x"))
+        self.assertThat(paths.LAST_EXEC, FileContains("2.346.1\n"))
+        self.assertThat(paths.UPGRADE_WIZARD_STATE, FileContains("2.346.1\n"))